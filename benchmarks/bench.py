@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+
+import heapq
+import math
+import os
+from pathlib import Path
+import random
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from typing import List, Optional, Tuple
+
+import click
+
+from rschunks.hashing import available_hash_funcs, buffer_identity
+
+import librsync
+from lansync.chunk import calc_signature
+from lansync.common import NodeChunk
+from lansync.database import open_database
+from lansync.gossip import Rumors, pick_peers
+from lansync.models import Namespace, RootFolder, StoredNode, all_models
+from lansync.models import NodeChunk as NodeChunkModel
+from lansync.sync_action import delete_stored, download, priority_policy
+from lansync.util.file import (clone_file, copy_range, create_file_placeholder, hash_path, iter_folder, read_chunk,
+                               walk_folder, write_chunk)
+
+
+def measure(name: str, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<24} {elapsed:10.3f}s  {result}")
+    return result
+
+
+def make_tree(root: Path, files: int, files_per_folder: int, fanout: int) -> None:
+    folders = [root]
+    created = 0
+    while created < files:
+        folder = folders.pop(0)
+        for i in range(min(files_per_folder, files - created)):
+            with open(folder / f"f{i}", "wb") as f:
+                f.write(b"x")
+            created += 1
+        for i in range(fanout):
+            subfolder = folder / f"d{i}"
+            subfolder.mkdir()
+            folders.append(subfolder)
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option("--files", default=1000000, type=int)
+@click.option("--files-per-folder", default=100, type=int)
+@click.option("--fanout", default=4, type=int)
+@click.option("--workers", default=8, type=int)
+@click.option("--root", default=None, help="Reuse an existing tree instead of creating one")
+def walk(files: int, files_per_folder: int, fanout: int, workers: int, root: str):
+    """Compare iter_folder + Path.stat against the scandir walker."""
+    tree = Path(root) if root else Path(tempfile.mkdtemp(prefix="lansync-walk-"))
+    try:
+        if not root:
+            measure("make tree", lambda: make_tree(tree, files, files_per_folder, fanout))
+        measure("iter_folder + stat", lambda: sum(1 for p in iter_folder(tree) if p.stat()))
+        measure("walk_folder (1 worker)", lambda: sum(1 for _ in walk_folder(tree, max_workers=1)))
+        measure(
+            f"walk_folder ({workers} workers)",
+            lambda: sum(1 for _ in walk_folder(tree, max_workers=workers))
+        )
+    finally:
+        if not root:
+            shutil.rmtree(os.fspath(tree))
+
+
+@cli.command("hash")
+@click.option("--size", default=1024 * 1024, type=int, help="Buffer size, defaults to CHUNK_SIZE")
+@click.option("--total", default=256 * 1024 * 1024, type=int)
+def hash_(size: int, total: int):
+    """Hash throughput of each available algorithm on chunk sized buffers."""
+    data = os.urandom(size)
+    count = max(total // size, 1)
+    for name in available_hash_funcs():
+        start = time.perf_counter()
+        for _ in range(count):
+            buffer_identity(data, name)
+        elapsed = time.perf_counter() - start
+        print(f"{name:<24} {elapsed:10.3f}s  {size * count / elapsed / 2 ** 20:10.1f} MB/s")
+
+
+def simulate_schedule(actions, workers: int, latency: float, bandwidth: float) -> List[float]:
+    """Completion times of `actions` started in order on `workers` parallel lanes."""
+    lanes = [0.0] * workers
+    finished = []
+    for action in actions:
+        start = heapq.heappop(lanes)
+        end = start + latency + action.size / bandwidth
+        heapq.heappush(lanes, end)
+        finished.append(end)
+    return sorted(finished)
+
+
+@cli.command()
+@click.option("--files", default=100000, type=int)
+@click.option("--deletes", default=0.1, type=float, help="Share of delete actions")
+@click.option("--workers", default=8, type=int)
+@click.option("--latency", default=0.005, type=float, help="Fixed cost of an action in seconds")
+@click.option("--bandwidth", default=100 * 2 ** 20, type=float, help="Bytes per second per action")
+def priority(files: int, deletes: float, workers: int, latency: float, bandwidth: float):
+    """Simulated time to N% of files synced for each priority policy."""
+    random.seed(1)
+    actions = []
+    for i in range(files):
+        node = SimpleNamespace(key=hash_path(f"f{i}"), path=f"f{i}", size=int(random.lognormvariate(10, 3)))
+        if random.random() < deletes:
+            actions.append(delete_stored(SimpleNamespace(key=node.key, path=node.path, size=0)))
+        else:
+            actions.append(download(node, None))
+
+    milestones = (0.5, 0.9, 0.99, 1.0)
+    print(f"{'policy':<24}" + "".join(f"{m:>10.0%}" for m in milestones))
+    for name in ("key", "size"):
+        finished = simulate_schedule(sorted(actions, key=priority_policy(name)), workers, latency, bandwidth)
+        times = [finished[max(math.ceil(m * len(finished)), 1) - 1] for m in milestones]
+        print(f"{name:<24}" + "".join(f"{t:>9.1f}s" for t in times))
+
+
+@cli.command()
+@click.option("--counts", default="1000,10000,50000", help="Comma separated chunk counts")
+def manifest(counts: str):
+    """Per-chunk update_or_create against the bulk upsert of a node's chunk rows."""
+    with tempfile.TemporaryDirectory() as folder:
+        with open_database(os.path.join(folder, "bench.db"), models=all_models):
+            namespace = Namespace.create(name="bench")
+            root_folder = RootFolder.create(path=folder)
+
+            def store(count: int, bulk: bool) -> int:
+                node = StoredNode.create(
+                    namespace=namespace, root_folder=root_folder, key=f"{bulk}:{count}", path="f",
+                    local_modified_time=0, local_created_time=0, size=0, signature="",
+                )
+                chunks = [
+                    NodeChunk(offset=i * 1024, size=1024, hash=f"blake2b:{bulk:d}{count:08d}{i:022x}")
+                    for i in range(count)
+                ]
+                if bulk:
+                    NodeChunkModel.bulk_update_or_create(node, chunks)
+                else:
+                    for chunk in chunks:
+                        NodeChunkModel.update_or_create(node, chunk)
+                return count
+
+            for count in (int(c) for c in counts.split(",")):
+                measure(f"per_chunk[{count}]", lambda: store(count, bulk=False))
+                measure(f"bulk[{count}]", lambda: store(count, bulk=True))
+
+
+@cli.command()
+@click.option("--files", default=2000, type=int)
+@click.option("--size", default=64 * 1024, type=int)
+@click.option("--workers", default=8, type=int)
+def signature(files: int, size: int, workers: int):
+    """Signatures through a temp file against streaming them into memory."""
+    with tempfile.TemporaryDirectory() as folder:
+        paths = []
+        for i in range(files):
+            path = os.path.join(folder, f"f{i}")
+            with open(path, "wb") as f:
+                f.write(os.urandom(size))
+            paths.append(path)
+
+        def via_temp_file(path: str) -> bytes:
+            fd, sig_path = tempfile.mkstemp()
+            os.close(fd)
+            try:
+                librsync.signature_from_paths(path, sig_path, block_len=1024 * 1024)
+                return Path(sig_path).read_bytes()
+            finally:
+                os.unlink(sig_path)
+
+        measure("temp_file", lambda: sum(len(via_temp_file(p)) for p in paths))
+        measure("in_memory", lambda: sum(len(calc_signature(p, 1024 * 1024)) for p in paths))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            measure(f"in_memory[{workers}]", lambda: sum(
+                len(s) for s in executor.map(lambda p: calc_signature(p, 1024 * 1024), paths)
+            ))
+
+
+class MarketSwarm:
+    """Peer 0 shares a file of `chunks` chunks with `peers - 1` downloaders.
+
+    A market is a bit mask with bit `peer * chunks + chunk` set when the peer
+    has the chunk. An exchange merges both markets like the market endpoint.
+    """
+
+    def __init__(self, peers: int, chunks: int):
+        self.peers = peers
+        self.chunks = chunks
+        self.all_chunks = (1 << chunks) - 1
+        self.owned = [self.all_chunks] + [0] * (peers - 1)
+        self.markets = list(self.owned)
+        self.served = [0] * peers
+        self.messages = 0
+        self.sent = [0] * peers
+        self.peak = 0
+
+    def others(self, peer: int) -> List[int]:
+        return [other for other in range(self.peers) if other != peer]
+
+    def knows(self, peer: int, other: int, chunk: int) -> bool:
+        return bool(self.markets[peer] >> (other * self.chunks + chunk) & 1)
+
+    def exchange(self, peer: int, other: int) -> Tuple[bool, bool]:
+        """Returns whether each side learned something."""
+        merged = self.markets[peer] | self.markets[other]
+        learned = merged != self.markets[peer], merged != self.markets[other]
+        self.markets[peer] = self.markets[other] = merged
+        self.messages += 1
+        self.sent[peer] += 1
+        return learned
+
+    def download(self, peer: int) -> Optional[int]:
+        """Fetches a random missing chunk from a provider the peer's market knows of."""
+        missing = [chunk for chunk in range(self.chunks) if not self.owned[peer] >> chunk & 1]
+        random.shuffle(missing)
+        for chunk in missing:
+            providers = [other for other in range(self.peers) if self.knows(peer, other, chunk)]
+            if providers:
+                self.served[random.choice(providers)] += 1
+                self.owned[peer] |= 1 << chunk
+                self.markets[peer] |= 1 << (peer * self.chunks + chunk)
+                return chunk
+        return None
+
+    def end_round(self) -> None:
+        self.peak = max(self.peak, *self.sent)
+        self.sent = [0] * self.peers
+
+    @property
+    def done(self) -> bool:
+        return all(owned == self.all_chunks for owned in self.owned)
+
+
+def simulate_broadcast(swarm: MarketSwarm, rate: int, max_rounds: int) -> int:
+    """The uploader and starved downloaders exchange with every peer, each received chunk with one consumer."""
+    for other in swarm.others(0):
+        swarm.exchange(0, other)
+    rounds = 0
+    while not swarm.done and rounds < max_rounds:
+        rounds += 1
+        for peer in range(1, swarm.peers):
+            if swarm.owned[peer] == swarm.all_chunks:
+                continue
+            chunks = [chunk for chunk in (swarm.download(peer) for _ in range(rate)) if chunk is not None]
+            if not chunks:
+                for other in swarm.others(peer):
+                    swarm.exchange(peer, other)
+            for chunk in chunks:
+                consumers = [other for other in swarm.others(peer) if not swarm.knows(peer, other, chunk)]
+                if consumers:
+                    swarm.exchange(peer, random.choice(consumers))
+        swarm.end_round()
+    return rounds
+
+
+def simulate_gossip(swarm: MarketSwarm, rate: int, fanout: int, stop_after: int, max_rounds: int) -> int:
+    """Changed markets are rumors, starved downloaders pull from `fanout` peers."""
+    rumors = [Rumors(stop_after) for _ in range(swarm.peers)]
+    rumors[0].touch("market")
+    rounds = done_round = 0
+    while (not swarm.done or any(rumors)) and rounds < max_rounds:
+        rounds += 1
+        for peer in range(1, swarm.peers):
+            if swarm.owned[peer] == swarm.all_chunks:
+                continue
+            if any([swarm.download(peer) is not None for _ in range(rate)]):
+                rumors[peer].touch("market")
+                continue
+            for other in pick_peers(swarm.others(peer), fanout):
+                learned, _ = swarm.exchange(peer, other)
+                if learned:
+                    rumors[peer].touch("market")
+        for peer in range(swarm.peers):
+            if not rumors[peer]:
+                continue
+            for other in pick_peers(swarm.others(peer), fanout):
+                learned, taught = swarm.exchange(peer, other)
+                rumors[peer].feedback("market", learned)
+                if taught:
+                    rumors[other].touch("market")
+        swarm.end_round()
+        if swarm.done and not done_round:
+            done_round = rounds
+    return done_round or rounds
+
+
+@cli.command()
+@click.option("--peers", default="10,30,100,300", help="Comma separated peer counts")
+@click.option("--chunks", default=64, type=int)
+@click.option("--rate", default=8, type=int, help="Chunks a peer downloads per round")
+@click.option("--fanout", default=3, type=int)
+@click.option("--stop-after", default=2, type=int)
+@click.option("--max-rounds", default=1000, type=int)
+def gossip(peers: str, chunks: int, rate: int, fanout: int, stop_after: int, max_rounds: int):
+    """Simulated market exchanges of a swarm: broadcast against gossip."""
+    print(f"{'strategy':<16}{'peers':>8}{'rounds':>8}{'messages':>12}{'per peer':>10}{'peak':>8}{'source':>8}")
+    for count in (int(p) for p in peers.split(",")):
+        for name in ("broadcast", "gossip"):
+            random.seed(1)
+            swarm = MarketSwarm(count, chunks)
+            if name == "broadcast":
+                rounds = simulate_broadcast(swarm, rate, max_rounds)
+            else:
+                rounds = simulate_gossip(swarm, rate, fanout, stop_after, max_rounds)
+            source = swarm.served[0] / max(sum(swarm.served), 1)
+            print(
+                f"{name:<16}{count:>8}{rounds:>8}{swarm.messages:>12}"
+                f"{swarm.messages / count:>10.1f}{swarm.peak:>8}{source:>8.0%}"
+            )
+
+
+@cli.command()
+@click.option("--size", default=256 * 2 ** 20, type=int)
+@click.option("--chunk-size", default=2 ** 20, type=int)
+def reuse(size: int, chunk_size: int):
+    """Local chunk reuse through Python bytes against copy_range and clone_file."""
+    with tempfile.TemporaryDirectory() as folder:
+        src, dst = os.path.join(folder, "src"), os.path.join(folder, "dst")
+        with open(src, "wb") as f:
+            for _ in range(0, size, chunk_size):
+                f.write(os.urandom(chunk_size))
+        offsets = range(0, size, chunk_size)
+
+        def through_bytes() -> int:
+            create_file_placeholder(Path(dst), size)
+            for offset in offsets:
+                write_chunk(Path(dst), read_chunk(Path(src), offset, chunk_size), offset)
+            return len(offsets)
+
+        def through_copy_range() -> int:
+            create_file_placeholder(Path(dst), size)
+            with open(src, "rb") as src_file, open(dst, "r+b") as dst_file:
+                for offset in offsets:
+                    copy_range(src_file.fileno(), dst_file.fileno(), offset, offset, chunk_size)
+            return len(offsets)
+
+        measure("read_chunk+write_chunk", through_bytes)
+        measure("copy_range", through_copy_range)
+        measure("clone_file", lambda: clone_file(src, dst))
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+import logging
+import os
+from threading import Lock
+import time
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from dynaconf import settings  # type: ignore
+
+from lansync.node import LocalNode
+from lansync.util.file import file_checksum
+
+
+class ChecksumResult(NamedTuple):
+    path: str
+    checksum: Optional[str]
+    size: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        return self.size / self.elapsed if self.elapsed > 0 else 0.0
+
+
+class ChecksumStats(NamedTuple):
+    files: int
+    size: int
+    elapsed: float
+
+    @property
+    def throughput(self) -> float:
+        return self.size / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def checksum_file(path: str, block_size: int) -> ChecksumResult:
+    start = time.perf_counter()
+    checksum = file_checksum(path, settings.FILE_HASH_FUNC, block_size=block_size)
+    elapsed = time.perf_counter() - start
+    try:
+        size = os.stat(path).st_size
+    except OSError:
+        size = 0
+    return ChecksumResult(path, checksum, size, elapsed)
+
+
+class ChecksumService:
+    """Checksums many files at once on a thread or process pool.
+
+    hashlib releases the GIL while hashing large buffers, so threads already
+    use several cores; processes also spread the Python side of the work.
+    """
+
+    executor: Optional[Executor]
+
+    def __init__(
+        self,
+        max_workers: int = settings.CHECKSUM_WORKERS,
+        use_processes: bool = settings.CHECKSUM_PROCESSES,
+        block_size: int = settings.CHECKSUM_BLOCK_SIZE,
+    ):
+        self.max_workers = max_workers
+        self.use_processes = use_processes
+        self.block_size = block_size
+        self.executor = None
+        self.lock = Lock()
+
+    def get_executor(self) -> Executor:
+        with self.lock:
+            if self.executor is None:
+                executor_class = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+                self.executor = executor_class(max_workers=self.max_workers)
+            return self.executor
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def checksum_files(self, paths: Iterable[str]) -> Iterable[ChecksumResult]:
+        executor = self.get_executor()
+        futures = [executor.submit(checksum_file, path, self.block_size) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+    def checksum_nodes(self, nodes: Iterable[LocalNode]) -> ChecksumStats:
+        pending: Dict[str, List[LocalNode]] = {}
+        for node in nodes:
+            if node._checksum is None and not node.restore_cached():
+                pending.setdefault(node.local_fspath, []).append(node)
+        if not pending:
+            return ChecksumStats(0, 0, 0.0)
+
+        # Largest files first so that one big file does not finish last on its own
+        paths = sorted(pending.keys(), key=lambda p: pending[p][0].size, reverse=True)
+        start = time.perf_counter()
+        total_files = total_size = 0
+        for result in self.checksum_files(paths):
+            logging.debug(
+                "[CHECKSUM] [%s] %d bytes in %.3fs (%.1f MB/s)",
+                result.path, result.size, result.elapsed, result.throughput / 1024 / 1024
+            )
+            if result.checksum is None:
+                # Left unset, so the file is read again once it can be
+                logging.warning("[CHECKSUM] Cannot read [%s]", result.path)
+                continue
+            for node in pending[result.path]:
+                node._checksum = result.checksum
+                node.save_cached()
+            total_files += 1
+            total_size += result.size
+
+        stats = ChecksumStats(total_files, total_size, time.perf_counter() - start)
+        logging.info(
+            "[CHECKSUM] %d files, %d bytes in %.3fs (%.1f MB/s)",
+            stats.files, stats.size, stats.elapsed, stats.throughput / 1024 / 1024
+        )
+        return stats
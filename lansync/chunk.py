@@ -1,23 +1,112 @@
 from base64 import b64decode
 from dataclasses import asdict
-from pathlib import Path
-from typing import List
+from typing import Iterable, List, NamedTuple
+
+from dynaconf import settings  # type: ignore
 
 import librsync
-from rschunks.chunk import read_chunks_from_file, update_chunks
-from rschunks.delta import parse_delta_from_file
+from rschunks.cdc import cdc_chunks_from_blocks, read_cdc_chunks_from_file
+from rschunks.chunk import Chunk, read_chunks_from_file, update_chunks
+from rschunks.delta import DeltaCommand, DeltaParser
+from rschunks.hashing import buffer_identity, identity_of, new_hash
 
 from lansync.common import NodeChunk
-from lansync.util.file import create_temp_file
+
+
+def content_defined_chunking() -> bool:
+    return settings.CHUNKING == "cdc"
+
+
+def chunking_config() -> str:
+    """Describes the settings that chunk boundaries and hashes depend on."""
+    if content_defined_chunking():
+        return (
+            f"cdc:{settings.CDC_MIN_SIZE}:{settings.CDC_AVG_SIZE}:{settings.CDC_MAX_SIZE}"
+            f":{settings.CHUNK_HASH_FUNC}:{settings.CHUNK_SIZE}"
+        )
+    return f"fixed:{settings.CHUNK_SIZE}:{settings.CHUNK_HASH_FUNC}"
 
 
 def calc_initial_chunks(path: str) -> List[NodeChunk]:
+    if content_defined_chunking():
+        return [NodeChunk(**asdict(c)) for c in read_cdc_chunks_from_file(path)]
     return [NodeChunk(**asdict(c)) for c in read_chunks_from_file(path)]
 
 
 def calc_new_chunks(path: str, signature: str) -> List[NodeChunk]:
-    with create_temp_file() as signature_file, create_temp_file() as delta_file:
-        Path(signature_file).write_bytes(b64decode(signature))
-        librsync.delta_from_paths(signature_file, path, delta_file)
-        delta_commands = list(parse_delta_from_file(delta_file))
-        return [NodeChunk(**asdict(c)) for c in update_chunks(delta_commands, path)]
+    # Content-defined boundaries survive edits on their own, no delta needed
+    if content_defined_chunking():
+        return calc_initial_chunks(path)
+
+    return [NodeChunk(**asdict(c)) for c in update_chunks(calc_delta_commands(path, signature), path)]
+
+
+def calc_delta_commands(
+    path: str, signature: str, block_size: int = settings.CHUNK_SIZE
+) -> List[DeltaCommand]:
+    """Runs the delta job and parses its output as it is produced, all in memory."""
+    parser = DeltaParser()
+    commands: List[DeltaCommand] = []
+    with open(path, "rb") as fd, librsync.delta_stream(
+        b64decode(signature), sink=lambda data: commands.extend(parser.feed(data))
+    ) as job:
+        for data in iter(lambda: fd.read(block_size), b""):
+            job.write(data)
+        job.finish()
+    if not parser.ended:
+        raise ValueError("Incomplete delta", path)
+    return commands
+
+
+def calc_signature(path: str, block_size: int = settings.CHUNK_SIZE) -> bytes:
+    """Streams the rsync signature of a file into memory.
+
+    The librsync calls run without the GIL, so many files can be signed at
+    once on a thread pool.
+    """
+    signature: List[bytes] = []
+    with open(path, "rb") as fd, librsync.signature_stream(block_size=block_size) as job:
+        for data in iter(lambda: fd.read(block_size), b""):
+            signature.append(job.write(data))
+        signature.append(job.finish())
+    return b"".join(signature)
+
+
+class IngestResult(NamedTuple):
+    checksum: str
+    chunks: List[NodeChunk]
+    signature: bytes
+
+
+def fixed_chunks_from_blocks(blocks: Iterable[bytes], hash_func: str) -> Iterable[Chunk]:
+    offset = 0
+    for data in blocks:
+        yield Chunk(offset, len(data), buffer_identity(data, hash_func))
+        offset += len(data)
+
+
+def ingest_file(
+    path: str,
+    chunk_size: int = settings.CHUNK_SIZE,
+    hash_func: str = settings.CHUNK_HASH_FUNC,
+    file_hash_func: str = settings.FILE_HASH_FUNC,
+) -> IngestResult:
+    """Computes the file checksum, the chunks and the signature in one read."""
+    file_hash = new_hash(file_hash_func)
+    signature: List[bytes] = []
+
+    with open(path, "rb") as fd, librsync.signature_stream(block_size=chunk_size) as job:
+        def read_blocks() -> Iterable[bytes]:
+            for data in iter(lambda: fd.read(chunk_size), b""):
+                file_hash.update(data)
+                signature.append(job.write(data))
+                yield data
+
+        if content_defined_chunking():
+            chunks = cdc_chunks_from_blocks(read_blocks(), hash_func=hash_func)
+        else:
+            chunks = fixed_chunks_from_blocks(read_blocks(), hash_func)
+        node_chunks = [NodeChunk(**asdict(c)) for c in chunks]
+        signature.append(job.finish())
+
+    return IngestResult(identity_of(file_hash, file_hash_func), node_chunks, b"".join(signature))
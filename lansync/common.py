@@ -1,10 +1,19 @@
 import enum
 from dataclasses import dataclass
-from typing import List, Optional
+from typing import List, NamedTuple, Optional
+
+from rschunks.hashing import parse_hash_identity
 
 from lansync.util.file import buffer_checksum
 
 
+class FileId(NamedTuple):
+    device: int
+    inode: int
+    size: int
+    mtime_ns: int
+
+
 class NodeOperation(str, enum.Enum):
     CREATE = "create"
     DELETE = "delete"
@@ -26,8 +35,12 @@ class NodeChunk:
     size: int
     hash: str
 
+    @property
+    def hash_func(self) -> str:
+        return parse_hash_identity(self.hash)[0]
+
     def check(self, data: bytes):
-        assert len(data) == self.size and buffer_checksum(data) == self.hash
+        assert len(data) == self.size and buffer_checksum(data, self.hash_func) == self.hash
 
 
 @dataclass
@@ -41,3 +54,8 @@ class NodeEvent:
     chunks: Optional[List[NodeChunk]] = None
     signature: Optional[str] = None
     sequence_number: Optional[int] = None
+
+
+def checksum_func(checksum: Optional[str]) -> Optional[str]:
+    """The hash function a checksum identity was made with."""
+    return parse_hash_identity(checksum)[0] if checksum else None
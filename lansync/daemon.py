@@ -0,0 +1,97 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+from dynaconf import settings  # type: ignore
+
+from lansync.checksum import ChecksumService
+from lansync.discovery import PeerRegistry, run_discovery_loop
+from lansync.session import Session
+from lansync.stats import Stats
+from lansync.sync import SyncWorker
+from lansync.util.lazy_object import LazyObject
+
+
+class Daemon:
+    """Hosts the sessions of many namespaces in one process.
+
+    The sessions share the peer server, the discovery socket, the peer
+    registry, the client pool, the checksum service and the pool that runs
+    sync actions. Each session keeps its own `SyncWorker` and event loop.
+    """
+
+    def __init__(self, device_id: str):
+        from lansync.client import ClientPool
+
+        self.device_id = device_id
+        self.peer_registry = PeerRegistry()
+        self.client_pool = ClientPool(settings.CLIENTS_PER_PEER)
+        self.stats = Stats(device_id)
+        self.checksum_service = ChecksumService()
+        self.action_pool = ThreadPoolExecutor(
+            max_workers=settings.SYNC_WORKERS, thread_name_prefix="sync-action"
+        )
+        self.sessions: Dict[str, Session] = {}
+        self.workers: Dict[str, SyncWorker] = {}
+        # Shared with the discovery sender, which announces every namespace
+        self.namespaces: List[str] = []
+
+    def add_session(self, namespace: str, root_folder: str) -> Session:
+        if namespace in self.sessions:
+            raise ValueError("Namespace is already hosted", namespace)
+        session = Session.create(
+            namespace,
+            root_folder,
+            self.device_id,
+            peer_registry=self.peer_registry,
+            client_pool=self.client_pool,
+            stats=self.stats,
+        )
+        self.sessions[namespace] = session
+        self.workers[namespace] = SyncWorker(
+            session, checksum_service=self.checksum_service, action_pool=self.action_pool
+        )
+        self.namespaces.append(namespace)
+        logging.info("[DAEMON] Hosting namespace [%s] in [%s]", namespace, session.root_folder.fspath)
+        return session
+
+    def schedule_sync(self, namespace: str) -> None:
+        worker = self.workers.get(namespace)
+        if worker is None:
+            logging.warning("[DAEMON] Namespace [%s] is not hosted", namespace)
+            return
+        worker.schedule_event("scheduled_sync")
+
+    def gossip_market(self, namespace: str, key: str) -> None:
+        """A peer taught us something about the market, pass it on."""
+        session = self.sessions.get(namespace)
+        if session is not None:
+            session.market_gossip.touch(key)
+
+    def start_server(self) -> None:
+        from lansync.server import run_in_thread as run_server
+
+        def on_server_start(server_port):
+            run_discovery_loop(self.device_id, self.namespaces, server_port, self.peer_registry)
+
+        run_server(on_start=on_server_start)
+
+    def run(self) -> None:
+        self.start_server()
+        threads = [
+            threading.Thread(target=worker.run, name=f"sync-{namespace}", daemon=True)
+            for namespace, worker in self.workers.items()
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_once(self) -> None:
+        self.start_server()
+        for worker in self.workers.values():
+            worker.run_once()
+
+
+instance = LazyObject()
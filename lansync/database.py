@@ -1,23 +1,31 @@
 from contextlib import contextmanager
-from pathlib import Path
 from threading import RLock
+from typing import Any, Callable, List
 
 import peewee  # type: ignore
 
 
 database = peewee.DatabaseProxy()
+migrations: List[Callable[[Any], None]] = []
+
+
+def migration(func: Callable[[Any], None]) -> Callable[[Any], None]:
+    """Registers `func(database)`, which upgrades the tables of existing databases before `create_tables`."""
+    migrations.append(func)
+    return func
 
 
 @contextmanager
 def open_database(path, models=None):
-    database_exists = path != ":memory:" and Path(path).exists()
     database.initialize(
         peewee.SqliteDatabase(path, pragmas={"foreign_keys": 1, "journal_mode": "wal"})
     )
     try:
         database.connect()
-        if not database_exists and models is not None:
-            database.create_tables(models)
+        if models is not None:
+            for migrate in migrations:
+                migrate(database)
+            database.create_tables(models, safe=True)
         yield database
     finally:
         database.close()
@@ -15,10 +15,42 @@ from dynaconf import settings  # type: ignore
 from pydantic import BaseModel
 
 
+MAX_DISCOVERY_MESSAGE_SIZE = 1024
+
+
 class DiscoveryMessage(BaseModel):
     device_id: str
     namespace: str
     port: int
+    # Set by peers announcing several namespaces; `namespace` is the first one
+    namespaces: List[str] = []
+
+    @property
+    def all_namespaces(self) -> List[str]:
+        return self.namespaces or [self.namespace]
+
+    def encode(self) -> bytes:
+        return json.dumps(self.dict()).encode("utf-8")
+
+    @classmethod
+    def create(cls, device_id: str, port: int, namespaces: List[str]) -> DiscoveryMessage:
+        return cls(device_id=device_id, namespace=namespaces[0], port=port, namespaces=namespaces)
+
+    @classmethod
+    def for_namespaces(
+        cls, device_id: str, port: int, namespaces: Sequence[str]
+    ) -> List[DiscoveryMessage]:
+        """Splits `namespaces` over as few messages as fit into a datagram."""
+        messages: List[DiscoveryMessage] = []
+        group: List[str] = []
+        for namespace in namespaces:
+            if group and len(cls.create(device_id, port, group + [namespace]).encode()) > MAX_DISCOVERY_MESSAGE_SIZE:
+                messages.append(cls.create(device_id, port, group))
+                group = []
+            group.append(namespace)
+        if group:
+            messages.append(cls.create(device_id, port, group))
+        return messages
 
 
 @dataclass
@@ -42,14 +74,15 @@ class PeerRegistry:
 
     def handle_discovery_message(self, address: str, msg: DiscoveryMessage) -> None:
         with self.lock:
-            self.peers.setdefault(msg.namespace, {})
-            peer = self.peers[msg.namespace].get(msg.device_id, None)
-            if peer is None:
-                peer = Peer(address, msg.port, msg.device_id)
-                self.peers[msg.namespace][msg.device_id] = peer
-                logging.info("[DISCOVERY] new peer joined: %r", peer)
-            else:
-                peer.touch()
+            for namespace in msg.all_namespaces:
+                peers = self.peers.setdefault(namespace, {})
+                peer = peers.get(msg.device_id, None)
+                if peer is None or (peer.address, peer.port) != (address, msg.port):
+                    peer = Peer(address, msg.port, msg.device_id)
+                    peers[msg.device_id] = peer
+                    logging.info("[DISCOVERY] new peer joined [%s]: %r", namespace, peer)
+                else:
+                    peer.touch()
 
     def peers_for_namespace(self, namespace: str) -> List[Peer]:
         return list(self.peers.get(namespace, {}).values())
@@ -98,7 +131,7 @@ class Receiver:
 
         client.bind(("", settings.DISCOVERY_PORT))
         while True:
-            data, addr = client.recvfrom(1024)
+            data, addr = client.recvfrom(65535)
             logging.debug("[DISCOVERY] %s <- %s", data, addr)
 
             msg: DiscoveryMessage = DiscoveryMessage.parse_raw(data)
@@ -112,8 +145,12 @@ class Receiver:
 
 
 class Sender:
-    def __init__(self, msg: DiscoveryMessage):
-        self.msg = json.dumps(msg.dict()).encode("utf-8")
+    """Announces `namespaces`, which may grow while the sender runs."""
+
+    def __init__(self, device_id: str, port: int, namespaces: List[str]):
+        self.device_id = device_id
+        self.port = port
+        self.namespaces = namespaces
 
     def run(self):
         server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
@@ -125,16 +162,20 @@ class Sender:
         # Set a timeout so the socket does not block indefinitely when trying to receive data.
         server.settimeout(0.2)
         while True:
-            server.sendto(self.msg, ("<broadcast>", settings.DISCOVERY_PORT))
-            logging.debug("[DISCOVERY] -> %s", self.msg)
+            for msg in DiscoveryMessage.for_namespaces(self.device_id, self.port, list(self.namespaces)):
+                data = msg.encode()
+                server.sendto(data, ("<broadcast>", settings.DISCOVERY_PORT))
+                logging.debug("[DISCOVERY] -> %s", data)
             time.sleep(settings.DISCOVERY_PING_INTERVAL)
 
     @classmethod
-    def run_in_thread(cls, msg: DiscoveryMessage):
-        sender = Sender(msg)
+    def run_in_thread(cls, device_id: str, port: int, namespaces: List[str]):
+        sender = Sender(device_id, port, namespaces)
         threading.Thread(target=sender.run, daemon=True).start()
 
 
-def run_discovery_loop(device_id: str, namespace: str, port: int, peer_registry: PeerRegistry):
+def run_discovery_loop(
+    device_id: str, namespaces: List[str], port: int, peer_registry: PeerRegistry
+):
     Receiver.run_in_thread(device_id, peer_registry)
-    Sender.run_in_thread(DiscoveryMessage(device_id=device_id, namespace=namespace, port=port))
+    Sender.run_in_thread(device_id, port, namespaces)
@@ -0,0 +1,170 @@
+"""Epidemic dissemination of node markets.
+
+A market that changed locally, or was changed by a peer, becomes a rumor.
+Every round the markets that are rumors are exchanged with `fanout` random
+live peers; a peer that learns from an exchange spreads the market in turn.
+A rumor is dropped after `stop_after` exchanges that taught nothing new, so
+an update reaches every peer in O(log N) rounds with O(N * fanout) messages
+no matter how many times the market changed in between.
+"""
+import dataclasses
+import logging
+import random
+import threading
+import time
+from typing import Dict, List, Sequence, TypeVar
+
+from dynaconf import settings  # type: ignore
+
+from lansync.market import Market
+from lansync.session import Session
+from lansync.util.task import Task, TaskList
+
+
+T = TypeVar("T")
+
+
+class Rumors:
+    """Counts the exchanges of every rumor that taught nothing new."""
+
+    def __init__(self, stop_after: int = settings.GOSSIP_STOP_AFTER):
+        self.stop_after = stop_after
+        self.counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def touch(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] = 0
+
+    def feedback(self, key: str, learned: bool) -> None:
+        with self.lock:
+            if key not in self.counters:
+                return
+            if learned:
+                self.counters[key] = 0
+                return
+            self.counters[key] += 1
+            if self.counters[key] >= self.stop_after:
+                del self.counters[key]
+
+    def discard(self, key: str) -> None:
+        with self.lock:
+            self.counters.pop(key, None)
+
+    def keys(self) -> List[str]:
+        with self.lock:
+            return list(self.counters)
+
+    def __len__(self) -> int:
+        return len(self.counters)
+
+
+def copy_market(market: Market) -> Market:
+    return dataclasses.replace(market, peers=dict(market.peers))
+
+
+def pick_peers(peers: Sequence[T], fanout: int) -> List[T]:
+    return random.sample(list(peers), min(fanout, len(peers)))
+
+
+class MarketGossip:
+    def __init__(
+        self,
+        session: Session,
+        fanout: int = settings.GOSSIP_FANOUT,
+        interval: float = settings.GOSSIP_INTERVAL,
+        stop_after: int = settings.GOSSIP_STOP_AFTER,
+    ):
+        self.session = session
+        self.fanout = fanout
+        self.interval = interval
+        self.rumors = Rumors(stop_after)
+        self.running = False
+
+    def touch(self, key: str) -> None:
+        """Spreads the market of `key` from the next round on."""
+        self.rumors.touch(key)
+
+    def start(self) -> None:
+        self.running = True
+        threading.Thread(target=self.run, name=f"gossip-{self.session.namespace}", daemon=True).start()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def run(self) -> None:
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.run_round()
+            except Exception as error:
+                logging.warning("[GOSSIP] Round failed: %r", error)
+
+    def run_round(self) -> int:
+        """Exchanges every rumor with `fanout` peers, returns the number of exchanges."""
+        keys = self.rumors.keys()
+        if not keys:
+            return 0
+        namespace = self.session.namespace
+        peers = self.session.peer_registry.live_peers(namespace)
+        client_pool = self.session.client_pool
+        tasks = TaskList()
+        exchanges = 0
+        for key in keys:
+            market = Market.load_from_db(namespace, key)
+            if market is None:
+                self.rumors.discard(key)
+                continue
+            for peer in pick_peers(peers, self.fanout):
+                client = client_pool.aquire(peer)
+                if client is not None:
+                    tasks.submit(GossipMarketTask(client, market, self))
+                    exchanges += 1
+        tasks.wait_all()
+        if exchanges:
+            logging.info("[GOSSIP] %d exchanges for %d markets", exchanges, len(keys))
+        return exchanges
+
+    def drain(self, max_rounds: int = 32) -> int:
+        """Runs rounds back to back until the rumors die out."""
+        exchanges = 0
+        for _ in range(max_rounds):
+            count = self.run_round()
+            if not count:
+                break
+            exchanges += count
+        return exchanges
+
+
+class GossipMarketTask(Task):
+    def __init__(self, client, market: Market, gossip: MarketGossip):
+        self.client = client
+        self.market = market
+        self.gossip = gossip
+        # `on_done` of other exchanges merges into `market` while this one is sent
+        self.sent = copy_market(market)
+        super().__init__((client, market, gossip))
+
+    def execute(self, *args, **kwargs):
+        return self.client.exchange_market(self.sent)
+
+    def on_done(self, result):
+        market = self.market
+        learned = False
+        if result is not None:
+            before = copy_market(market)
+            market.merge(result)
+            learned = market.peers != before.peers
+            if learned:
+                market.exchange_with_db()
+            self.gossip.session.stats.emit_market_exchange(
+                (market.namespace, *market.key.split(":")), self.client.peer
+            )
+        self.gossip.rumors.feedback(market.key, learned)
+
+    def on_error(self, error):
+        logging.info("[GOSSIP] Market exchange with %s failed: %r", self.client.peer.device_id, error)
+        self.gossip.rumors.feedback(self.market.key, False)
+
+    def cleanup(self):
+        self.gossip.session.client_pool.release(self.client)
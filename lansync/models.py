@@ -2,12 +2,13 @@ from __future__ import annotations
 
 from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple, Callable, Optional
+from dataclasses import asdict
+from typing import Any, Dict, Iterable, List, NamedTuple, Sequence, Tuple, Callable, Optional
 
 import mong  # type: ignore
 import peewee  # type: ignore
 
-from lansync.database import database, atomic
+from lansync.database import database, atomic, migration
 from lansync.session import Session
 from lansync import common
 from lansync.util.db_fields import JSONField
@@ -100,6 +101,15 @@ class StoredNode(peewee.Model):
             common.NodeChunk(hash=c.chunk.hash, size=c.chunk.size, offset=c.offset) for c in chunks
         ]
 
+    @property
+    def data_path(self) -> Path:
+        """Where the content is read from; a temp file until the download is done."""
+        if not self.ready:
+            partial = PartialDownload.get_or_none(PartialDownload.node == self)
+            if partial is not None:
+                return partial.local_path
+        return self.local_path
+
     def sync_with_local(self, local_node):
         self.local_modified_time = local_node.modified_time
         self.local_created_time = local_node.created_time
@@ -107,9 +117,26 @@ class StoredNode(peewee.Model):
         self.save()
 
 
+class StoredNodeRecord(NamedTuple):
+    """The `StoredNode` columns that sync decisions read, without the signature."""
+
+    id: int
+    key: str
+    path: str
+    checksum: Optional[str]
+    local_modified_time: int
+    local_created_time: int
+    ready: bool
+    size: int
+
+    @classmethod
+    def select(cls) -> Any:
+        return StoredNode.select(*(getattr(StoredNode, name) for name in cls._fields))
+
+
 class Chunk(peewee.Model):
     id = peewee.AutoField()
-    hash = peewee.CharField(index=True)
+    hash = peewee.CharField(unique=True)
     size = peewee.IntegerField()
 
     class Meta:
@@ -132,6 +159,7 @@ class NodeChunk(peewee.Model):
 
     class Meta:
         database = database
+        indexes = ((("node", "chunk"), True),)
 
     @classmethod
     def update_or_create(cls, node: StoredNode, chunk: common.NodeChunk) -> NodeChunk:
@@ -145,6 +173,52 @@ class NodeChunk(peewee.Model):
                 node_chunk.save()
             return node_chunk
 
+    @classmethod
+    def bulk_update_or_create(
+        cls, node: StoredNode, chunks: Sequence[common.NodeChunk], batch_size: int = 300
+    ) -> None:
+        """Upserts the `Chunk` and `NodeChunk` rows of `node` with three statements per batch."""
+        with atomic():
+            for batch in peewee.chunked(chunks, batch_size):
+                Chunk.insert_many(
+                    [(chunk.hash, chunk.size) for chunk in batch], fields=[Chunk.hash, Chunk.size]
+                ).on_conflict(
+                    conflict_target=[Chunk.hash], update={Chunk.size: peewee.EXCLUDED.size}
+                ).execute()
+                chunk_ids = dict(
+                    Chunk.select(Chunk.hash, Chunk.id)
+                    .where(Chunk.hash.in_({chunk.hash for chunk in batch}))
+                    .tuples()
+                )
+                cls.insert_many(
+                    [(node.id, chunk_ids[chunk.hash], chunk.offset) for chunk in batch],
+                    fields=[cls.node, cls.chunk, cls.offset],
+                ).on_conflict(
+                    conflict_target=[cls.node, cls.chunk], update={cls.offset: peewee.EXCLUDED.offset}
+                ).execute()
+
+    @classmethod
+    def find_all(
+        cls, namespace: str, hashes: Iterable[str], batch_size: int = 300
+    ) -> Dict[str, Tuple[Path, int, int]]:
+        """Maps each hash found in the namespace to the `(path, offset, size)` of one copy."""
+        namespace = Namespace.by_name(namespace)
+        found: Dict[str, Tuple[Path, int, int]] = {}
+        for batch in peewee.chunked(hashes, batch_size):
+            query = (
+                cls.select(cls, Chunk, StoredNode)
+                .join(Chunk, on=(cls.chunk == Chunk.id))
+                .switch(cls)
+                .join(StoredNode, on=(cls.node == StoredNode.id))
+                .where(StoredNode.namespace == namespace, Chunk.hash.in_(batch))
+            )
+            for node_chunk in query:
+                if node_chunk.chunk.hash not in found:
+                    found[node_chunk.chunk.hash] = (
+                        node_chunk.node.data_path, node_chunk.offset, node_chunk.chunk.size
+                    )
+        return found
+
     @classmethod
     def find(
         cls, namespace: str, hash: str
@@ -166,7 +240,7 @@ class NodeChunk(peewee.Model):
                         offset=node_chunk.offset,
                     ),
                     lambda: read_chunk(
-                        node_chunk.node.local_path, node_chunk.offset, node_chunk.chunk.size
+                        node_chunk.node.data_path, node_chunk.offset, node_chunk.chunk.size
                     ),
                 )
                 if node_chunk
@@ -176,6 +250,57 @@ class NodeChunk(peewee.Model):
             return None
 
 
+def has_unique_index(db: Any, table: str, columns: List[str]) -> bool:
+    return any(index.unique and index.columns == columns for index in db.get_indexes(table))
+
+
+@migration
+def unique_chunk_rows(db: Any) -> None:
+    """Merges duplicate rows of databases created before `Chunk.hash` and `(node, chunk)` were unique.
+
+    The old non-unique `chunk_hash` index is dropped, `create_tables` then
+    creates both unique indexes.
+    """
+    tables = db.get_tables()
+    if "chunk" not in tables or "nodechunk" not in tables:
+        return
+    if has_unique_index(db, "chunk", ["hash"]) and has_unique_index(db, "nodechunk", ["node_id", "chunk_id"]):
+        return
+    with atomic():
+        db.execute_sql(
+            'UPDATE "nodechunk" SET "chunk_id" = ('
+            'SELECT MIN(other."id") FROM "chunk" AS this JOIN "chunk" AS other ON other."hash" = this."hash" '
+            'WHERE this."id" = "nodechunk"."chunk_id")'
+        )
+        db.execute_sql(
+            'DELETE FROM "nodechunk" WHERE "id" NOT IN '
+            '(SELECT MIN("id") FROM "nodechunk" GROUP BY "node_id", "chunk_id")'
+        )
+        db.execute_sql('DELETE FROM "chunk" WHERE "id" NOT IN (SELECT MIN("id") FROM "chunk" GROUP BY "hash")')
+        if not has_unique_index(db, "chunk", ["hash"]):
+            db.execute_sql('DROP INDEX IF EXISTS "chunk_hash"')
+
+
+class PartialDownload(peewee.Model):
+    """The temp file of a download in progress and the chunks written to it.
+
+    `received` has one bit per entry of the remote chunk list of `checksum`.
+    """
+
+    id = peewee.AutoField()
+    node = peewee.ForeignKeyField(StoredNode, unique=True, on_delete="CASCADE")
+    temp_path = peewee.CharField()
+    checksum = peewee.CharField()
+    received = peewee.BlobField()
+
+    class Meta:
+        database = database
+
+    @property
+    def local_path(self) -> Path:
+        return Path(self.node.root_folder.path) / self.temp_path
+
+
 class RemoteNode(peewee.Model):
     id = peewee.AutoField()
     namespace = peewee.ForeignKeyField(Namespace, on_delete="CASCADE")
@@ -203,6 +328,95 @@ class RemoteNode(peewee.Model):
         )
 
 
+class RemoteNodeRecord(NamedTuple):
+    """The `RemoteNode` columns that sync decisions read, without chunks and signature."""
+
+    id: int
+    key: str
+    path: str
+    checksum: Optional[str]
+    size: int
+
+    @classmethod
+    def select(cls) -> Any:
+        return RemoteNode.select(*(getattr(RemoteNode, name) for name in cls._fields))
+
+    def updated(self, stored: Any) -> bool:
+        return self.checksum != stored.checksum
+
+
+class LocalFileState(peewee.Model):
+    id = peewee.AutoField()
+    root_folder = peewee.ForeignKeyField(RootFolder, on_delete="CASCADE")
+    path = peewee.CharField()
+    device = peewee.IntegerField()
+    inode = peewee.IntegerField()
+    size = peewee.IntegerField()
+    mtime_ns = peewee.IntegerField()
+    ctime_ns = peewee.IntegerField()
+
+    class Meta:
+        database = database
+        indexes = ((("root_folder", "path"), True),)
+
+
+class ContentCache(peewee.Model):
+    id = peewee.AutoField()
+    device = peewee.IntegerField()
+    inode = peewee.IntegerField()
+    size = peewee.IntegerField()
+    mtime_ns = peewee.IntegerField()
+    checksum = peewee.CharField(null=True)
+    chunking = peewee.CharField(null=True)
+    chunks = JSONField(null=True)
+    signature = peewee.BlobField(null=True)
+
+    class Meta:
+        database = database
+        indexes = ((("device", "inode", "size", "mtime_ns"), True),)
+
+    @classmethod
+    def lookup(cls, file_id: common.FileId) -> Optional[ContentCache]:
+        return cls.get_or_none(
+            cls.device == file_id.device,
+            cls.inode == file_id.inode,
+            cls.size == file_id.size,
+            cls.mtime_ns == file_id.mtime_ns,
+        )
+
+    @classmethod
+    def store(
+        cls,
+        file_id: common.FileId,
+        checksum: Optional[str],
+        chunking: Optional[str] = None,
+        chunks: Optional[List[common.NodeChunk]] = None,
+        signature: Optional[bytes] = None,
+    ) -> None:
+        with atomic():
+            cls.insert(
+                device=file_id.device,
+                inode=file_id.inode,
+                size=file_id.size,
+                mtime_ns=file_id.mtime_ns,
+                checksum=checksum,
+                chunking=chunking,
+                chunks=[asdict(c) for c in chunks] if chunks is not None else None,
+                signature=signature,
+            ).on_conflict_replace().execute()
+
+    @classmethod
+    def forget(cls, file_ids: Iterable[common.FileId]) -> None:
+        with atomic():
+            for file_id in file_ids:
+                cls.delete().where(
+                    cls.device == file_id.device,
+                    cls.inode == file_id.inode,
+                    cls.size == file_id.size,
+                    cls.mtime_ns == file_id.mtime_ns,
+                ).execute()
+
+
 class Market(peewee.Model):
     id = peewee.AutoField()
     namespace = peewee.ForeignKeyField(Namespace, on_delete="CASCADE")
@@ -2,27 +2,27 @@ from __future__ import annotations
 
 import logging
 import os
-import shutil
 from base64 import b64encode
 from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Dict, List, NamedTuple, Optional, Set, Union
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Set, Union
 from uuid import uuid4
 
 from dynaconf import settings  # type: ignore
 from typing_extensions import Literal
 
-import librsync  # type: ignore
+from rschunks.hashing import parse_hash_identity
 
-from lansync.chunk import calc_initial_chunks, calc_new_chunks
-from lansync.common import NodeChunk
+from lansync.chunk import calc_initial_chunks, calc_new_chunks, calc_signature, chunking_config, ingest_file
+from lansync.common import FileId, NodeChunk, checksum_func
 from lansync.database import atomic
 from lansync.models import Namespace
 from lansync.models import NodeChunk as NodeChunkModel
-from lansync.models import RemoteNode, RootFolder, StoredNode
+from lansync.models import ContentCache, PartialDownload, RemoteNode, RootFolder, StoredNode
 from lansync.session import Session
-from lansync.util.file import (create_file_placeholder, create_temp_file, file_checksum, hash_path,
-                               read_chunk, write_chunk)
+from lansync.util.file import (clone_file, copy_range, create_file_placeholder, file_checksum, hash_path,
+                               read_chunk, relative_path, write_chunk)
+from lansync.util.bitmap import Bitmap
 from lansync.util.misc import index_by
 
 
@@ -36,21 +36,26 @@ class LocalNode:
     size: int
     _checksum: Optional[str]
     _signature: Optional[bytes] = None
+    _chunks: Optional[List[NodeChunk]] = None
+    file_id: Optional[FileId] = None
+    _other_checksums: Dict[str, str] = field(default_factory=dict, repr=False, compare=False)
 
     def __post_init__(self):
         self.key = hash_path(self.path)
 
     @classmethod
-    def create(cls, local_path: Path, session: Session) -> LocalNode:
-        root_folder = session.root_folder.path
-        stat = local_path.stat()
+    def create(cls, local_path: Union[Path, str], session: Session, stat: Any = None) -> LocalNode:
+        local_fspath = os.fspath(local_path)
+        if stat is None:
+            stat = os.stat(local_fspath)
         return LocalNode(
-            root_folder=root_folder,
-            path=local_path.relative_to(root_folder).as_posix(),
-            modified_time=int(stat.st_mtime),
-            created_time=int(stat.st_ctime),
+            root_folder=session.root_folder.path,
+            path=relative_path(local_fspath, session.root_folder.fspath),
+            modified_time=stat.st_mtime_ns // 1000000000,
+            created_time=stat.st_ctime_ns // 1000000000,
             size=stat.st_size,
             _checksum=None,
+            file_id=FileId(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns),
         )
 
     @classmethod
@@ -75,9 +80,47 @@ class LocalNode:
 
     @property
     def checksum(self) -> str:
-        if self._checksum is None:
-            self._checksum = file_checksum(self.local_fspath) or ""
-        return self._checksum
+        if self._checksum is None and not self.restore_cached():
+            checksum = file_checksum(self.local_fspath, settings.FILE_HASH_FUNC)
+            if checksum is None:
+                # Not kept, a file that cannot be read now is read again later
+                return ""
+            self._checksum = checksum
+            self.save_cached()
+        return self._checksum  # type: ignore
+
+    def same_content(self, checksum: Optional[str]) -> bool:
+        """Compares with a checksum of any hash function, hashing the file again when it differs from ours."""
+        hash_func = checksum_func(checksum)
+        if hash_func is None:
+            return False
+        if hash_func == settings.FILE_HASH_FUNC:
+            return self.checksum == checksum
+        if hash_func not in self._other_checksums:
+            self._other_checksums[hash_func] = file_checksum(self.local_fspath, hash_func) or ""
+        return self._other_checksums[hash_func] == checksum
+
+    def restore_cached(self) -> bool:
+        """Fills checksum, chunks and signature from the content cache."""
+        if self.file_id is None:
+            return False
+        entry = ContentCache.lookup(self.file_id)
+        if entry is None or not entry.checksum:
+            return False
+        if parse_hash_identity(entry.checksum)[0] != settings.FILE_HASH_FUNC:
+            return False
+        self._checksum = entry.checksum
+        if entry.chunks is not None and entry.chunking == chunking_config():
+            self._chunks = [NodeChunk(**c) for c in entry.chunks]
+        if entry.signature is not None and entry.chunking == chunking_config():
+            self._signature = entry.signature
+        return True
+
+    def save_cached(self) -> None:
+        if self.file_id is not None and self._checksum:
+            ContentCache.store(
+                self.file_id, self._checksum, chunking_config(), self._chunks, self._signature
+            )
 
     def read_chunk(self, chunk: NodeChunk) -> bytes:
         return read_chunk(self.local_path, chunk.offset, chunk.size)
@@ -95,11 +138,10 @@ class LocalNode:
 
     def calc_signature(self, format=Union[Literal["binary"], Literal["base64"]]) -> Union[str, bytes]:
         if self._signature is None:
-            with create_temp_file() as f:
-                librsync.signature_from_paths(
-                    self.local_fspath, f, block_len=settings.CHUNK_SIZE
-                )
-                self._signature = Path(f).read_bytes()
+            self.restore_cached()
+        if self._signature is None:
+            self._signature = calc_signature(self.local_fspath)
+            self.save_cached()
 
         if format == "binary":
             return self._signature
@@ -108,11 +150,29 @@ class LocalNode:
         else:
             raise ValueError("Invalid format", format)
 
+    def ingest(self) -> List[NodeChunk]:
+        if self._chunks is None or self._signature is None:
+            self.restore_cached()
+        if self._chunks is None or self._signature is None:
+            result = ingest_file(self.local_fspath)
+            self._checksum = result.checksum
+            self._signature = result.signature
+            self._chunks = result.chunks
+            self.save_cached()
+        return self._chunks
+
     def calc_chunks(self, signature: Optional[str]) -> List[NodeChunk]:
-        if signature is None:
-            return calc_initial_chunks(self.local_fspath)
-        else:
+        """Only the initial chunks are cached, chunks against a signature depend on it."""
+        if signature is not None:
             return calc_new_chunks(self.local_fspath, signature)
+        if self._chunks is None:
+            self.restore_cached()
+        if self._chunks is None:
+            self._chunks = calc_initial_chunks(self.local_fspath)
+            # Cache entries without a checksum are not stored
+            self._checksum = self.checksum
+            self.save_cached()
+        return self._chunks
 
 
 class FullNode(NamedTuple):
@@ -131,8 +191,8 @@ def store_new_node(
         signature = stored_node.signature
         chunks = local_node.calc_chunks(signature=signature)
     else:
+        chunks = local_node.ingest()
         signature = local_node.calc_signature(format="base64")
-        chunks = local_node.calc_chunks(None)
 
     with atomic():
         new_node = StoredNode.create(
@@ -148,8 +208,7 @@ def store_new_node(
             signature=signature
         )
 
-        for chunk in chunks:
-            NodeChunkModel.update_or_create(new_node, chunk)
+        NodeChunkModel.bulk_update_or_create(new_node, chunks)
 
         if stored_node:
             stored_node.delete_instance()
@@ -164,48 +223,193 @@ def store_new_node(
         )
 
 
-def create_node_placeholder(remote_node: RemoteNode, session: Session) -> FullNode:
-    with atomic():
-        temp_path = str(uuid4())
-        stored_node = StoredNode.create(
-            namespace=remote_node.namespace,
-            root_folder=RootFolder.for_session(session),
-            key=hash_path(temp_path),
-            path=temp_path,
-            checksum=remote_node.checksum,
-            size=remote_node.size,
-            local_modified_time=0,
-            local_created_time=0,
-            ready=False,
-            signature=remote_node.signature
+class PartialNode:
+    """A download written to a temp file under `settings.PARTIAL_FOLDER`.
+
+    Every chunk written is recorded in the bitmap of its `PartialDownload`,
+    so an interrupted download resumes with the chunks that are still
+    missing. The file is moved to its path once all chunks are there.
+    """
+
+    def __init__(self, stored_node: StoredNode, partial: PartialDownload, all_chunks: List[NodeChunk]):
+        self.stored_node = stored_node
+        self.partial = partial
+        self.all_chunks = all_chunks
+        self.chunk_index = index_by("hash")(all_chunks)
+        self.positions: Dict[str, List[int]] = {}
+        for i, chunk in enumerate(all_chunks):
+            self.positions.setdefault(chunk.hash, []).append(i)
+        self.received = Bitmap(len(all_chunks), partial.received)
+
+    @property
+    def path(self) -> str:
+        return self.stored_node.path
+
+    @property
+    def temp_path(self) -> Path:
+        return self.partial.local_path
+
+    @classmethod
+    def prepare(cls, remote_node: RemoteNode, session: Session) -> PartialNode:
+        all_chunks = [NodeChunk(**c) for c in remote_node.chunks]
+        node = cls.resume(remote_node, all_chunks) or cls.start(remote_node, session, all_chunks)
+        if node.received.count() or not node.copy_local_file(session):
+            node.copy_local_chunks(session)
+        return node
+
+    @classmethod
+    def resume(cls, remote_node: RemoteNode, all_chunks: List[NodeChunk]) -> Optional[PartialNode]:
+        """Picks up an interrupted download of the same content.
+
+        Chunks marked as received are trusted by the size of the temp file and
+        the hashes of the chunk list, without reading them back.
+        """
+        partial = (
+            PartialDownload.select()
+            .join(StoredNode)
+            .where(
+                StoredNode.namespace == remote_node.namespace,
+                StoredNode.key == remote_node.key,
+                StoredNode.ready == False,  # noqa: E712
+            )
+            .first()
         )
-        local_node = LocalNode.create_placeholder(
-            stored_node.local_path, stored_node.size, session
+        if partial is None or partial.checksum != remote_node.checksum:
+            return None
+        try:
+            size = os.stat(partial.local_path).st_size
+        except OSError:
+            return None
+        if size != remote_node.size or len(partial.received) != (len(all_chunks) + 7) // 8:
+            return None
+        node = cls(partial.node, partial, all_chunks)
+        logging.info(
+            "[CHUNK] Resuming download of [%s] with %d of %d chunks",
+            node.path, node.received.count(), len(all_chunks)
         )
+        return node
 
-        all_chunks = [NodeChunk(**c) for c in remote_node.chunks]
-        chunk_index = index_by("hash")(all_chunks)
-        needed_chunks: Set[str] = set()
-        available_chunks: Set[str] = set()
-        for chunk_hash, chunks in chunk_index.items():
-            node_chunk_pair = NodeChunkModel.find(session.namespace, chunk_hash)
-            if node_chunk_pair:
-                available_chunk, read_chunk = node_chunk_pair
-                logging.info(
-                    "[CHUNK] found local chunk for node [%s]: [%r]", local_node.path, available_chunk
-                )
-                for chunk in chunks:
-                    local_node.write_chunk(chunk, read_chunk())
-                available_chunks.add(chunk_hash)
-            else:
-                needed_chunks.add(chunk_hash)
-
-        StoredNode.delete().where(StoredNode.key == remote_node.key).execute()
-        stored_node.key = remote_node.key
-        stored_node.path = remote_node.path
-        stored_node.save()
-
-        shutil.move(local_node.local_path, stored_node.local_path)
-        local_node = LocalNode.create(stored_node.local_path, session)
-
-        return FullNode(stored_node, local_node, all_chunks, chunk_index, needed_chunks, available_chunks)
+    @classmethod
+    def start(cls, remote_node: RemoteNode, session: Session, all_chunks: List[NodeChunk]) -> PartialNode:
+        with atomic():
+            previous = StoredNode.select().where(
+                StoredNode.namespace == remote_node.namespace, StoredNode.key == remote_node.key
+            )
+            for stored_node in previous:
+                discard_partial_download(stored_node)
+                stored_node.delete_instance()
+            stored_node = StoredNode.create(
+                namespace=remote_node.namespace,
+                root_folder=RootFolder.for_session(session),
+                key=remote_node.key,
+                path=remote_node.path,
+                checksum=remote_node.checksum,
+                size=remote_node.size,
+                local_modified_time=0,
+                local_created_time=0,
+                ready=False,
+                signature=remote_node.signature
+            )
+            partial = PartialDownload.create(
+                node=stored_node,
+                temp_path=f"{settings.PARTIAL_FOLDER}/{uuid4()}",
+                checksum=remote_node.checksum,
+                received=bytes(Bitmap(len(all_chunks))),
+            )
+        create_file_placeholder(partial.local_path, remote_node.size)
+        return cls(stored_node, partial, all_chunks)
+
+    def has_chunk(self, chunk_hash: str) -> bool:
+        return all(i in self.received for i in self.positions[chunk_hash])
+
+    def write_chunk(self, chunk_hash: str, data: bytes) -> None:
+        for chunk in self.chunk_index[chunk_hash]:
+            write_chunk(self.temp_path, data, chunk.offset)
+        self.mark_received([chunk_hash])
+
+    def mark_received(self, chunk_hashes: Iterable[str]) -> None:
+        # The data is written before its bits are set, so the bitmap never claims a missing chunk
+        chunk_hashes = list(chunk_hashes)
+        with atomic():
+            NodeChunkModel.bulk_update_or_create(
+                self.stored_node, [chunk for h in chunk_hashes for chunk in self.chunk_index[h]]
+            )
+            for chunk_hash in chunk_hashes:
+                for i in self.positions[chunk_hash]:
+                    self.received.add(i)
+            self.partial.received = bytes(self.received)
+            self.partial.save()
+
+    def copy_local_file(self, session: Session) -> bool:
+        """Clones an unchanged local file of the same content into the temp file."""
+        candidates = StoredNode.select().where(
+            StoredNode.namespace == self.stored_node.namespace,
+            StoredNode.checksum == self.stored_node.checksum,
+            StoredNode.size == self.stored_node.size,
+            StoredNode.ready == True,  # noqa: E712
+            StoredNode.id != self.stored_node.id,
+        )
+        for stored_node in candidates:
+            try:
+                local_node = LocalNode.create(stored_node.local_path, session)
+            except OSError:
+                continue
+            if local_node.updated(stored_node) or local_node.size != stored_node.size:
+                continue
+            try:
+                clone_file(stored_node.local_path, self.temp_path)
+            except OSError as error:
+                logging.warning("[CHUNK] Cannot clone local file [%s]: %r", stored_node.path, error)
+                create_file_placeholder(self.temp_path, self.stored_node.size)
+                return False
+            logging.info("[CHUNK] Cloned [%s] from local file [%s]", self.path, stored_node.path)
+            self.mark_received(self.chunk_index)
+            return True
+        return False
+
+    def copy_local_chunks(self, session: Session) -> None:
+        missing = [chunk_hash for chunk_hash in self.chunk_index if not self.has_chunk(chunk_hash)]
+        found = NodeChunkModel.find_all(session.namespace, missing)
+        if not found:
+            return
+        copied = []
+        sources: Dict[Path, int] = {}
+        dst_fd = os.open(self.temp_path, os.O_WRONLY)
+        try:
+            for chunk_hash, (path, offset, size) in found.items():
+                try:
+                    if path not in sources:
+                        sources[path] = os.open(path, os.O_RDONLY)
+                    for chunk in self.chunk_index[chunk_hash]:
+                        copy_range(sources[path], dst_fd, offset, chunk.offset, size)
+                except (OSError, EOFError) as error:
+                    logging.warning("[CHUNK] Cannot copy local chunk [%s] from [%s]: %r", chunk_hash, path, error)
+                    continue
+                copied.append(chunk_hash)
+        finally:
+            for fd in sources.values():
+                os.close(fd)
+            os.close(dst_fd)
+        logging.info("[CHUNK] Copied %d local chunks for node [%s]", len(copied), self.path)
+        self.mark_received(copied)
+
+    def finish(self, session: Session) -> LocalNode:
+        local_path = self.stored_node.local_path
+        local_path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(self.temp_path, local_path)
+        local_node = LocalNode.create(local_path, session)
+        with atomic():
+            self.partial.delete_instance()
+            self.stored_node.sync_with_local(local_node)
+        return local_node
+
+
+def discard_partial_download(stored_node: StoredNode) -> None:
+    partial = PartialDownload.get_or_none(PartialDownload.node == stored_node)
+    if partial is None:
+        return
+    try:
+        os.unlink(partial.local_path)
+    except OSError:
+        pass
+    partial.delete_instance()
@@ -1,15 +1,22 @@
 from dataclasses import asdict
 import json
+import logging
+import threading
+import time
 from urllib.parse import urlparse, urlencode, urlunparse
-from typing import Any, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
+from dynaconf import settings  # type: ignore
 import requests
 import sseclient  # type: ignore
 
+from lansync.database import atomic
 from lansync.session import Session
 from lansync.common import NodeEvent, NodeOperation
 from lansync.models import RemoteNode, Namespace
 from lansync.serializers import NodeEventSerializer
+from lansync.util.interval import AdaptiveInterval
+from lansync.util.timeout import Timeout
 
 
 class RemoteUrl:
@@ -25,6 +32,9 @@ class RemoteUrl:
     def events(self, **qs) -> str:
         return self.build_url(f"/namespace/{self.session.namespace}/events", **qs)
 
+    def feed(self, **qs) -> str:
+        return self.build_url(f"/namespace/{self.session.namespace}/feed", **qs)
+
 
 class RemoteClient:
     def __init__(self, session: Session):
@@ -45,16 +55,36 @@ class RemoteClient:
         response = requests.post(self.remote_url.events(), json=data)
         response.raise_for_status()
 
-    def track_events(self):
-        response = requests.get(f"/namespace/{self.session.namespace}/feed", stream=True)
+    def track_events(self, min_sequence_number: int = 0) -> Iterator[List[NodeEvent]]:
+        """Yields batches of events pushed by the server, starting at `min_sequence_number`."""
+        response = requests.get(
+            self.remote_url.feed(min_sequence_number=min_sequence_number),
+            stream=True,
+            # The server sends a keepalive comment when it has nothing else to send
+            timeout=(5, settings.FEED_KEEPALIVE * 2),
+        )
+        response.raise_for_status()
         client = sseclient.SSEClient(response)
-        for event in client.events():
-            data = NodeEventSerializer().load(json.loads(event.data), many=True)
-            events = [NodeEvent(**d) for d in data]
-            print(events)
+        try:
+            for event in client.events():
+                data = NodeEventSerializer().load(json.loads(event.data), many=True)
+                yield [NodeEvent(**d) for d in data]
+        finally:
+            client.close()
 
 
 class RemoteEventHandler:
+    """Applies remote events to the stored remote nodes.
+
+    The feed thread and the refreshes of the sync worker apply events of the
+    same namespace concurrently. Both go through `lock` and skip events at or
+    below the last applied sequence number, so a batch that the other thread
+    already applied is never replayed over newer events.
+    """
+
+    lock = threading.RLock()
+    applied: Dict[str, int] = {}
+
     def __init__(self, session: Session):
         self.session = session
 
@@ -85,9 +115,163 @@ class RemoteEventHandler:
             .execute()
         )
 
-    def handle_new_events(self):
-        namespace = Namespace.by_name(self.session.namespace)  # type: ignore
-        max_sequence_number = RemoteNode.max_sequence_number(namespace)  # type: ignore
-        events = RemoteClient(self.session).fetch_events(max_sequence_number)
-        for event in events:
-            self.handle(event)
+    def last_sequence_number(self) -> Optional[int]:
+        with self.lock:
+            if self.session.namespace not in self.applied:
+                namespace = Namespace.by_name(self.session.namespace)  # type: ignore
+                max_sequence_number = RemoteNode.max_sequence_number(namespace)  # type: ignore
+                if max_sequence_number is None:
+                    return None
+                self.applied[self.session.namespace] = max_sequence_number
+            return self.applied[self.session.namespace]
+
+    def handle_events(self, events: List[NodeEvent]) -> List[NodeEvent]:
+        """Applies the events that are not applied yet and returns them."""
+        with self.lock:
+            last_sequence_number = self.last_sequence_number()
+            if last_sequence_number is not None:
+                events = [event for event in events if event.sequence_number > last_sequence_number]
+            if not events:
+                return []
+            with atomic():
+                for event in events:
+                    self.handle(event)
+            self.applied[self.session.namespace] = max(event.sequence_number for event in events)
+            return events
+
+    def handle_new_events(self) -> List[NodeEvent]:
+        with self.lock:
+            events = RemoteClient(self.session).fetch_events(self.last_sequence_number())
+            return self.handle_events(events)
+
+
+class EventPublisher:
+    """Pushes the events of many sync actions in few requests.
+
+    Events are pushed once `max_events` are pending, `max_delay` seconds
+    after the first pending one or on `flush`. Every push is followed by one
+    incremental refresh of the remote nodes. `on_published` callbacks run
+    once the event has reached the server. Failed pushes are retried with a
+    growing delay, up to `max_retry_delay`.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        max_events: int = settings.PUBLISH_MAX_EVENTS,
+        max_delay: float = settings.PUBLISH_MAX_DELAY,
+        max_retry_delay: float = settings.PUBLISH_MAX_RETRY_DELAY,
+    ):
+        self.session = session
+        self.max_events = max_events
+        self.pending: List[Tuple[NodeEvent, Optional[Callable[[], None]]]] = []
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.retry_interval = AdaptiveInterval(
+            min_interval=max_delay,
+            max_interval=max(max_delay, max_retry_delay),
+            max_share=1.0,
+        )
+        self.timeout = Timeout(self.flush_in_background, interval=max_delay)
+
+    def publish(self, event: NodeEvent, on_published: Optional[Callable[[], None]] = None) -> None:
+        with self.lock:
+            self.pending.append((event, on_published))
+            count = len(self.pending)
+            if count == 1 and not self.timeout.running:
+                self.timeout.restart()
+        if count >= self.max_events:
+            self.flush_in_background()
+
+    def flush(self) -> List[NodeEvent]:
+        """Pushes the pending events and returns the events of the refresh.
+
+        Events that could not be pushed stay pending and the error is raised.
+        """
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                self.timeout.stop()
+            if not pending:
+                return []
+            try:
+                RemoteClient(self.session).push_events([event for event, _ in pending])
+            except Exception:
+                with self.lock:
+                    self.pending[:0] = pending
+                    self.timeout.interval = self.retry_interval.record_cycle(0.0, found_work=False)
+                    self.timeout.restart()
+                raise
+            self.timeout.interval = self.retry_interval.reset("published")
+            logging.info("[PUBLISH] Pushed %d events", len(pending))
+            for event, on_published in pending:
+                if on_published is None:
+                    continue
+                try:
+                    on_published()
+                except Exception as error:
+                    logging.warning("[PUBLISH] Callback of [%s] failed: %r", event.path, error)
+            return RemoteEventHandler(self.session).handle_new_events()
+
+    def flush_in_background(self) -> None:
+        try:
+            self.flush()
+        except Exception as error:
+            logging.warning(
+                "[PUBLISH] Pushing events failed, retrying in %.1fs: %r", self.timeout.interval, error
+            )
+
+    @property
+    def empty(self) -> bool:
+        return not self.pending
+
+
+class RemoteEventFeed:
+    """Applies events pushed by the server feed in a background thread.
+
+    `on_events` is called from the feed thread with every applied batch. The
+    thread reconnects with a growing delay and resumes after the last event
+    it has seen.
+    """
+
+    def __init__(self, session: Session, on_events: Callable[[List[NodeEvent]], None]):
+        self.session = session
+        self.on_events = on_events
+        self.running = False
+        self.connected = False
+
+    def start(self) -> None:
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self) -> None:
+        self.running = False
+
+    def run(self) -> None:
+        handler = RemoteEventHandler(self.session)
+        next_sequence_number: Optional[int] = None
+        retry_delay = 1.0
+        while self.running:
+            try:
+                if next_sequence_number is None:
+                    last_sequence_number = handler.last_sequence_number()
+                    next_sequence_number = 0 if last_sequence_number is None else last_sequence_number + 1
+                for events in RemoteClient(self.session).track_events(next_sequence_number):
+                    if not self.connected:
+                        logging.info("[FEED] Connected to remote feed")
+                        self.connected = True
+                        retry_delay = 1.0
+                    if not self.running:
+                        break
+                    if not events:
+                        continue
+                    applied = handler.handle_events(events)
+                    next_sequence_number = max(event.sequence_number for event in events) + 1
+                    if applied:
+                        self.on_events(applied)
+            except Exception as error:
+                logging.warning("[FEED] Remote feed failed: %r", error)
+            self.connected = False
+            if self.running:
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, settings.REMOTE_FEED_MAX_RETRY_DELAY)
@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+from itertools import chain
+import logging
+import os
+from stat import S_ISDIR, S_ISREG
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from dynaconf import settings  # type: ignore
+
+from lansync.database import atomic
+from lansync.common import FileId
+from lansync.models import ContentCache, LocalFileState, RootFolder
+from lansync.session import Session
+from lansync.util.file import relative_path, walk_folder
+from lansync.util.ignore import IgnoreRules, RootIgnoreRules
+
+
+class FileState(NamedTuple):
+    st_dev: int
+    st_ino: int
+    st_size: int
+    st_mtime_ns: int
+    st_ctime_ns: int
+
+    @classmethod
+    def from_stat(cls, stat: os.stat_result) -> FileState:
+        return cls(stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns)
+
+    @classmethod
+    def from_model(cls, model: LocalFileState) -> FileState:
+        return cls(model.device, model.inode, model.size, model.mtime_ns, model.ctime_ns)
+
+
+def file_id(state: FileState) -> FileId:
+    return FileId(state.st_dev, state.st_ino, state.st_size, state.st_mtime_ns)
+
+
+class ScanResult(NamedTuple):
+    new: List[Tuple[str, FileState]]
+    changed: List[Tuple[str, FileState]]
+    vanished: List[str]
+
+    @property
+    def empty(self) -> bool:
+        return not (self.new or self.changed or self.vanished)
+
+
+class LocalScanner:
+    """Detects local changes by comparing stat data against a persistent cache.
+
+    Paths are relative to the session root folder in posix form, the same as
+    `LocalNode.path`.
+    """
+
+    states: Optional[Dict[str, FileState]]
+
+    def __init__(self, session: Session, ignore_file: str = settings.IGNORE_FILE):
+        self.session = session
+        self.states = None
+        # Downloads in progress are written below the partial folder
+        self.ignore_rules = RootIgnoreRules(
+            session.root_folder.path, ignore_file, builtin=[f"/{settings.PARTIAL_FOLDER}/"]
+        )
+
+    @property
+    def root_folder(self):
+        return self.session.root_folder.path
+
+    def load(self) -> Dict[str, FileState]:
+        if self.states is None:
+            root_folder = RootFolder.for_session(self.session)
+            self.states = {
+                row.path: FileState.from_model(row)
+                for row in LocalFileState.select().where(LocalFileState.root_folder == root_folder)
+            }
+        return self.states
+
+    def ignored(self, path: str, is_dir: bool = False) -> bool:
+        return self.ignore_rules.current().ignored(path, is_dir)
+
+    def prune(self, rules: IgnoreRules):
+        """Returns a `walk_folder` prune callback, or None when nothing is ignored."""
+        if not rules.any_rules:
+            return None
+        root_fspath = self.session.root_folder.fspath
+        return lambda fspath, is_dir: rules.match(relative_path(fspath, root_fspath), is_dir)
+
+    def iter_stats(self) -> Iterable[Tuple[str, os.stat_result]]:
+        root_fspath = self.session.root_folder.fspath
+        prune = self.prune(self.ignore_rules.current())
+        for local_fspath, stat in walk_folder(self.root_folder, prune=prune):
+            yield relative_path(local_fspath, root_fspath), stat
+
+    def scan(self) -> ScanResult:
+        states = self.load()
+        seen = set()
+        new, changed = [], []
+        for path, stat in self.iter_stats():
+            seen.add(path)
+            state = FileState.from_stat(stat)
+            old_state = states.get(path)
+            if old_state is None:
+                new.append((path, state))
+            elif old_state != state:
+                changed.append((path, state))
+        vanished = [path for path in states.keys() if path not in seen]
+        return self.apply(ScanResult(new, changed, vanished))
+
+    def rescan(self, paths: Iterable[str]) -> ScanResult:
+        """Checks only `paths`; a folder path covers everything below it."""
+        states = self.load()
+        root_fspath = self.session.root_folder.fspath
+        rules = self.ignore_rules.current()
+        prune = self.prune(rules)
+        current: Dict[str, FileState] = {}
+        checked: Set[str] = set()
+        for path in set(paths):
+            checked.add(path)
+            try:
+                stat = os.stat(self.root_folder / path)
+            except OSError:
+                stat = None
+            if stat is not None and rules.ignored(path, S_ISDIR(stat.st_mode)):
+                stat = None
+            if stat is not None and S_ISREG(stat.st_mode):
+                current[path] = FileState.from_stat(stat)
+                continue
+
+            prefix = path + "/"
+            checked.update(p for p in states.keys() if p.startswith(prefix))
+            if stat is not None and S_ISDIR(stat.st_mode):
+                for local_fspath, file_stat in walk_folder(self.root_folder / path, prune=prune):
+                    file_path = relative_path(local_fspath, root_fspath)
+                    checked.add(file_path)
+                    current[file_path] = FileState.from_stat(file_stat)
+
+        new, changed, vanished = [], [], []
+        for path in checked:
+            state, old_state = current.get(path), states.get(path)
+            if state is None:
+                if old_state is not None:
+                    vanished.append(path)
+            elif old_state is None:
+                new.append((path, state))
+            elif old_state != state:
+                changed.append((path, state))
+        return self.apply(ScanResult(new, changed, vanished))
+
+    def apply(self, result: ScanResult) -> ScanResult:
+        if result.empty:
+            return result
+
+        states = self.load()
+        ContentCache.forget(
+            file_id(states[path])
+            for path in chain(result.vanished, (p for p, _ in result.changed))
+            if path in states
+        )
+        for path in result.vanished:
+            states.pop(path, None)
+        for path, state in result.new + result.changed:
+            states[path] = state
+
+        logging.info(
+            "[SCAN] new: %d, changed: %d, vanished: %d",
+            len(result.new), len(result.changed), len(result.vanished)
+        )
+        self.save(result)
+        return result
+
+    def save(self, result: ScanResult) -> None:
+        root_folder = RootFolder.for_session(self.session)
+        with atomic():
+            removed = result.vanished + [path for path, _ in result.changed]
+            for offset in range(0, len(removed), 500):
+                (
+                    LocalFileState.delete()
+                    .where(
+                        LocalFileState.root_folder == root_folder,
+                        LocalFileState.path.in_(removed[offset:offset + 500])
+                    )
+                    .execute()
+                )
+            rows = [
+                {
+                    "root_folder": root_folder,
+                    "path": path,
+                    "device": state.st_dev,
+                    "inode": state.st_ino,
+                    "size": state.st_size,
+                    "mtime_ns": state.st_mtime_ns,
+                    "ctime_ns": state.st_ctime_ns,
+                }
+                for path, state in result.new + result.changed
+            ]
+            for offset in range(0, len(rows), 100):
+                LocalFileState.insert_many(rows[offset:offset + 100]).execute()
@@ -11,7 +11,7 @@ from werkzeug.serving import make_server, run_simple, WSGIRequestHandler
 
 from lansync.models import NodeChunk
 from lansync.market import Market
-from lansync.session import instance as session
+from lansync.daemon import instance as daemon
 
 
 class WSGIRequestHandlerHTTP11(WSGIRequestHandler):
@@ -27,10 +27,12 @@ app = Flask(__name__)
 @app.route("/market/<namespace_name>/<key>", methods=["POST"])
 def exchange(namespace_name, key):
     market = Market.load_from_file(request.stream)
-    own_market_exists = Market.load_from_db(namespace_name, key) is not None
+    own_market = Market.load_from_db(namespace_name, key)
     market.exchange_with_db()
-    if not own_market_exists:
-        session.sync_worker.schedule_event("scheduled_sync")
+    if own_market is None:
+        daemon.schedule_sync(namespace_name)
+    if own_market is None or own_market.peers != market.peers:
+        daemon.gossip_market(namespace_name, key)
     fd = BytesIO()
     market.dump_to_file(fd)
     fd.seek(os.SEEK_SET)
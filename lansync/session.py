@@ -3,13 +3,12 @@ from __future__ import annotations
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any
+from typing import Any, Optional
 
 from dynaconf import settings  # type: ignore
 
 from lansync.discovery import PeerRegistry
 from lansync.stats import Stats
-from lansync.util.lazy_object import LazyObject
 
 
 @dataclass
@@ -32,20 +31,33 @@ class Session:
     peer_registry: PeerRegistry
     client_pool: Any
     stats: Stats
+    event_publisher: Any = None
+    market_gossip: Any = None
 
     @classmethod
-    def create(cls, namespace: str, root_folder: str, device_id: str) -> Session:
+    def create(
+        cls,
+        namespace: str,
+        root_folder: str,
+        device_id: str,
+        peer_registry: Optional[PeerRegistry] = None,
+        client_pool: Any = None,
+        stats: Optional[Stats] = None,
+    ) -> Session:
+        """Sessions of one daemon pass in the registry, pool and stats they share."""
         from lansync.client import ClientPool
+        from lansync.gossip import MarketGossip
+        from lansync.remote import EventPublisher
 
-        return cls(
+        session = cls(
             namespace=namespace,
             root_folder=RootFolder.create(root_folder),
             remote_server_url=settings.REMOTE_SERVER_URL,
             device_id=device_id,
-            peer_registry=PeerRegistry(),
-            client_pool=ClientPool(settings.CLIENTS_PER_PEER),
-            stats=Stats(device_id)
+            peer_registry=peer_registry or PeerRegistry(),
+            client_pool=client_pool or ClientPool(settings.CLIENTS_PER_PEER),
+            stats=stats or Stats(device_id)
         )
-
-
-instance = LazyObject()
+        session.event_publisher = EventPublisher(session)
+        session.market_gossip = MarketGossip(session)
+        return session
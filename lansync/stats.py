@@ -34,6 +34,15 @@ class Stats:
             to_peer=self.device_id
         )
 
+    def emit_sync_interval(self, namespace: str, interval: float, reason: str):
+        self.logger.info(json.dumps({
+            "namespace": namespace,
+            "event": "sync_interval",
+            "device_id": self.device_id,
+            "interval": interval,
+            "reason": reason,
+        }))
+
     def emit_event(self, key: EventKey, **event):
         key = EventKey(*key)
         data = {
@@ -1,123 +1,501 @@
+from bisect import bisect_left, insort
+from concurrent.futures import Executor
 import enum
 from functools import partial
-from itertools import chain, groupby
+import heapq
+from itertools import chain, groupby, islice
 import logging
+from operator import attrgetter
 from queue import Queue
-from typing import Callable, Any, List, Iterable
+import time
+from typing import Callable, Any, Dict, List, Iterable, Iterator, Optional, Set
+
+from dynaconf import settings  # type: ignore
 
 from lansync.session import Session
-from lansync.models import RemoteNode, StoredNode, Namespace
+from lansync.models import RemoteNode, RemoteNodeRecord, StoredNode, StoredNodeRecord, Namespace
 from lansync.node import LocalNode
-from lansync.sync_action import SyncActionExecutor, SyncAction
+from lansync.sync_action import (ActionPlan, SyncAction, SyncActionExecutor, SyncActionScheduler,
+                                 SyncProgress, priority_policy)
 from lansync.sync_logic import handle_node
-from lansync.remote import RemoteEventHandler
+from lansync.remote import RemoteEventFeed, RemoteEventHandler
+from lansync.checksum import ChecksumService
+from lansync.scanner import LocalScanner, ScanResult
+from lansync.watcher import FolderWatcher
+from lansync.util.interval import AdaptiveInterval
 from lansync.util.timeout import Timeout
 from lansync.util.row import Row
-from lansync.util.file import iter_folder
+from lansync.util.file import hash_path, walk_folder
 
 
 class SyncWorkerEvent(str, enum.Enum):
     SCHEDULED_SYNC = "scheduled_sync"
     SYNC_ACTION = "sync_action"
+    LOCAL_CHANGE = "local_change"
+    REMOTE_CHANGE = "remote_change"
+    FULL_SYNC = "full_sync"
 
 
 class SyncWorker:
-    def __init__(self, session: Session) -> None:
+    def __init__(
+        self,
+        session: Session,
+        checksum_service: Optional[ChecksumService] = None,
+        action_pool: Optional[Executor] = None,
+    ) -> None:
         self.session = session
 
+        self.sync_interval = AdaptiveInterval(
+            min_interval=settings.SYNC_MIN_INTERVAL,
+            max_interval=settings.SYNC_MAX_INTERVAL,
+            factor=settings.SYNC_BACKOFF_FACTOR,
+            max_share=settings.SYNC_MAX_CPU_SHARE,
+        )
         self.sync_timeout = Timeout(
-            partial(self.schedule_event, SyncWorkerEvent.SCHEDULED_SYNC), interval=3
+            partial(self.schedule_event, SyncWorkerEvent.SCHEDULED_SYNC),
+            interval=self.sync_interval.interval
+        )
+        self.local_change_timeout = Timeout(
+            partial(self.schedule_event, SyncWorkerEvent.SCHEDULED_SYNC),
+            interval=settings.LOCAL_CHANGE_DELAY
         )
 
-        self.sync_action_producer = SyncActionProducer(session)
+        self.sync_action_producer = SyncActionProducer(session, checksum_service=checksum_service)
         self.sync_action_executor = SyncActionExecutor(session)
+        self.sync_action_scheduler = SyncActionScheduler(
+            self.sync_action_executor,
+            on_idle=partial(self.schedule_event, SyncWorkerEvent.SYNC_ACTION),
+            on_complete=self.on_action_complete,
+            pool=action_pool,
+        )
+        self.priority = priority_policy()
+        self.progress: Optional[SyncProgress] = None
 
         self.event_queue: Any = Queue()
-        self.sync_actions: List[Callable] = []
+        self.sync_actions = ActionPlan()
 
-    def schedule_event(self, event: SyncWorkerEvent) -> None:
-        self.event_queue.put(event)
+        self.watcher: Optional[FolderWatcher] = None
+        if settings.WATCH_LOCAL_CHANGES and FolderWatcher.available():
+            self.watcher = FolderWatcher(
+                session.root_folder.fspath,
+                on_change=partial(self.schedule_event, SyncWorkerEvent.LOCAL_CHANGE),
+                on_overflow=partial(self.schedule_event, SyncWorkerEvent.FULL_SYNC),
+                ignored=self.sync_action_producer.local_scanner.ignored,
+            )
+        self.remote_feed: Optional[RemoteEventFeed] = None
+        if settings.REMOTE_FEED:
+            self.remote_feed = RemoteEventFeed(
+                session,
+                on_events=lambda events: self.schedule_event(
+                    SyncWorkerEvent.REMOTE_CHANGE, *(event.key for event in events)
+                ),
+            )
+        self.dirty_paths: Set[str] = set()
+        self.dirty_keys: Set[str] = set()
+        self.full_sync_needed = True
+        self.last_full_sync = 0.0
+
+    def schedule_event(self, event: SyncWorkerEvent, *args) -> None:
+        self.event_queue.put((event, args))
 
     def run(self):
+        if self.watcher is not None:
+            self.watcher.start()
+        if self.remote_feed is not None:
+            self.remote_feed.start()
+        if self.session.market_gossip is not None:
+            self.session.market_gossip.start()
         self.schedule_event(SyncWorkerEvent.SCHEDULED_SYNC)
 
         while True:
-            event = self.event_queue.get()
+            event, args = self.event_queue.get()
             if event == SyncWorkerEvent.SCHEDULED_SYNC:
                 logging.info("[SYNC] Executing scheduled sync")
                 self.do_sync()
             elif event == SyncWorkerEvent.SYNC_ACTION:
                 self.do_sync_action()
+            elif event == SyncWorkerEvent.LOCAL_CHANGE:
+                self.on_local_change(*args)
+            elif event == SyncWorkerEvent.REMOTE_CHANGE:
+                self.on_remote_change(*args)
+            elif event == SyncWorkerEvent.FULL_SYNC:
+                self.full_sync_needed = True
+                self.on_local_change()
 
     def run_once(self):
         logging.info("[SYNC] Running sync")
         self.sync_actions = self.sync_action_producer.produce()
-        logging.info("[SYNC] Sync produced actions: %r", self.sync_actions)
-        for action in self.sync_actions:
-            logging.info("[SYNC] Executing sync action: %r", action)
-            self.sync_action_executor.do_action(action)
+        self.sync_actions.prioritize(self.priority)
+        logging.info("[SYNC] Sync plan: %s", self.sync_actions.summary())
+        self.progress = SyncProgress(len(self.sync_actions))
+        self.sync_action_scheduler.submit_all(self.sync_actions)
+        self.sync_action_scheduler.join()
+        self.flush_events()
+        if self.session.market_gossip is not None:
+            self.session.market_gossip.drain()
+        logging.info("[SYNC] Sync progress: %s", self.progress.summary())
+
+    @property
+    def full_sync_due(self) -> bool:
+        return (
+            self.watcher is None
+            or self.full_sync_needed
+            or time.monotonic() - self.last_full_sync >= settings.FULL_SYNC_INTERVAL
+        )
+
+    def on_local_change(self, *paths: str) -> None:
+        if settings.IGNORE_FILE in paths:
+            self.full_sync_needed = True
+        self.dirty_paths.update(paths)
+        self.sync_interval.reset("local change")
+        self.schedule_changes()
+
+    def on_remote_change(self, *keys: str) -> None:
+        self.dirty_keys.update(keys)
+        self.sync_interval.reset("remote change")
+        self.schedule_changes()
+
+    def schedule_changes(self) -> None:
+        if self.idle and not self.local_change_timeout.running:
+            self.local_change_timeout.start()
+
+    def flush_events(self) -> bool:
+        """Publishes the events of finished actions; keys of refreshed events become dirty."""
+        publisher = self.session.event_publisher
+        if publisher is None:
+            return True
+        try:
+            events = publisher.flush()
+        except Exception as error:
+            logging.warning("[SYNC] Publishing events failed: %r", error)
+            return False
+        self.dirty_keys.update(event.key for event in events)
+        return True
 
     def do_sync(self):
         self.sync_timeout.stop()
-        logging.info("[SYNC] Running sync")
-        self.sync_actions = self.sync_action_producer.produce()
-        logging.info("[SYNC] Sync produced actions: %r", self.sync_actions)
+        self.local_change_timeout.stop()
+        # Decisions on nodes whose events are still pending would undo the actions
+        if not self.flush_events():
+            self.sync_timeout.start()
+            return
+        start = time.monotonic()
+        if self.full_sync_due:
+            logging.info("[SYNC] Running full sync")
+            self.full_sync_needed = False
+            self.last_full_sync = time.monotonic()
+            self.dirty_paths = set()
+            self.dirty_keys = set()
+            self.sync_actions = self.sync_action_producer.produce()
+        else:
+            logging.info(
+                "[SYNC] Running sync for %d changed paths and %d remote changes",
+                len(self.dirty_paths), len(self.dirty_keys)
+            )
+            dirty_paths, self.dirty_paths = self.dirty_paths, set()
+            dirty_keys, self.dirty_keys = self.dirty_keys, set()
+            # Without a live feed new remote events are polled
+            feed_connected = self.remote_feed is not None and self.remote_feed.connected
+            self.sync_actions = self.sync_action_producer.produce_changes(
+                dirty_paths, dirty_keys if feed_connected else None
+            )
+        self.sync_actions.prioritize(self.priority)
+        logging.info("[SYNC] Sync plan: %s", self.sync_actions.summary())
+        self.sync_interval.record_cycle(time.monotonic() - start, found_work=bool(self.sync_actions))
         self.schedule_event(SyncWorkerEvent.SYNC_ACTION)
 
+    def on_action_complete(self, action: SyncAction) -> None:
+        progress = self.progress
+        if progress is not None:
+            progress.complete(action)
+
+    @property
+    def idle(self) -> bool:
+        return not self.sync_actions and self.sync_action_scheduler.idle
+
     def do_sync_action(self):
         if self.sync_actions:
-            action = self.sync_actions.pop(0)
-            logging.info("[SYNC] Executing sync action: %r", action)
-            self.sync_action_executor.do_action(action)
-            self.schedule_event(SyncWorkerEvent.SYNC_ACTION)
+            actions, self.sync_actions = self.sync_actions, ActionPlan()
+            self.progress = SyncProgress(len(actions))
+            # on_idle schedules the next SYNC_ACTION once they have finished
+            self.sync_action_scheduler.submit_all(actions)
+            return
+        elif not self.sync_action_scheduler.idle:
+            return
+
+        self.flush_events()
+        if self.progress is not None:
+            logging.info("[SYNC] Sync progress: %s", self.progress.summary())
+            self.progress = None
+        if self.dirty_paths or self.dirty_keys or self.full_sync_needed:
+            logging.info("[SYNC] Local changes pending")
+            self.local_change_timeout.start()
         else:
-            logging.info("[SYNC] Starting timer")
+            interval = self.sync_interval
+            logging.info("[SYNC] Starting timer: %.1fs (%s)", interval.interval, interval.reason)
+            self.session.stats.emit_sync_interval(self.session.namespace, interval.interval, interval.reason)
+            self.sync_timeout.interval = interval.interval
             self.sync_timeout.start()
 
 
 class NodeRow(Row):
-    value_types = [RemoteNode, LocalNode, StoredNode]
+    value_types = [(RemoteNode, RemoteNodeRecord), LocalNode, (StoredNode, StoredNodeRecord)]  # type: ignore
+
+
+node_key = attrgetter("key")
+
+
+def merge_node_rows(*sources: Iterable[Any]) -> Iterator[NodeRow]:
+    """Merges node streams that are each sorted by key into one row per key."""
+    for key, nodes in groupby(heapq.merge(*sources, key=node_key), key=node_key):
+        yield NodeRow.create(key, nodes)
 
 
 class SyncActionProducer:
-    def __init__(self, session: Session):
+    def __init__(
+        self,
+        session: Session,
+        incremental: bool = settings.INCREMENTAL_SCAN,
+        checksum_service: Optional[ChecksumService] = None,
+    ):
         self.session = session
+        self.incremental = incremental
+        self.local_scanner = LocalScanner(session)
+        self.local_nodes: Optional[Dict[str, LocalNode]] = None
+        self.local_keys: List[str] = []
+        self.checksum_service = checksum_service or ChecksumService()
 
-    def produce(self) -> List[SyncAction]:
-        remote_nodes = handle_remote_events(self.session)
-        stored_nodes = fetch_stored_nodes(self.session)
-        local_nodes = scan_local_files(self.session)
-
-        all_nodes = list(chain(remote_nodes, local_nodes, stored_nodes))
-        all_nodes.sort(key=lambda n: n.key)  # type: ignore
-        rows = [
-            NodeRow.create(key, nodes)
-            for key, nodes in groupby(all_nodes, key=lambda n: n.key)  # type: ignore
-        ]
-        actions = []
-        for _, remote, local, stored in rows:
-            actions.append(handle_node(remote, local, stored))
+    def produce(self) -> ActionPlan:
+        """Streams decisions from a merge-join of the key-ordered node sources."""
+        plan = ActionPlan()
+        with plan.phase("remote"):
+            RemoteEventHandler(self.session).handle_new_events()
+        with plan.phase("scan"):
+            if self.incremental:
+                local_nodes: Iterable[LocalNode] = self.scan_local_changes()
+            else:
+                prune = self.local_scanner.prune(self.local_scanner.ignore_rules.current())
+                local_nodes = sorted(scan_local_files(self.session, prune=prune), key=node_key)
 
-        return actions
+        with plan.phase("decide"):
+            self.handle_rows(merge_node_rows(
+                self.skip_ignored(iter_remote_nodes(self.session)),
+                local_nodes,
+                self.skip_ignored(iter_stored_nodes(self.session)),
+            ), plan)
+        return plan
+
+    def produce_changes(self, paths: Set[str], remote_keys: Optional[Set[str]] = None) -> ActionPlan:
+        """Re-evaluates only keys touched by `paths` or by remote events.
+
+        `remote_keys` are keys of events that were already applied, usually by
+        the remote feed; when it is None new remote events are polled.
+        """
+        if not self.incremental:
+            return self.produce()
+
+        plan = ActionPlan()
+        if remote_keys is None:
+            with plan.phase("remote"):
+                events = RemoteEventHandler(self.session).handle_new_events()
+                remote_keys = {event.key for event in events}
+        with plan.phase("scan"):
+            local_nodes = self.load_local_nodes()
+            result = self.local_scanner.rescan(paths)
+            self.apply_scan_result(result)
 
+        keys = set(remote_keys)
+        keys.update(hash_path(path) for path in paths)
+        keys.update(hash_path(path) for path in result.vanished)
+        keys.update(hash_path(path) for path, _ in chain(result.new, result.changed))
 
-def fetch_stored_nodes(session: Session) -> List[StoredNode]:
+        with plan.phase("decide"):
+            nodes = sorted(chain(
+                self.skip_ignored(fetch_remote_nodes(self.session, keys)),
+                (local_nodes[key] for key in keys if key in local_nodes),
+                self.skip_ignored(fetch_stored_nodes(self.session, keys)),
+            ), key=node_key)
+            self.handle_rows(merge_node_rows(nodes), plan)
+        return plan
+
+    def skip_ignored(self, nodes: Iterable[Any]) -> Iterable[Any]:
+        """Ignored paths are left alone on both sides, never deleted."""
+        rules = self.local_scanner.ignore_rules.current()
+        if not rules.any_rules:
+            return nodes
+        return (node for node in nodes if not rules.ignored(node.path))
+
+    def handle_rows(
+        self,
+        rows: Iterable[NodeRow],
+        plan: ActionPlan,
+        batch_size: int = settings.SYNC_BATCH_SIZE,
+    ) -> None:
+        for batch in iter_batches((tuple(row) for row in rows), batch_size):
+            with plan.phase("checksum"):
+                needed = [
+                    local for _, remote, local, stored in batch
+                    if needs_local_checksum(remote, local, stored)
+                ]
+                self.checksum_service.checksum_nodes(needed)
+            # Files that could not be read are decided in a later cycle
+            unread = {local.key for local in needed if local._checksum is None}
+            if unread:
+                logging.info("[SYNC] Skipping %d files that could not be read", len(unread))
+                batch = [row for row in batch if row[0] not in unread]
+            actions = [handle_node(remote, local, stored) for _, remote, local, stored in batch]
+            with plan.phase("load"):
+                plan.extend(load_full_nodes(actions))
+
+    def load_local_nodes(self) -> Dict[str, LocalNode]:
+        if self.local_nodes is None:
+            root_folder = self.session.root_folder.path
+            self.local_nodes = {
+                node.key: node
+                for node in (
+                    LocalNode.create(root_folder / path, self.session, stat=state)
+                    for path, state in self.local_scanner.load().items()
+                )
+            }
+            self.local_keys = sorted(self.local_nodes.keys())
+        return self.local_nodes
+
+    def apply_scan_result(self, result: ScanResult) -> None:
+        local_nodes = self.load_local_nodes()
+        root_folder = self.session.root_folder.path
+        removed = set()
+        for path in result.vanished:
+            key = hash_path(path)
+            if local_nodes.pop(key, None) is not None:
+                removed.add(key)
+        added = []
+        for path, state in chain(result.new, result.changed):
+            node = LocalNode.create(root_folder / path, self.session, stat=state)
+            if node.key not in local_nodes:
+                added.append(node.key)
+            local_nodes[node.key] = node
+        self.local_keys = update_sorted_keys(self.local_keys, added, removed)
+
+    def scan_local_changes(self) -> Iterable[LocalNode]:
+        """Returns the local nodes in key order."""
+        local_nodes = self.load_local_nodes()
+        self.apply_scan_result(self.local_scanner.scan())
+        return (local_nodes[key] for key in self.local_keys)
+
+
+def needs_local_checksum(
+    remote: Optional[RemoteNode], local: Optional[LocalNode], stored: Optional[StoredNode]
+) -> bool:
+    """Mirrors the branches of `handle_node` that compare the local checksum."""
+    if not remote or not local:
+        return False
+    return stored is None or (stored.ready and local.updated(stored))
+
+
+def update_sorted_keys(
+    keys: List[str], added: List[str], removed: Set[str], bisect_max_changes: int = 64
+) -> List[str]:
+    """Updates sorted `keys` in place for a few changes, a big change set is merged in one pass."""
+    if len(added) + len(removed) <= bisect_max_changes:
+        for key in removed:
+            del keys[bisect_left(keys, key)]
+        for key in added:
+            insort(keys, key)
+        return keys
+    kept = (key for key in keys if key not in removed) if removed else keys
+    return list(heapq.merge(kept, sorted(added)))
+
+
+def iter_batches(items: Iterable[Any], batch_size: int = 500) -> Iterator[List[Any]]:
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def iter_stored_nodes(session: Session) -> Iterator[StoredNodeRecord]:
     namespace = Namespace.by_name(session.namespace)  # type: ignore
-    return list(
-        StoredNode.select().where(StoredNode.namespace == namespace)
+    query = (
+        StoredNodeRecord.select()
+        .where(StoredNode.namespace == namespace)
+        .order_by(StoredNode.key)
     )
+    return map(StoredNodeRecord._make, query.tuples().iterator())
 
 
-def handle_remote_events(session: Session) -> List[RemoteNode]:
-    RemoteEventHandler(session).handle_new_events()
-
+def iter_remote_nodes(session: Session) -> Iterator[RemoteNodeRecord]:
     namespace = Namespace.by_name(session.namespace)  # type: ignore
-    return list(
-        RemoteNode.select().where(RemoteNode.namespace == namespace)
+    query = (
+        RemoteNodeRecord.select()
+        .where(RemoteNode.namespace == namespace)
+        .order_by(RemoteNode.key)
     )
+    return map(RemoteNodeRecord._make, query.tuples().iterator())
+
+
+def fetch_stored_nodes(session: Session, keys: Iterable[str]) -> List[StoredNodeRecord]:
+    namespace = Namespace.by_name(session.namespace)  # type: ignore
+    return [
+        StoredNodeRecord._make(row)
+        for batch in iter_batches(keys)
+        for row in StoredNodeRecord.select().where(
+            StoredNode.namespace == namespace, StoredNode.key.in_(batch)
+        ).tuples()
+    ]
+
+
+def fetch_remote_nodes(session: Session, keys: Iterable[str]) -> List[RemoteNodeRecord]:
+    namespace = Namespace.by_name(session.namespace)  # type: ignore
+    return [
+        RemoteNodeRecord._make(row)
+        for batch in iter_batches(keys)
+        for row in RemoteNodeRecord.select().where(
+            RemoteNode.namespace == namespace, RemoteNode.key.in_(batch)
+        ).tuples()
+    ]
+
+
+def load_full_nodes(actions: List[SyncAction]) -> List[SyncAction]:
+    """Swaps the records of the decision phase in `actions` for full model rows.
+
+    Only rows that need work get their signature and chunk columns loaded.
+    Actions whose rows are gone by now are dropped; the next cycle sees that.
+    """
+    record_models = {StoredNodeRecord: StoredNode, RemoteNodeRecord: RemoteNode}
+    ids: Dict[Any, Set[int]] = {record_type: set() for record_type in record_models}
+    for sync_action in actions:
+        for arg in sync_action.action.args:  # type: ignore
+            if type(arg) in ids:
+                ids[type(arg)].add(arg.id)
+    if not any(ids.values()):
+        return actions
+
+    models: Dict[Any, Dict[int, Any]] = {
+        record_type: {
+            node.id: node
+            for batch in iter_batches(ids[record_type])
+            for node in model.select().where(model.id.in_(batch))
+        }
+        for record_type, model in record_models.items()
+    }
+
+    result = []
+    for sync_action in actions:
+        action = sync_action.action
+        args = [models[type(arg)].get(arg.id) if type(arg) in models else arg for arg in action.args]  # type: ignore
+        if any(arg is None and old is not None for arg, old in zip(args, action.args)):  # type: ignore
+            logging.info("[SYNC] Skipping [%s] of [%s], its rows changed", sync_action.name, sync_action.path)
+            continue
+        result.append(SyncAction(partial(action.func, *args, **action.keywords)))  # type: ignore
+    return result
 
 
-def scan_local_files(session: Session) -> Iterable[LocalNode]:
+def scan_local_files(
+    session: Session, prune: Optional[Callable[[str, bool], bool]] = None
+) -> Iterable[LocalNode]:
     return (
-        LocalNode.create(p, session) for p in iter_folder(session.root_folder.path)
+        LocalNode.create(path, session, stat=stat)
+        for path, stat in walk_folder(session.root_folder.path, prune=prune)
     )
@@ -1,13 +1,22 @@
+from collections import Counter, deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import contextmanager
 import logging
 from dataclasses import dataclass
 from functools import partial, wraps
-from typing import Callable, Optional
+import math
+from threading import Condition, Lock
+import time
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, Optional, Sequence
+
+from dynaconf import settings  # type: ignore
 
 from lansync.common import NodeEvent, NodeOperation
 from lansync.database import atomic
+from lansync.gossip import pick_peers
 from lansync.node_market import NodeMarket
 from lansync.models import RemoteNode, StoredNode
-from lansync.node import LocalNode, store_new_node, create_node_placeholder
+from lansync.node import LocalNode, PartialNode, discard_partial_download, store_new_node
 from lansync.remote import RemoteClient, RemoteEventHandler
 from lansync.session import Session
 from lansync.util.task import TaskList, Task
@@ -28,7 +37,121 @@ class SyncAction:
         return self.action(*args, **kwargs)
 
     def __repr__(self) -> str:
-        return f"{self.action.func.__name__}({self.action.args, self.action.keywords})"  # type: ignore
+        return f"{self.name}({self.action.args, self.action.keywords})"  # type: ignore
+
+    @property
+    def name(self) -> str:
+        return self.action.func.__name__  # type: ignore
+
+    @property
+    def node(self) -> Any:
+        """The first node argument of the action."""
+        return next((arg for arg in self.action.args if hasattr(arg, "key")), None)  # type: ignore
+
+    @property
+    def key(self) -> Optional[str]:
+        node = self.node
+        return node.key if node is not None else None
+
+    @property
+    def path(self) -> str:
+        return getattr(self.node, "path", "")
+
+    @property
+    def size(self) -> int:
+        return getattr(self.node, "size", None) or 0
+
+    @property
+    def kind(self) -> str:
+        return ACTION_KINDS.get(self.name, "other")
+
+
+ACTION_KINDS = {
+    "download": "download",
+    "upload": "upload",
+    "delete_local": "delete",
+    "delete_remote": "delete",
+    "delete_stored": "delete",
+}
+
+ACTION_RANKS = {"delete": 0, "other": 1, "upload": 2, "download": 2}
+
+Priority = Callable[[SyncAction], Any]
+
+
+def key_priority(action: SyncAction) -> Any:
+    return action.key or ""
+
+
+def size_priority(boost_folders: Iterable[str] = ()) -> Priority:
+    """Deletes first, then files in `boost_folders`, then the smallest files first."""
+    prefixes = tuple(folder.strip("/") + "/" for folder in boost_folders)
+
+    def priority(action: SyncAction) -> Any:
+        path = action.path
+        return (ACTION_RANKS[action.kind], not path.startswith(prefixes), action.size, path)
+
+    return priority
+
+
+def priority_policy(
+    name: str = settings.SYNC_PRIORITY, boost_folders: Iterable[str] = settings.SYNC_PRIORITY_FOLDERS
+) -> Priority:
+    if name == "key":
+        return key_priority
+    elif name == "size":
+        return size_priority(boost_folders)
+    raise ValueError("Unknown sync priority", name)
+
+
+class ActionPlan:
+    """The work produced by one sync cycle.
+
+    Nops are counted but not kept. Phase timings accumulate, so a phase may be
+    entered several times and may nest inside another one.
+    """
+
+    actions: Deque[SyncAction]
+
+    def __init__(self, actions: Iterable[SyncAction] = ()):
+        self.actions = deque()
+        self.counts: Counter = Counter()
+        self.timings: Dict[str, float] = {}
+        self.extend(actions)
+
+    def __len__(self) -> int:
+        return len(self.actions)
+
+    def __iter__(self) -> Iterator[SyncAction]:
+        return iter(self.actions)
+
+    def add(self, action: SyncAction) -> None:
+        self.counts[action.name] += 1
+        if action.name != "nop":
+            self.actions.append(action)
+
+    def extend(self, actions: Iterable[SyncAction]) -> None:
+        for action in actions:
+            self.add(action)
+
+    def popleft(self) -> SyncAction:
+        return self.actions.popleft()
+
+    def prioritize(self, priority: Priority) -> None:
+        self.actions = deque(sorted(self.actions, key=priority))
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.monotonic() - start
+
+    def summary(self) -> str:
+        counts = ", ".join(f"{name}: {count}" for name, count in sorted(self.counts.items()))
+        timings = ", ".join(f"{name}: {seconds:.3f}s" for name, seconds in self.timings.items())
+        return f"{len(self.actions)} actions ({counts or 'none'}) in {timings or '0s'}"
 
 
 class SyncActionExecutor:
@@ -39,6 +162,173 @@ class SyncActionExecutor:
         return action(self.session)
 
 
+class SyncProgress:
+    """Records how long a batch of actions takes to reach each share of completion."""
+
+    def __init__(self, total: int, milestones: Sequence[float] = (0.5, 0.9, 1.0)):
+        self.total = total
+        self.targets = {milestone: max(math.ceil(milestone * total), 1) for milestone in milestones}
+        self.reached: Dict[float, float] = {}
+        self.completed = 0
+        self.start = time.monotonic()
+        self.lock = Lock()
+
+    def complete(self, action: Optional[SyncAction] = None) -> None:
+        with self.lock:
+            self.completed += 1
+            elapsed = time.monotonic() - self.start
+            for milestone, target in self.targets.items():
+                if milestone not in self.reached and self.completed >= target:
+                    self.reached[milestone] = elapsed
+
+    def summary(self) -> str:
+        reached = ", ".join(
+            f"{milestone:.0%}: {seconds:.3f}s" for milestone, seconds in self.reached.items()
+        )
+        return f"{self.completed}/{self.total} actions, time to {reached or 'none'}"
+
+
+def default_action_limits() -> Dict[str, int]:
+    return {
+        "download": settings.SYNC_MAX_DOWNLOADS,
+        "upload": settings.SYNC_MAX_UPLOADS,
+        "delete": settings.SYNC_MAX_DELETES,
+    }
+
+
+class SyncActionScheduler:
+    """Runs sync actions concurrently on one bounded thread pool.
+
+    Actions on the same key run one at a time in submission order, and at most
+    `limits[kind]` actions of a kind run at once; kinds without a limit are
+    only bounded by `max_workers`. Within a kind actions start in submission
+    order. `on_complete` and `on_idle` are called from worker threads, after
+    every action and when the last submitted action has finished.
+    """
+
+    def __init__(
+        self,
+        executor: SyncActionExecutor,
+        max_workers: int = settings.SYNC_WORKERS,
+        limits: Optional[Dict[str, int]] = None,
+        on_idle: Optional[Callable[[], None]] = None,
+        on_complete: Optional[Callable[[SyncAction], None]] = None,
+        pool: Optional[Executor] = None,
+    ):
+        self.executor = executor
+        self.max_workers = max_workers
+        self.limits = default_action_limits() if limits is None else limits
+        self.on_idle = on_idle
+        self.on_complete = on_complete
+        # A shared pool may be busy with the actions of other schedulers
+        self.owns_pool = pool is None
+        self.pool = pool or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sync-action")
+        self.condition = Condition()
+        # Actions waiting behind an earlier action on the same key
+        self.waiting: Dict[Optional[str], Deque[SyncAction]] = {}
+        # Actions free to start, per kind
+        self.ready: Dict[str, Deque[SyncAction]] = {}
+        self.running: Counter = Counter()
+        self.pending = 0
+
+    @property
+    def idle(self) -> bool:
+        with self.condition:
+            return self.pending == 0
+
+    def submit(self, action: SyncAction) -> None:
+        with self.condition:
+            self.pending += 1
+            key = action.key
+            if key is not None and key in self.waiting:
+                self.waiting[key].append(action)
+            else:
+                if key is not None:
+                    self.waiting[key] = deque()
+                self.ready.setdefault(action.kind, deque()).append(action)
+            self.dispatch()
+
+    def submit_all(self, actions: Iterable[SyncAction]) -> None:
+        """Submits `actions` as one batch, so `on_idle` fires only after all of them."""
+        with self.condition:
+            for action in actions:
+                self.submit(action)
+
+    def join(self) -> None:
+        with self.condition:
+            self.condition.wait_for(lambda: self.pending == 0)
+
+    def shutdown(self) -> None:
+        if self.owns_pool:
+            self.pool.shutdown(wait=True)
+
+    def dispatch(self) -> None:
+        """Starts ready actions while there are free slots, taking kinds in turn."""
+        started = True
+        while started and sum(self.running.values()) < self.max_workers:
+            started = False
+            for kind, actions in self.ready.items():
+                if not actions or self.running[kind] >= self.limits.get(kind, self.max_workers):
+                    continue
+                action = actions.popleft()
+                self.running[kind] += 1
+                self.pool.submit(self.run, action)
+                started = True
+                if sum(self.running.values()) >= self.max_workers:
+                    return
+
+    def run(self, action: SyncAction) -> None:
+        logging.info("[SYNC] Executing sync action: %r", action)
+        try:
+            self.executor.do_action(action)
+        except Exception:
+            logging.exception("[SYNC] Sync action failed: %r", action)
+        finally:
+            if self.on_complete is not None:
+                self.on_complete(action)
+            self.complete(action)
+
+    def complete(self, action: SyncAction) -> None:
+        with self.condition:
+            self.running[action.kind] -= 1
+            self.pending -= 1
+            key = action.key
+            if key is not None:
+                waiting = self.waiting[key]
+                if waiting:
+                    following = waiting.popleft()
+                    self.ready.setdefault(following.kind, deque()).append(following)
+                else:
+                    del self.waiting[key]
+            self.dispatch()
+            idle = self.pending == 0
+            if idle:
+                self.condition.notify_all()
+        if idle and self.on_idle is not None:
+            self.on_idle()
+
+
+def spread_market(session: Session, market: NodeMarket) -> None:
+    if session.market_gossip is not None:
+        session.market_gossip.touch(market.key)
+
+
+def publish_event(
+    session: Session, event: NodeEvent, on_published: Optional[Callable[[], None]] = None
+) -> None:
+    """Queues the event on the session publisher, or pushes it right away without one.
+
+    `on_published` runs once the server has the event.
+    """
+    if session.event_publisher is not None:
+        session.event_publisher.publish(event, on_published)
+        return
+    RemoteClient(session).push_events([event])
+    if on_published is not None:
+        on_published()
+    RemoteEventHandler(session).handle_new_events()
+
+
 def action(func):
     @wraps(func)
     def wrapper(*args, **kwargs) -> Callable[[Session], SyncActionResult]:
@@ -65,10 +355,9 @@ def upload(
         chunks=all_chunks,
         signature=stored_node.signature
     )
-    RemoteClient(session).push_events([event])
-    RemoteEventHandler(session).handle_new_events()
+    publish_event(session, event)
 
-    # Create market for new node and exchange with all
+    # Create market for new node and let gossip spread it
     peers = session.peer_registry.peers_for_namespace(session.namespace)
     market = NodeMarket.for_file_provider(
         namespace=session.namespace,
@@ -77,17 +366,7 @@ def upload(
         peers=[peer.device_id for peer in peers],
         chunk_hashes=available_chunks
     )
-
-    tasks = TaskList()
-    for peer in peers:
-        client = session.client_pool.aquire(peer)
-        if client is not None:
-            logging.info(
-                "[CHUNK] Exchange node [%s] market with [%s]", local_node.path, peer.device_id
-            )
-            tasks.submit(ExchangeMarketTask(client, market, session))
-
-    tasks.wait_all()
+    spread_market(session, market)
 
     return SyncActionResult()
 
@@ -103,14 +382,10 @@ def download(
     client_pool = session.client_pool
     device_id = session.device_id
 
-    (
-        stored_node,
-        local_node,
-        all_chunks,
-        chunk_index,
-        needed_chunks,
-        available_chunks
-    ) = create_node_placeholder(remote_node, session)
+    node = PartialNode.prepare(remote_node, session)
+    stored_node, chunk_index = node.stored_node, node.chunk_index
+    available_chunks = {chunk_hash for chunk_hash in chunk_index if node.has_chunk(chunk_hash)}
+    needed_chunks = set(chunk_index) - available_chunks
 
     market = NodeMarket.for_file_consumer(
         namespace=session.namespace,
@@ -137,7 +412,7 @@ def download(
         def on_done(self, result):
             logging.info(
                 "[CHUNK] Chunk downloaded [%s:%r] form %s",
-                local_node.path, self.chunk_hash, self.client.peer.device_id
+                node.path, self.chunk_hash, self.client.peer.device_id
             )
             session.stats.emit_chunk_download(
                 (session.namespace, stored_node.key, stored_node.checksum),
@@ -146,22 +421,10 @@ def download(
             )
             self.chunks[0].check(result)
             with atomic():
-                for chunk in self.chunks:
-                    local_node.write_chunk(chunk, result)
+                node.write_chunk(self.chunk_hash, result)
                 market.provide_chunk(self.chunk_hash)
             available_chunks.add(self.chunk_hash)
-
-            chunk_consumers = set(market.find_consumers(self.chunk_hash))
-            clients = list(client_pool.try_aquire_peers(
-                (
-                    peer
-                    for peer in peer_registry.iter_peers(session.namespace)
-                    if peer.device_id in chunk_consumers
-                ),
-                max_count=1
-            ))
-            for client in clients:
-                tasks.submit(ExchangeMarketTask(client, market, session))
+            spread_market(session, market)
 
         def on_error(self, error):
             logging.error("[CHUNK] Error downloading chunk: %r", error)
@@ -207,14 +470,14 @@ def download(
         while client is not None:
             logging.info(
                 "[CHUNK] Downloading chunk [%s:%r] from %s",
-                local_node.path, chunks[0].hash, client.peer.device_id
+                node.path, chunks[0].hash, client.peer.device_id
             )
             tasks.submit(DownloadChunkTask(client, chunks))
             client, chunks = pick_next_chunks()
 
         if tasks.empty:
-            logging.info("[CHUNK] No chunks for [%s] found no market", local_node.path)
-            for peer in peer_registry.iter_peers(session.namespace):
+            logging.info("[CHUNK] No chunks for [%s] found no market", node.path)
+            for peer in pick_peers(peer_registry.live_peers(session.namespace), settings.GOSSIP_FANOUT):
                 client = client_pool.aquire(peer)
                 if client is not None:
                     logging.info("[CHUNK] Doing exchange with: %s", peer.device_id)
@@ -222,7 +485,7 @@ def download(
 
         tasks.wait_any()
 
-    stored_node.sync_with_local(local_node)
+    node.finish(session)
 
     return SyncActionResult()
 
@@ -232,6 +495,7 @@ def delete_local(
     local_node: LocalNode, stored_node: StoredNode, session: Session
 ) -> SyncActionResult:
     local_node.local_path.unlink()
+    discard_partial_download(stored_node)
     stored_node.delete_instance()
     return SyncActionResult()
 
@@ -246,9 +510,8 @@ def delete_remote(
         path=remote_node.path,
         timestamp=now_as_iso(),
     )
-    RemoteClient(session).push_events([event])
-    stored_node.delete_instance()
-    RemoteEventHandler(session).handle_new_events()
+    # Until the server has the event the stored node keeps this a delete_remote
+    publish_event(session, event, on_published=stored_node.delete_instance)
     return SyncActionResult()
 
 
@@ -256,12 +519,17 @@ def delete_remote(
 def save_stored(
     remote_node: RemoteNode, local_node: LocalNode, session: Session
 ) -> SyncActionResult:
-    store_new_node(local_node, session, None)
+    full_node = store_new_node(local_node, session, None)
+    # The contents match; keeping the remote checksum makes `remote.updated` compare like with like
+    if remote_node.checksum and remote_node.checksum != local_node.checksum:
+        full_node.stored_node.checksum = remote_node.checksum
+        full_node.stored_node.save()
     return SyncActionResult()
 
 
 @action
 def delete_stored(stored_node: StoredNode, session: Session) -> SyncActionResult:
+    discard_partial_download(stored_node)
     stored_node.delete_instance()
     return SyncActionResult()
 
@@ -1,3 +1,4 @@
+from lansync.common import checksum_func
 from lansync.models import StoredNode, RemoteNode
 from lansync.node import LocalNode
 from lansync.sync_action import (
@@ -27,9 +28,11 @@ def handle_node(
     elif remote and not local and not stored:
         return download(remote, None)
     elif remote and not local and stored:
+        if not stored.ready:
+            return download(remote, stored)
         return delete_remote(remote, stored)
     elif remote and local and not stored:
-        if remote.checksum == local.checksum:
+        if local.same_content(remote.checksum):
             return save_stored(remote, local)
         else:
             return conflict(remote, local, stored)
@@ -40,20 +43,27 @@ def handle_node(
         local_updated = local.updated(stored)
         remote_updated = remote.updated(stored)
         if local_updated and remote_updated:
-            if remote.checksum == local.checksum:
+            if local.same_content(remote.checksum):
                 return save_stored(remote, local)
             else:
                 return conflict(remote, local, stored)
         elif local_updated:
-            if local.checksum == stored.checksum:
+            if local.same_content(stored.checksum):
                 return save_stored(remote, local)
             else:
                 return upload(local, stored)
         elif remote_updated:
-            if remote.checksum == stored.checksum:
+            if remote_matches_stored(remote, local, stored):
                 return save_stored(remote, local)
             else:
                 return download(remote, stored)
         else:
             return nop()
     return nop()
+
+
+def remote_matches_stored(remote: RemoteNode, local: LocalNode, stored: StoredNode) -> bool:
+    """Checksums of different hash functions are compared through the unchanged local file."""
+    if checksum_func(remote.checksum) == checksum_func(stored.checksum):
+        return remote.checksum == stored.checksum
+    return local.same_content(remote.checksum)
@@ -0,0 +1,33 @@
+from typing import Optional
+
+
+class Bitmap:
+    """A fixed number of bits, stored as bytes; bit `i` is bit `i % 8` of byte `i // 8`."""
+
+    def __init__(self, size: int, data: Optional[bytes] = None):
+        length = (size + 7) // 8
+        if data is not None and len(data) != length:
+            raise ValueError("Bitmap data does not match the size", size, len(data))
+        self.size = size
+        self.data = bytearray(data) if data is not None else bytearray(length)
+
+    def __contains__(self, index: int) -> bool:
+        return bool(self.data[index >> 3] & (1 << (index & 7)))
+
+    def add(self, index: int) -> None:
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        self.data[index >> 3] |= 1 << (index & 7)
+
+    def count(self) -> int:
+        return sum(bin(byte).count("1") for byte in self.data)
+
+    @property
+    def full(self) -> bool:
+        return self.count() == self.size
+
+    def __bytes__(self) -> bytes:
+        return bytes(self.data)
+
+    def __len__(self) -> int:
+        return self.size
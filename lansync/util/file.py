@@ -1,13 +1,28 @@
 from __future__ import annotations
 
+from collections import deque
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
 from contextlib import contextmanager
 import hashlib
 import logging
 import os
 import os.path
 from pathlib import Path
+import struct
 import tempfile
-from typing import Generator, Optional, Dict, List, Union, Tuple
+from typing import Callable, Deque, Generator, Optional, Dict, List, Union, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # type: ignore
+
+from rschunks.hashing import buffer_identity, identity_of, new_hash
+
+
+# From linux/fs.h
+FICLONE = 0x40049409
+FICLONERANGE = 0x4020940D
 
 
 def iter_folder(folder: Path) -> Generator[Path, None, None]:
@@ -18,6 +33,66 @@ def iter_folder(folder: Path) -> Generator[Path, None, None]:
             yield from iter_folder(p)
 
 
+def scan_dir(
+    folder: str, prune: Optional[Callable[[str, bool], bool]] = None
+) -> Tuple[List[Tuple[str, os.stat_result]], List[str]]:
+    files: List[Tuple[str, os.stat_result]] = []
+    subfolders: List[str] = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir():
+                        if prune is None or not prune(entry.path, True):
+                            subfolders.append(entry.path)
+                    elif entry.is_file():
+                        if prune is None or not prune(entry.path, False):
+                            files.append((entry.path, entry.stat()))
+                except OSError:
+                    continue
+    except OSError:
+        logging.warning("[FILE] Cannot scan folder [%s]", folder)
+    return files, subfolders
+
+
+def walk_folder(
+    folder: Path,
+    executor: Optional[Executor] = None,
+    max_workers: int = 8,
+    prune: Optional[Callable[[str, bool], bool]] = None,
+) -> Generator[Tuple[str, os.stat_result], None, None]:
+    """Yields `(fspath, stat)` for every file under `folder`.
+
+    Each folder is listed once with `os.scandir` and the stat data comes from
+    the `DirEntry`, so a file costs a single stat call. Subfolders are listed
+    concurrently on `executor`. `prune(fspath, is_dir)` skips files and whole
+    subfolders.
+    """
+    own_executor = executor is None
+    executor = executor or ThreadPoolExecutor(max_workers=max_workers)
+    pending: Deque[Future] = deque()
+    try:
+        pending.append(executor.submit(scan_dir, os.fspath(folder), prune))
+        while pending:
+            files, subfolders = pending.popleft().result()
+            for subfolder in subfolders:
+                pending.append(executor.submit(scan_dir, subfolder, prune))
+            yield from files
+    finally:
+        for future in pending:
+            future.cancel()
+        if own_executor:
+            executor.shutdown(wait=False)
+
+
+def relative_path(fspath: str, root_fspath: str) -> str:
+    """Fast `Path(fspath).relative_to(root_fspath).as_posix()` for normalized paths."""
+    if not fspath.startswith(root_fspath) or fspath[len(root_fspath):len(root_fspath) + 1] != os.sep:
+        raise ValueError(f"{fspath!r} is not in {root_fspath!r}")
+    path = fspath[len(root_fspath) + 1:]
+    return path.replace(os.sep, "/") if os.sep != "/" else path
+
+
 def hash_path(path: str) -> str:
     return hashlib.new("md5", path.encode("utf-8")).hexdigest()
 
@@ -37,8 +112,9 @@ def create_file_placeholder(path: Path, size: int) -> None:
     if not path.parent.exists():
         path.parent.mkdir(parents=True)
     with open(path, "wb") as f:
-        f.seek(size - 1)
-        f.write(b"\0")
+        if size:
+            f.seek(size - 1)
+            f.write(b"\0")
 
 
 def read_chunk(path: Path, offset: int, size: int) -> bytes:
@@ -53,24 +129,78 @@ def write_chunk(path: Path, data: bytes, offset: int) -> None:
         file.write(data)
 
 
-def file_checksum(file_name: str, hash_func: str = "md5") -> Optional[str]:
+def clone_range(src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, size: int) -> bool:
+    """Shares the extents of a range with a reflink; False where the filesystem cannot.
+
+    Offsets and the size have to be block aligned, except for a range that
+    ends at the end of the source file.
+    """
+    if fcntl is None or size <= 0:
+        return False
     try:
-        hash = hashlib.new(hash_func)
-        with open(file_name, "rb") as f:
-            data = f.read(1000000)
-            while len(data) > 0:
-                hash.update(data)
-                data = f.read(1000000)
-        return hash.hexdigest()
+        fcntl.ioctl(dst_fd, FICLONERANGE, struct.pack("qQQQ", src_fd, src_offset, size, dst_offset))
+        return True
+    except OSError:
+        return False
+
+
+def copy_range(src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, size: int) -> None:
+    """Copies a range between open files without passing through Python buffers.
+
+    Tries a reflink, then `os.copy_file_range` and falls back to
+    `os.pread`/`os.pwrite` where neither is available.
+    """
+    if clone_range(src_fd, dst_fd, src_offset, dst_offset, size):
+        return
+    copy_file_range = getattr(os, "copy_file_range", None)
+    while size > 0:
+        copied = 0
+        if copy_file_range is not None:
+            try:
+                copied = copy_file_range(src_fd, dst_fd, size, src_offset, dst_offset)
+            except OSError:
+                copy_file_range = None
+        if not copied:
+            data = os.pread(src_fd, min(size, 1024 * 1024), src_offset)
+            if not data:
+                raise EOFError("Source range ends before its size", src_offset, size)
+            copied = os.pwrite(dst_fd, data, dst_offset)
+        src_offset += copied
+        dst_offset += copied
+        size -= copied
+
+
+def clone_file(src: Union[Path, str], dst: Union[Path, str]) -> None:
+    """Makes `dst` a copy of `src`, a single reflink where the filesystem supports it."""
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+                return
+            except OSError:
+                pass
+        copy_range(src_file.fileno(), dst_file.fileno(), 0, 0, os.fstat(src_file.fileno()).st_size)
+
+
+def file_checksum(
+    file_name: str, hash_func: str = "md5", block_size: int = 1024 * 1024
+) -> Optional[str]:
+    try:
+        hash = new_hash(hash_func)
+        buffer = memoryview(bytearray(block_size))
+        with open(file_name, "rb", buffering=0) as f:
+            size = f.readinto(buffer)
+            while size:
+                hash.update(buffer[:size])
+                size = f.readinto(buffer)
+        return identity_of(hash, hash_func)
     except IOError:
         logging.error(u"[FILE] Error calculating checksum", exc_info=True)
         return None
 
 
 def buffer_checksum(buffer: bytes, hash_func: str = "md5") -> str:
-    hash = hashlib.new(hash_func)
-    hash.update(buffer)
-    return hash.hexdigest()
+    return buffer_identity(buffer, hash_func)
 
 
 def read_file_chunks(
@@ -81,13 +211,13 @@ def read_file_chunks(
         with open(path, "rb") as f:
             offset = 0
             while True:
-                hash = hashlib.new(hash_func)
+                hash = new_hash(hash_func)
                 data = f.read(chunk_size)
                 size = len(data)
                 if size == 0:
                     break
                 hash.update(data)
-                chunks.append((hash.hexdigest(), size, offset))
+                chunks.append((identity_of(hash, hash_func), size, offset))
                 offset += size
                 if size < chunk_size:
                     break
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Pattern, Sequence
+
+
+class IgnoreRule(NamedTuple):
+    regex: Pattern
+    negate: bool
+    dir_only: bool
+
+
+def translate_pattern(pattern: str) -> str:
+    i, n = 0, len(pattern)
+    parts = []
+    while i < n:
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            parts.append("[^/]")
+            i += 1
+        elif pattern[i] == "[" and "]" in pattern[i + 2:]:
+            end = pattern.index("]", i + 2)
+            body = pattern[i + 1:end].replace("\\", "\\\\")
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            parts.append(f"[{body}]")
+            i = end + 1
+        elif pattern[i] == "\\" and i + 1 < n:
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+    return "".join(parts)
+
+
+def compile_rule(line: str) -> Optional[IgnoreRule]:
+    line = line.rstrip("\n").rstrip(" ")
+    if not line or line.startswith("#"):
+        return None
+
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    anchored = "/" in line
+    line = line.lstrip("/")
+    if not line:
+        return None
+
+    body = translate_pattern(line)
+    prefix = "" if anchored else "(?:.*/)?"
+    return IgnoreRule(re.compile(f"^{prefix}{body}$"), negate, dir_only)
+
+
+class IgnoreRules:
+    """gitignore-style rules, matched against posix paths relative to the root.
+
+    Supports comments, `!` negation, trailing `/` for folders only, patterns
+    anchored by a `/`, `*`, `?`, `[...]` and `**`. When nothing is negated all
+    rules are merged into one regular expression per kind.
+    """
+
+    rules: List[IgnoreRule]
+
+    def __init__(self, lines: Iterable[str] = ()):
+        self.rules = [rule for rule in (compile_rule(line) for line in lines) if rule is not None]
+        self.any_rules = bool(self.rules)
+        self.combined = None
+        if not any(rule.negate for rule in self.rules):
+            self.combined = (
+                self.combine(rule for rule in self.rules if not rule.dir_only),
+                self.combine(self.rules),
+            )
+
+    @staticmethod
+    def combine(rules: Iterable[IgnoreRule]) -> Optional[Pattern]:
+        patterns = [rule.regex.pattern for rule in rules]
+        return re.compile("|".join(f"(?:{p})" for p in patterns)) if patterns else None
+
+    def match(self, path: str, is_dir: bool = False) -> bool:
+        """Checks `path` itself, without looking at its parent folders."""
+        if not self.any_rules:
+            return False
+        if self.combined is not None:
+            regex = self.combined[1 if is_dir else 0]
+            return regex is not None and regex.match(path) is not None
+        for rule in reversed(self.rules):
+            if rule.dir_only and not is_dir:
+                continue
+            if rule.regex.match(path):
+                return not rule.negate
+        return False
+
+    def ignored(self, path: str, is_dir: bool = False) -> bool:
+        """Checks `path` and every folder above it."""
+        if not self.any_rules:
+            return False
+        parts = path.split("/")
+        for i in range(1, len(parts)):
+            if self.match("/".join(parts[:i]), is_dir=True):
+                return True
+        return self.match(path, is_dir=is_dir)
+
+
+class RootIgnoreRules:
+    """The rules of one root folder, reloaded when the rule file changes.
+
+    `builtin` rules come before the ones in the file.
+    """
+
+    def __init__(self, root_folder: Path, filename: str, builtin: Sequence[str] = ()):
+        self.path = root_folder / filename
+        self.builtin = list(builtin)
+        self.mtime_ns: Optional[int] = None
+        self.rules = IgnoreRules(self.builtin)
+
+    def current(self) -> IgnoreRules:
+        try:
+            mtime_ns: Optional[int] = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns != self.mtime_ns:
+            self.mtime_ns = mtime_ns
+            lines = self.path.read_text(encoding="utf-8").splitlines() if mtime_ns is not None else []
+            self.rules = IgnoreRules(self.builtin + lines)
+            logging.info("[IGNORE] Loaded %d rules from [%s]", len(self.rules.rules), self.path)
+        return self.rules
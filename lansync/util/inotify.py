@@ -0,0 +1,125 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+from typing import List, NamedTuple
+
+
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+READ_BUFFER_SIZE = 64 * 1024
+
+
+_libc = None
+if sys.platform.startswith("linux"):
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        _libc.inotify_init1.restype = ctypes.c_int
+        _libc.inotify_init1.argtypes = (ctypes.c_int,)
+        _libc.inotify_add_watch.restype = ctypes.c_int
+        _libc.inotify_add_watch.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32)
+        _libc.inotify_rm_watch.restype = ctypes.c_int
+        _libc.inotify_rm_watch.argtypes = (ctypes.c_int, ctypes.c_int)
+    except (OSError, AttributeError):
+        _libc = None
+
+
+def available() -> bool:
+    return _libc is not None
+
+
+def _check(result: int) -> int:
+    if result < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    return result
+
+
+class InotifyEvent(NamedTuple):
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+class Inotify:
+    """An inotify instance read by one thread.
+
+    `close` may be called from any thread: it wakes the reader through a
+    pipe and the reader closes the descriptors, so a blocked read never sees
+    its fd closed or reused.
+    """
+
+    def __init__(self):
+        if _libc is None:
+            raise NotImplementedError("inotify is not supported on your platform")
+        self.fd = _check(_libc.inotify_init1(IN_CLOEXEC))
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+        self.poller.register(self.wakeup_read, select.POLLIN)
+        self.closing = False
+
+    def add_watch(self, path: str, mask: int) -> int:
+        return _check(_libc.inotify_add_watch(self.fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd: int) -> None:
+        _check(_libc.inotify_rm_watch(self.fd, wd))
+
+    def read_events(self) -> List[InotifyEvent]:
+        """Blocks until events arrive; returns no events once closed."""
+        if self.fd < 0:
+            return []
+        ready = {fd for fd, _ in self.poller.poll()}
+        if self.wakeup_read in ready:
+            self.release()
+            return []
+        data = os.read(self.fd, READ_BUFFER_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append(InotifyEvent(wd, mask, cookie, name))
+        return events
+
+    def close(self) -> None:
+        if not self.closing:
+            self.closing = True
+            os.write(self.wakeup_write, b"\0")
+
+    def release(self) -> None:
+        for fd in (self.fd, self.wakeup_read, self.wakeup_write):
+            os.close(fd)
+        self.fd = -1
+
+    @property
+    def closed(self) -> bool:
+        return self.fd < 0
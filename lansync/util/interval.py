@@ -0,0 +1,48 @@
+class AdaptiveInterval:
+    """The delay before the next scheduled sync cycle.
+
+    Backs off by `factor` after cycles that found no work, up to
+    `max_interval`, and snaps back to `min_interval` when there is work or a
+    change arrives. The delay never lets cycles take more than `max_share` of
+    the wall time. `reason` tells why the interval has its current value.
+    """
+
+    def __init__(
+        self,
+        min_interval: float,
+        max_interval: float,
+        factor: float = 2.0,
+        max_share: float = 0.1,
+    ):
+        assert 0 < min_interval <= max_interval and factor >= 1 and 0 < max_share <= 1
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.max_share = max_share
+        self.interval = min_interval
+        self.reason = "start"
+        self.backoff_interval = min_interval
+
+    def reset(self, reason: str) -> float:
+        self.backoff_interval = self.min_interval
+        return self.set(self.min_interval, reason)
+
+    def record_cycle(self, duration: float, found_work: bool) -> float:
+        if found_work:
+            self.backoff_interval = self.min_interval
+            reason = "work"
+        else:
+            self.backoff_interval = min(self.backoff_interval * self.factor, self.max_interval)
+            reason = "idle" if self.backoff_interval < self.max_interval else "idle, max interval"
+
+        # A cycle of `duration` followed by `interval` seconds of rest uses
+        # duration / (duration + interval) of the time
+        cpu_interval = duration * (1 - self.max_share) / self.max_share
+        if cpu_interval > self.backoff_interval:
+            return self.set(cpu_interval, "cpu share")
+        return self.set(self.backoff_interval, reason)
+
+    def set(self, interval: float, reason: str) -> float:
+        self.interval = interval
+        self.reason = reason
+        return interval
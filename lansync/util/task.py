@@ -2,8 +2,25 @@ import abc
 from concurrent.futures import (
     Executor, Future, ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 )
-from threading import RLock
-from typing import Dict, List
+from threading import Lock, RLock
+from typing import Dict, List, Optional
+
+from dynaconf import settings  # type: ignore
+
+
+shared_executor: Optional[Executor] = None
+shared_executor_lock = Lock()
+
+
+def get_shared_executor() -> Executor:
+    """The executor shared by every `TaskList` in the process."""
+    global shared_executor
+    with shared_executor_lock:
+        if shared_executor is None:
+            shared_executor = ThreadPoolExecutor(
+                max_workers=settings.TASK_WORKERS, thread_name_prefix="task"
+            )
+        return shared_executor
 
 
 class Task(abc.ABC):
@@ -41,7 +58,7 @@ class TaskList:
     futures: List[Future]
 
     def __init__(self, executor: Executor = None):
-        self.executor = executor or ThreadPoolExecutor(max_workers=32)
+        self.executor = executor or get_shared_executor()
         self.tasks = {}
         self.futures = []
         self.lock = RLock()
@@ -17,6 +17,10 @@ class Timeout:
         self.timer and self.timer.cancel()
         self.timer = None
 
+    @property
+    def running(self) -> bool:
+        return self.timer is not None and self.timer.is_alive()
+
     def restart(self):
         self.stop()
         self.start()
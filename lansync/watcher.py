@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+from typing import Callable, Dict, Optional
+
+from lansync.util import inotify
+from lansync.util.file import relative_path
+
+
+WATCH_MASK = (
+    inotify.IN_MODIFY
+    | inotify.IN_ATTRIB
+    | inotify.IN_CLOSE_WRITE
+    | inotify.IN_MOVED_FROM
+    | inotify.IN_MOVED_TO
+    | inotify.IN_CREATE
+    | inotify.IN_DELETE
+    | inotify.IN_MOVE_SELF
+    | inotify.IN_DONT_FOLLOW
+    | inotify.IN_EXCL_UNLINK
+    | inotify.IN_ONLYDIR
+)
+
+
+class FolderWatcher:
+    """Reports paths changed under `root_fspath` using inotify.
+
+    `on_change` receives posix paths relative to the root; a path may name a
+    file or a whole folder. `on_overflow` is called when the kernel queue
+    overflowed or a watch could not be added, so changes may have been lost.
+    Folders for which `ignored(path, is_dir)` is true are not watched.
+    """
+
+    inotify: Optional[inotify.Inotify]
+    folders: Dict[int, str]
+    thread: Optional[threading.Thread] = None
+
+    def __init__(
+        self,
+        root_fspath: str,
+        on_change: Callable[[str], None],
+        on_overflow: Callable[[], None],
+        ignored: Optional[Callable[[str, bool], bool]] = None,
+    ):
+        self.root_fspath = root_fspath
+        self.on_change = on_change
+        self.on_overflow = on_overflow
+        self.ignored = ignored
+        self.inotify = None
+        self.folders = {}
+
+    @classmethod
+    def available(cls) -> bool:
+        return inotify.available()
+
+    def start(self) -> None:
+        self.inotify = inotify.Inotify()
+        self.watch_tree(self.inotify, self.root_fspath)
+        self.thread = threading.Thread(target=self.run, args=(self.inotify,), daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        # The reader thread closes the inotify descriptors once it wakes up
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+    def watch_tree(self, notifier: inotify.Inotify, fspath: str) -> None:
+        for folder, subfolders, _ in os.walk(fspath):
+            try:
+                wd = notifier.add_watch(folder, WATCH_MASK)
+            except OSError as error:
+                logging.error("[WATCH] Cannot watch [%s]: %r", folder, error)
+                self.on_overflow()
+                continue
+            self.folders[wd] = folder
+            if self.ignored is not None:
+                subfolders[:] = [
+                    name for name in subfolders
+                    if not self.ignored(relative_path(os.path.join(folder, name), self.root_fspath), True)
+                ]
+
+    def unwatch_tree(self, notifier: inotify.Inotify, fspath: str) -> None:
+        prefix = fspath + os.sep
+        for wd, folder in list(self.folders.items()):
+            if folder == fspath or folder.startswith(prefix):
+                del self.folders[wd]
+                try:
+                    notifier.rm_watch(wd)
+                except OSError:
+                    pass
+
+    def run(self, notifier: inotify.Inotify) -> None:
+        # `self.inotify` is reset by `stop` from another thread, the reader only uses `notifier`
+        while not notifier.closed:
+            for event in notifier.read_events():
+                if notifier.closing:
+                    break
+                self.handle_event(notifier, event)
+
+    def handle_event(self, notifier: inotify.Inotify, event: inotify.InotifyEvent) -> None:
+        if event.mask & inotify.IN_Q_OVERFLOW:
+            logging.warning("[WATCH] Event queue overflow")
+            self.on_overflow()
+            return
+
+        folder = self.folders.get(event.wd)
+        if folder is None:
+            return
+        if event.mask & inotify.IN_IGNORED:
+            self.folders.pop(event.wd, None)
+            return
+        if event.mask & inotify.IN_MOVE_SELF:
+            # Moved subfolders are handled by the events of their parent
+            if folder == self.root_fspath:
+                logging.warning("[WATCH] Root folder [%s] was moved", folder)
+                self.on_overflow()
+            return
+
+        fspath = os.path.join(folder, event.name) if event.name else folder
+        if fspath == self.root_fspath:
+            return
+        path = relative_path(fspath, self.root_fspath)
+        is_dir = bool(event.mask & inotify.IN_ISDIR)
+        if is_dir and event.mask & inotify.IN_MOVED_FROM:
+            # The watches follow the folder, drop them so that no event reports its old path
+            self.unwatch_tree(notifier, fspath)
+        if self.ignored is not None and self.ignored(path, is_dir):
+            return
+        if is_dir and event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+            self.watch_tree(notifier, fspath)
+        self.on_change(path)
@@ -0,0 +1,27 @@
+from threading import Condition
+from typing import Dict, Optional
+
+
+class EventFeed:
+    """Wakes up feed subscribers when new events are stored in a namespace."""
+
+    def __init__(self):
+        self.condition = Condition()
+        self.sequence_numbers: Dict[str, int] = {}
+
+    def notify(self, namespace: str, sequence_number: int) -> None:
+        with self.condition:
+            self.sequence_numbers[namespace] = max(
+                sequence_number, self.sequence_numbers.get(namespace, -1)
+            )
+            self.condition.notify_all()
+
+    def wait(self, namespace: str, after: int, timeout: Optional[float] = None) -> bool:
+        """Waits until an event newer than `after` is stored; False on timeout."""
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: self.sequence_numbers.get(namespace, -1) > after, timeout=timeout
+            )
+
+
+event_feed = EventFeed()
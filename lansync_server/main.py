@@ -1,11 +1,11 @@
 import json
-from threading import Condition
 
 from dynaconf import settings  # type: ignore
 from flask import Flask, jsonify, request, Response
 
 from lansync.database import open_database
 from lansync_server.models import all_models
+from lansync_server.feed import event_feed
 from lansync_server.service import load_events, store_events
 from lansync_server.util import error_response
 
@@ -29,20 +29,32 @@ def node(namespace):
 
 
 @app.route("/namespace/<namespace>/feed")
-def feed():
-    def get_message():
-        message = json.dumps({})
-        return f"data: {message}\n\n"
-
-    def event_stream():
-        yield get_message()
-        condition = Condition()
-        while True:
-            with condition:
-                condition.wait()
-                yield get_message()
+def feed(namespace):
+    """Streams stored events as server-sent events, one message per batch.
+
+    The stream starts at `min_sequence_number`, or after the `Last-Event-ID`
+    of a reconnecting client, with a message that may be empty. Every message
+    id is the last sequence number sent so far.
+    """
+    last_event_id = request.headers.get("Last-Event-ID")
+    if last_event_id is not None:
+        next_sequence_number = int(last_event_id) + 1
+    else:
+        next_sequence_number = int(request.args.get("min_sequence_number", 0))
 
-    return Response(event_stream(), mimetype="text/event-stream")
+    def event_stream(next_sequence_number):
+        first = True
+        while True:
+            events = load_events(namespace, next_sequence_number)
+            if events:
+                next_sequence_number = events[-1]["sequence_number"] + 1
+            if events or first:
+                first = False
+                yield f"id: {next_sequence_number - 1}\ndata: {json.dumps(events)}\n\n"
+            elif not event_feed.wait(namespace, next_sequence_number - 1, settings.FEED_KEEPALIVE):
+                yield ": keepalive\n\n"
+
+    return Response(event_stream(next_sequence_number), mimetype="text/event-stream")
 
 
 if __name__ == "__main__":
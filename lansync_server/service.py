@@ -1,5 +1,7 @@
 from typing import List, Dict
 
+from lansync.database import atomic
+from lansync_server.feed import event_feed
 from lansync_server.models import Namespace, NodeEvent, Sequence
 from lansync.serializers import NodeEventSerializer
 
@@ -8,10 +10,13 @@ def store_events(namespace_name: str, data) -> int:
     namespace, _ = Namespace.get_or_create(name=namespace_name)
     events = NodeEventSerializer().load(data, many=True)
     sequence_number = 0
-    for event in events:
-        sequence_number = Sequence.increment(namespace_name)
-        event["sequence_number"] = sequence_number
-        NodeEvent.create(namespace=namespace, **event)
+    with atomic():
+        for event in events:
+            sequence_number = Sequence.increment(namespace_name)
+            event["sequence_number"] = sequence_number
+            NodeEvent.create(namespace=namespace, **event)
+    if events:
+        event_feed.notify(namespace_name, sequence_number)
     return sequence_number
 
 
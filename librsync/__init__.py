@@ -89,11 +89,12 @@ class Buffer(ctypes.Structure):
 _librsync.rs_strerror.restype = ctypes.c_char_p
 _librsync.rs_strerror.argtypes = (ctypes.c_int,)
 
-# rs_job_t *rs_sig_begin(size_t new_block_len, size_t strong_sum_len);
+# rs_job_t *rs_sig_begin(size_t new_block_len, size_t strong_sum_len, rs_magic_number sig_magic);
 _librsync.rs_sig_begin.restype = ctypes.c_void_p
 _librsync.rs_sig_begin.argtypes = (
     ctypes.c_size_t,
     ctypes.c_size_t,
+    ctypes.c_int,
 )
 
 # rs_job_t *rs_loadsig_begin(rs_signature_t **);
@@ -306,6 +307,128 @@ def _execute(job, f, o=None):
     return o
 
 
+class JobStream:
+    """
+    Drives a librsync "job" with buffers pushed by the caller instead of
+    reading them from a file. `write` and `finish` return the output produced
+    so far. Input the job did not consume is kept and fed again on the next
+    call.
+
+    With a `sink` the output is not collected: every block is passed to it
+    as a view of the job's output buffer, which is only valid during the call.
+    """
+
+    def __init__(self, job, sink=None):
+        self.job = job
+        self.out = ctypes.create_string_buffer(RS_JOB_BLOCKSIZE)
+        self.out_view = memoryview(self.out).cast("B")
+        self.sink = sink
+        self.pending = b""
+        self.done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if self.job is not None:
+            _librsync.rs_job_free(self.job)
+            self.job = None
+
+    def _iterate(self, data, eof):
+        data = self.pending + data if self.pending else data
+        # The job reads `data` in place from `offset` on, the input is never sliced
+        address = ctypes.cast(data, ctypes.c_void_p).value or 0
+        offset = 0
+        output = []
+        while not self.done:
+            buff = Buffer()
+            buff.next_in = ctypes.cast(address + offset, CharPtr)
+            buff.avail_in = ctypes.c_size_t(len(data) - offset)
+            buff.eof_in = ctypes.c_int(eof)
+            buff.next_out = ctypes.cast(self.out, CharPtr)
+            buff.avail_out = ctypes.c_size_t(RS_JOB_BLOCKSIZE)
+            result = _librsync.rs_job_iter(self.job, ctypes.byref(buff))
+            produced = RS_JOB_BLOCKSIZE - buff.avail_out
+            consumed = len(data) - offset - buff.avail_in
+            if produced:
+                if self.sink is not None:
+                    self.sink(self.out_view[:produced])
+                else:
+                    output.append(self.out.raw[:produced])
+            offset += consumed
+            if result == RS_DONE:
+                self.done = True
+            elif result != RS_BLOCKED:
+                raise LibrsyncError(result)
+            elif not produced and not consumed:
+                if eof:
+                    raise LibrsyncError(result)
+                break
+            elif offset == len(data) and not eof and produced < RS_JOB_BLOCKSIZE:
+                break
+        self.pending = data[offset:] if offset < len(data) else b""
+        return b"".join(output)
+
+    def write(self, data):
+        return self._iterate(bytes(data), False)
+
+    def finish(self):
+        return self._iterate(b"", True)
+
+
+def signature_stream(block_size=RS_DEFAULT_BLOCK_LEN, strong_len=RS_DEFAULT_STRONG_LEN):
+    """
+    Returns a `JobStream` that turns the buffers written to it into a
+    signature.
+    """
+    return JobStream(_librsync.rs_sig_begin(block_size, strong_len, RS_MD4_SIG_MAGIC))
+
+
+def load_signature(data):
+    """
+    Loads a signature from memory and indexes it for delta jobs. The result
+    must be released with `rs_free_sumset`.
+    """
+    sig = ctypes.c_void_p()
+    try:
+        with JobStream(_librsync.rs_loadsig_begin(ctypes.byref(sig))) as job:
+            job.write(data)
+            job.finish()
+    except LibrsyncError:
+        if sig.value:
+            _librsync.rs_free_sumset(sig)
+        raise
+    _librsync.rs_build_hash_table(sig)
+    return sig
+
+
+class DeltaJobStream(JobStream):
+    """
+    A `JobStream` that turns the new file written to it into a delta against
+    a signature held in memory.
+    """
+
+    def __init__(self, signature, sink=None):
+        self.sig = load_signature(signature)
+        super(DeltaJobStream, self).__init__(_librsync.rs_delta_begin(self.sig), sink)
+
+    def close(self):
+        super(DeltaJobStream, self).close()
+        if self.sig is not None:
+            _librsync.rs_free_sumset(self.sig)
+            self.sig = None
+
+
+def delta_stream(signature, sink=None):
+    """
+    Returns a `DeltaJobStream` for the signature bytes `signature`.
+    """
+    return DeltaJobStream(signature, sink)
+
+
 def debug(level=syslog.LOG_DEBUG):
     assert level in TRACE_LEVELS, "Invalid log level %i" % level
     _librsync.rs_trace_set_level(level)
@@ -321,7 +444,7 @@ def signature(f, s=None, block_size=RS_DEFAULT_BLOCK_LEN):
     """
     if s is None:
         s = tempfile.SpooledTemporaryFile(max_size=MAX_SPOOL, mode="wb")
-    job = _librsync.rs_sig_begin(block_size, RS_DEFAULT_STRONG_LEN)
+    job = _librsync.rs_sig_begin(block_size, RS_DEFAULT_STRONG_LEN, RS_MD4_SIG_MAGIC)
     try:
         _execute(job, f, s)
     finally:
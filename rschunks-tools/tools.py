@@ -5,11 +5,17 @@ import re
 from pathlib import Path
 import shutil
 from random import randint
+import tempfile
+import time
+from typing import List, Optional
 
 import click
 from dynaconf import settings  # type: ignore
 from faker import Faker, providers
 
+import librsync
+from rschunks.cdc import read_cdc_chunks_from_file
+from rschunks.chunk import Chunk, diff_chunks, read_chunks_from_file, update_chunks
 from rschunks.delta import parse_delta_from_file
 
 
@@ -35,12 +41,7 @@ def reset(ctx):
         dir.mkdir()
 
 
-@cli.command()
-@click.pass_context
-@click.argument("filename")
-@click.option("--position", default=-1, type=int)
-@click.option("--size", default=-1, type=int)
-def mutate_file(ctx, filename: str, position: int, size: int):
+def mutate(filename: str, position: int = -1, size: int = -1, insert: bool = False):
     with open(filename, "r+b") as f:
         f.seek(0, os.SEEK_END)
         file_size = f.tell()
@@ -52,8 +53,21 @@ def mutate_file(ctx, filename: str, position: int, size: int):
         size = size if size != -1 else randint(1, file_size - position)
         assert size < file_size - position
 
+        f.seek(position, os.SEEK_SET)
+        tail = f.read() if insert else b""
         f.seek(position, os.SEEK_SET)
         f.write(fake.binary(size))
+        f.write(tail)
+
+
+@cli.command()
+@click.pass_context
+@click.argument("filename")
+@click.option("--position", default=-1, type=int)
+@click.option("--size", default=-1, type=int)
+@click.option("--insert/--overwrite", default=False)
+def mutate_file(ctx, filename: str, position: int, size: int, insert: bool):
+    mutate(filename, position, size, insert)
 
 
 def make_chunk(size: int) -> bytes:
@@ -73,22 +87,76 @@ def parse_size(size: str) -> int:
     return int(number) * multiplier
 
 
-@cli.command()
-@click.pass_context
-@click.argument("size")
-def make_file(ctx, size: str):
-    size_in_bytes = parse_size(size)
-    filename = fake.file_name()
-    with open(storage_folder / filename, "wb") as f:
+def write_file(path: Path, size_in_bytes: int, random_data: bool = False):
+    with open(path, "wb") as f:
         bytes_left = size_in_bytes
         while bytes_left > 0:
             chunk_size = min(settings.CHUNK_SIZE, bytes_left)
-            f.write(make_chunk(chunk_size))
+            f.write(os.urandom(chunk_size) if random_data else make_chunk(chunk_size))
             bytes_left -= chunk_size
 
+
+@cli.command()
+@click.pass_context
+@click.argument("size")
+@click.option("--random-data/--pattern-data", default=False)
+def make_file(ctx, size: str, random_data: bool):
+    filename = fake.file_name()
+    write_file(storage_folder / filename, parse_size(size), random_data)
     print(filename)
 
 
+def fixed_chunks(filename: str, signature: Optional[str]) -> List[Chunk]:
+    if signature is None:
+        return list(read_chunks_from_file(filename))
+    with tempfile.NamedTemporaryFile() as delta:
+        librsync.delta_from_paths(signature, filename, delta.name)
+        return list(update_chunks(list(parse_delta_from_file(delta.name)), filename))
+
+
+def measure(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+@cli.command()
+@click.pass_context
+@click.argument("size")
+@click.option("--mutations", default=5, type=int)
+@click.option("--mutation-size", default=100, type=int)
+@click.option("--insert/--overwrite", default=True)
+def benchmark_chunking(ctx, size: str, mutations: int, mutation_size: int, insert: bool):
+    """Compares fixed-size chunks repaired with librsync deltas against FastCDC."""
+    size_in_bytes = parse_size(size)
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, "file")
+        signature = os.path.join(folder, "signature")
+        write_file(Path(filename), size_in_bytes, random_data=True)
+
+        fixed_old, fixed_time = measure(lambda: fixed_chunks(filename, None))
+        _, signature_time = measure(lambda: librsync.signature_from_paths(
+            filename, signature, block_len=settings.CHUNK_SIZE
+        ))
+        cdc_old, cdc_time = measure(lambda: list(read_cdc_chunks_from_file(filename)))
+        print(f"initial  fixed: {size_in_bytes / (fixed_time + signature_time) / 2 ** 20:8.1f} MB/s"
+              f"  cdc: {size_in_bytes / cdc_time / 2 ** 20:8.1f} MB/s")
+
+        for _ in range(mutations):
+            mutate(filename, size=mutation_size, insert=insert)
+        new_size = os.path.getsize(filename)
+
+        for name, old, (new, elapsed) in (
+            ("fixed", fixed_old, measure(lambda: fixed_chunks(filename, signature))),
+            ("cdc", cdc_old, measure(lambda: list(read_cdc_chunks_from_file(filename)))),
+        ):
+            diff = diff_chunks(old, new)
+            print(
+                f"{name:<6} chunks: {len(new):6d}  preserved: {diff['preserved'] / new_size:6.1%}"
+                f"  added: {diff['added']:10d}  {new_size / elapsed / 2 ** 20:8.1f} MB/s"
+            )
+
+
 @cli.command()
 @click.pass_context
 @click.argument("filename")
@@ -0,0 +1,127 @@
+"""Content-defined chunking (FastCDC).
+
+Boundaries depend only on the bytes around them, so an insertion or a
+deletion changes the chunks next to the edit and leaves the rest intact.
+Peers must use the same gear table and sizes to get the same chunks.
+"""
+import hashlib
+from pathlib import Path
+from typing import Iterable, List, Optional, Union
+
+from dynaconf import settings  # type: ignore
+
+from rschunks.chunk import Chunk
+from rschunks.hashing import buffer_identity
+
+
+GEAR = [
+    int.from_bytes(hashlib.md5(i.to_bytes(1, "little")).digest()[:8], "little")
+    for i in range(256)
+]
+
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def top_bits_mask(bits: int) -> int:
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+class FastCDC:
+    def __init__(
+        self,
+        min_size: int = settings.CDC_MIN_SIZE,
+        avg_size: int = settings.CDC_AVG_SIZE,
+        max_size: int = settings.CDC_MAX_SIZE,
+    ):
+        assert 0 < min_size <= avg_size <= max_size
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        bits = max(avg_size.bit_length() - 1, 1)
+        # Normalized chunking: harder to cut before the average size, easier after it
+        self.mask_small = top_bits_mask(bits + 1)
+        self.mask_large = top_bits_mask(max(bits - 1, 1))
+
+    def cut_point(self, data: Union[bytes, memoryview], start: int, end: int) -> int:
+        """Returns the length of the chunk starting at `start` within `data[:end]`."""
+        length = end - start
+        if length <= self.min_size:
+            return length
+        length = min(length, self.max_size)
+        normal_size = min(self.avg_size, length)
+
+        gear = GEAR
+        fingerprint = 0
+        i = start + self.min_size
+        stop = start + normal_size
+        mask = self.mask_small
+        while i < stop:
+            fingerprint = ((fingerprint << 1) + gear[data[i]]) & MASK_64
+            if not fingerprint & mask:
+                return i - start
+            i += 1
+        stop = start + length
+        mask = self.mask_large
+        while i < stop:
+            fingerprint = ((fingerprint << 1) + gear[data[i]]) & MASK_64
+            if not fingerprint & mask:
+                return i - start
+            i += 1
+        return length
+
+    def split(self, data: bytes) -> List[int]:
+        """Returns the chunk sizes of a whole buffer."""
+        sizes = []
+        offset = 0
+        while offset < len(data):
+            size = self.cut_point(data, offset, len(data))
+            sizes.append(size)
+            offset += size
+        return sizes
+
+
+def cdc_chunks_from_blocks(
+    blocks: Iterable[bytes],
+    hash_func: str = settings.CHUNK_HASH_FUNC,
+    cdc: Optional[FastCDC] = None,
+) -> Iterable[Chunk]:
+    """Cuts a stream of arbitrarily sized blocks into content-defined chunks."""
+    cdc = cdc or FastCDC()
+    blocks = iter(blocks)
+    buffer = bytearray()
+    position = 0
+    offset = 0
+    eof = False
+    while True:
+        if not eof and len(buffer) - position < cdc.max_size:
+            del buffer[:position]
+            position = 0
+            while not eof and len(buffer) < cdc.max_size:
+                data = next(blocks, b"")
+                eof = not data
+                buffer += data
+        if position >= len(buffer):
+            break
+        size = cdc.cut_point(buffer, position, len(buffer))
+        yield Chunk(offset, size, buffer_identity(buffer[position:position + size], hash_func))
+        offset += size
+        position += size
+
+
+def read_cdc_chunks_from_fd(
+    fd,
+    hash_func: str = settings.CHUNK_HASH_FUNC,
+    cdc: Optional[FastCDC] = None,
+) -> Iterable[Chunk]:
+    cdc = cdc or FastCDC()
+    blocks = iter(lambda: fd.read(cdc.max_size * 4), b"")
+    yield from cdc_chunks_from_blocks(blocks, hash_func=hash_func, cdc=cdc)
+
+
+def read_cdc_chunks_from_file(
+    path: Union[Path, str],
+    hash_func: str = settings.CHUNK_HASH_FUNC,
+    cdc: Optional[FastCDC] = None,
+) -> Iterable[Chunk]:
+    with open(path, "rb") as fd:
+        yield from read_cdc_chunks_from_fd(fd, hash_func=hash_func, cdc=cdc)
@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, asdict
-import hashlib
 from itertools import chain
 from pathlib import Path
 import os
@@ -10,6 +9,7 @@ from typing import Union, List, Optional, Iterable, Tuple
 from dynaconf import settings  # type: ignore
 
 from rschunks.delta import DeltaCommand, LiteralDeltaCommand, CopyDeltaCommand
+from rschunks.hashing import buffer_identity, identity_of, new_hash
 
 
 @dataclass
@@ -47,13 +47,13 @@ def read_chunks_from_fd(
 ) -> Iterable[Chunk]:
     offset = 0
     while True:
-        hash = hashlib.new(hash_func)
+        hash = new_hash(hash_func)
         data = fd.read(chunk_size)
         size = len(data)
         if size == 0:
             break
         hash.update(data)
-        yield Chunk(offset, size, hash.hexdigest())
+        yield Chunk(offset, size, identity_of(hash, hash_func))
         offset += size
         if size < chunk_size:
             break
@@ -77,9 +77,7 @@ def fill_chunks_from_fd(
         fd.seek(chunk.offset, os.SEEK_SET)
         data = fd.read(chunk.size)
         assert len(data) == chunk.size
-        hash = hashlib.new(hash_func)
-        hash.update(data)
-        chunk.hash = hash.hexdigest()
+        chunk.hash = buffer_identity(data, hash_func)
 
 
 def fill_chunks_from_file(
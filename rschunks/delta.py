@@ -1,6 +1,6 @@
 import os
 from dataclasses import dataclass
-from typing import Union, Iterable
+from typing import Iterable, Iterator, Optional, Union
 
 
 RS_DELTA_MAGIC = 0x72730236
@@ -389,3 +389,66 @@ def parse_delta(cursor: Cursor) -> Iterable[DeltaCommand]:
 def parse_delta_from_file(filename: str):
     with open(filename, "rb") as fd:
         yield from parse_delta(Cursor(fd))
+
+
+class DeltaParser:
+    """Parses a delta pushed in pieces of any size.
+
+    Only command headers are buffered. The payload of a literal command is
+    counted off as it passes and never kept.
+    """
+
+    def __init__(self):
+        self.header = bytearray()
+        self.started = False
+        self.ended = False
+        self.skip = 0
+
+    def header_size(self) -> int:
+        if not self.started:
+            return 4
+        if not self.header:
+            return 1
+        cmd = rs_prototab[self.header[0]]
+        return 1 + cmd.len_1 + cmd.len_2
+
+    def parse_header(self) -> Optional[DeltaCommand]:
+        header = self.header
+        if not self.started:
+            magic = int.from_bytes(header, "big")
+            if magic != RS_DELTA_MAGIC:
+                raise Exception("Invalid magic number", magic)
+            self.started = True
+            return None
+
+        cmd = rs_prototab[header[0]]
+        if cmd.kind == RS_KIND_END:
+            self.ended = True
+            return None
+        elif cmd.kind == RS_KIND_LITERAL:
+            length = int.from_bytes(header[1:1 + cmd.len_1], "big") if cmd.len_1 else cmd.immediate
+            self.skip = length
+            return LiteralDeltaCommand(length=length)
+        elif cmd.kind == RS_KIND_COPY:
+            start = int.from_bytes(header[1:1 + cmd.len_1], "big")
+            length = int.from_bytes(header[1 + cmd.len_1:1 + cmd.len_1 + cmd.len_2], "big")
+            return CopyDeltaCommand(start=start, length=length)
+        return handle_unsupported(cmd)
+
+    def feed(self, data: Union[bytes, memoryview]) -> Iterator[DeltaCommand]:
+        position, size = 0, len(data)
+        while position < size and not self.ended:
+            if self.skip:
+                step = min(self.skip, size - position)
+                self.skip -= step
+                position += step
+                continue
+            missing = self.header_size() - len(self.header)
+            step = min(missing, size - position)
+            self.header += data[position:position + step]
+            position += step
+            if step == missing and len(self.header) == self.header_size():
+                command = self.parse_header()
+                self.header.clear()
+                if command is not None:
+                    yield command
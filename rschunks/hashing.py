@@ -0,0 +1,50 @@
+"""Content hash algorithms and versioned hash identities.
+
+A hash identity is the hex digest prefixed with the algorithm name, e.g.
+``blake2b:9f86d0...``. MD5 digests carry no prefix so identities produced
+by older peers stay valid. ``blake2b`` is BLAKE2b with a 128-bit digest and
+``xxh3`` is XXH3-128, which needs the optional ``xxhash`` package.
+"""
+import hashlib
+from typing import Any, List, Tuple
+
+try:
+    import xxhash  # type: ignore
+except ImportError:
+    xxhash = None
+
+
+LEGACY_HASH_FUNC = "md5"
+
+
+def new_hash(name: str) -> Any:
+    if name == "blake2b":
+        return hashlib.blake2b(digest_size=16)
+    elif name == "xxh3":
+        if xxhash is None:
+            raise ValueError("xxh3 requires the xxhash package", name)
+        return xxhash.xxh3_128()
+    return hashlib.new(name)
+
+
+def available_hash_funcs() -> List[str]:
+    return ["md5", "sha1", "blake2b"] + (["xxh3"] if xxhash is not None else [])
+
+
+def hash_identity(name: str, hexdigest: str) -> str:
+    return hexdigest if name == LEGACY_HASH_FUNC else f"{name}:{hexdigest}"
+
+
+def parse_hash_identity(identity: str) -> Tuple[str, str]:
+    name, separator, hexdigest = identity.partition(":")
+    return (name, hexdigest) if separator else (LEGACY_HASH_FUNC, identity)
+
+
+def identity_of(hash: Any, name: str) -> str:
+    return hash_identity(name, hash.hexdigest())
+
+
+def buffer_identity(data: bytes, name: str) -> str:
+    hash = new_hash(name)
+    hash.update(data)
+    return identity_of(hash, name)
@@ -1,3 +1,4 @@
+import io
 import random
 from functools import reduce
 
@@ -11,6 +12,7 @@ from rschunks.chunk import (
     diff_chunks,
     Chunk,
 )
+from rschunks.cdc import FastCDC, cdc_chunks_from_blocks, read_cdc_chunks_from_fd
 from rschunks.delta import LiteralDeltaCommand, CopyDeltaCommand
 
 
@@ -97,3 +99,26 @@ def test_diff_chunks():
         "deleted": 1,
         "added": 2
     }
+
+
+def test_cdc_chunks_do_not_depend_on_block_size():
+    cdc = FastCDC(min_size=64, avg_size=256, max_size=1024)
+    data = fake.binary(20000)
+    chunks = list(read_cdc_chunks_from_fd(io.BytesIO(data), cdc=cdc))
+    blocks = (data[i:i + 100] for i in range(0, len(data), 100))
+
+    assert list(cdc_chunks_from_blocks(blocks, cdc=cdc)) == chunks
+    assert sum(c.size for c in chunks) == len(data)
+    assert all(64 <= c.size <= 1024 for c in chunks[:-1])
+
+
+def test_cdc_insertion_preserves_most_chunks():
+    cdc = FastCDC(min_size=64, avg_size=256, max_size=1024)
+    data = fake.binary(20000)
+    changed = data[:10000] + b"inserted" + data[10000:]
+
+    old = list(read_cdc_chunks_from_fd(io.BytesIO(data), cdc=cdc))
+    new = list(read_cdc_chunks_from_fd(io.BytesIO(changed), cdc=cdc))
+    diff = diff_chunks(old, new)
+
+    assert diff["preserved"] >= diff["old_size"] - 3 * 1024
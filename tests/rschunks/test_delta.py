@@ -0,0 +1,35 @@
+import io
+
+from rschunks.delta import (
+    RS_DELTA_MAGIC,
+    CopyDeltaCommand,
+    Cursor,
+    DeltaParser,
+    LiteralDeltaCommand,
+    parse_delta,
+)
+
+
+DELTA = (
+    RS_DELTA_MAGIC.to_bytes(4, "big")
+    + bytes([3]) + b"abc"
+    + bytes([0x41, 5]) + b"defgh"
+    + bytes([0x45, 7, 9])
+    + bytes([0x4b]) + (300).to_bytes(2, "big") + (70000).to_bytes(4, "big")
+    + bytes([0])
+)
+
+
+def test_delta_parser_matches_file_parser_for_any_split():
+    expected = list(parse_delta(Cursor(io.BytesIO(DELTA))))
+    assert expected == [
+        LiteralDeltaCommand(3), LiteralDeltaCommand(5), CopyDeltaCommand(7, 9), CopyDeltaCommand(300, 70000)
+    ]
+
+    for size in (1, 2, 3, 7, len(DELTA)):
+        parser = DeltaParser()
+        commands = []
+        for i in range(0, len(DELTA), size):
+            commands.extend(parser.feed(memoryview(DELTA)[i:i + size]))
+        assert commands == expected
+        assert parser.ended
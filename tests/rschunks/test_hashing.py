@@ -0,0 +1,26 @@
+import pytest
+
+from rschunks.hashing import available_hash_funcs, buffer_identity, parse_hash_identity
+
+from lansync.common import NodeChunk
+
+
+@pytest.mark.parametrize("name", available_hash_funcs())
+def test_hash_identity_carries_algorithm(name):
+    identity = buffer_identity(b"data", name)
+
+    assert parse_hash_identity(identity)[0] == name
+    assert (":" in identity) == (name != "md5")
+
+    chunk = NodeChunk(offset=0, size=4, hash=identity)
+    assert chunk.hash_func == name
+    chunk.check(b"data")
+    with pytest.raises(AssertionError):
+        chunk.check(b"atad")
+
+
+def test_legacy_md5_identity():
+    assert buffer_identity(b"data", "md5") == "8d777f385d3dfec8815d20f7496026dc"
+    assert parse_hash_identity("8d777f385d3dfec8815d20f7496026dc") == (
+        "md5", "8d777f385d3dfec8815d20f7496026dc"
+    )
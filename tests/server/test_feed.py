@@ -0,0 +1,74 @@
+import json
+import threading
+
+import pytest
+from faker import Faker, providers
+
+from lansync.common import NodeOperation
+from lansync.database import open_database
+from lansync_server.feed import EventFeed
+from lansync_server.main import app
+from lansync_server.models import all_models
+from lansync_server.service import store_events
+
+
+fake = Faker()
+fake.add_provider(providers.file)
+fake.add_provider(providers.date_time)
+
+
+def create_event():
+    return {
+        "key": fake.md5(),
+        "operation": NodeOperation.CREATE,
+        "path": fake.file_path(),
+        "timestamp": fake.date_time().isoformat(),
+        "checksum": fake.md5(),
+        "size": fake.pyint(1, 1024),
+        "chunks": [],
+    }
+
+
+@pytest.fixture()
+def db():
+    with open_database(":memory:", all_models):
+        yield
+
+
+def parse_message(chunk: bytes):
+    fields = dict(line.split(": ", 1) for line in chunk.decode().strip().split("\n"))
+    return int(fields["id"]), json.loads(fields["data"])
+
+
+def test_event_feed_wakes_up_waiters():
+    feed = EventFeed()
+    assert not feed.wait("ns", -1, timeout=0.01)
+
+    threading.Timer(0.05, feed.notify, args=("ns", 3)).start()
+    assert feed.wait("ns", 2, timeout=5)
+    assert not feed.wait("ns", 3, timeout=0.01)
+    assert not feed.wait("other", -1, timeout=0.01)
+
+
+def test_feed_streams_stored_events(db):
+    src_events = [create_event() for _ in range(3)]
+    store_events("ns", src_events)
+
+    response = app.test_client().get("/namespace/ns/feed?min_sequence_number=1", buffered=False)
+    messages = iter(response.response)
+    last_id, events = parse_message(next(messages))
+    assert last_id == 2
+    assert [e["key"] for e in events] == [e["key"] for e in src_events[1:]]
+
+    store_events("ns", [create_event()])
+    last_id, events = parse_message(next(messages))
+    assert last_id == 3 and len(events) == 1
+    response.close()
+
+
+def test_feed_starts_with_an_empty_message(db):
+    response = app.test_client().get(
+        "/namespace/ns/feed", headers={"Last-Event-ID": "4"}, buffered=False
+    )
+    assert parse_message(next(iter(response.response))) == (4, [])
+    response.close()
@@ -0,0 +1,76 @@
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from lansync.checksum import ChecksumService
+from lansync.database import open_database
+from lansync.models import all_models
+from lansync.node import LocalNode
+from lansync.session import RootFolder
+from lansync.util.file import file_checksum
+
+
+@pytest.fixture()
+def db():
+    with open_database(":memory:", all_models):
+        yield
+
+
+@pytest.fixture
+def session(tmp_path):
+    return Mock(namespace="test", root_folder=RootFolder.create(os.fspath(tmp_path)))
+
+
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_checksum_nodes(db, tmp_path, session, use_processes):
+    nodes = []
+    for i in range(5):
+        path = tmp_path / f"file{i}"
+        path.write_bytes(os.urandom(1000 * i + 1))
+        nodes.append(LocalNode.create(path, session))
+
+    service = ChecksumService(max_workers=2, use_processes=use_processes, block_size=256)
+    try:
+        stats = service.checksum_nodes(nodes)
+    finally:
+        service.shutdown()
+
+    assert stats.files == 5
+    assert stats.size == sum(node.size for node in nodes)
+    assert all(node._checksum == file_checksum(node.local_fspath) for node in nodes)
+
+
+def test_checksum_nodes_skips_known_checksums(db, tmp_path, session):
+    path = tmp_path / "file"
+    path.write_bytes(b"data")
+    node = LocalNode.create(path, session)
+    node._checksum = "known"
+
+    assert ChecksumService(max_workers=1).checksum_nodes([node]).files == 0
+    assert node.checksum == "known"
+
+
+def test_checksum_nodes_uses_content_cache(db, tmp_path, session):
+    path = tmp_path / "file"
+    path.write_bytes(b"data")
+    ChecksumService(max_workers=1).checksum_nodes([LocalNode.create(path, session)])
+
+    node = LocalNode.create(path, session)
+    assert ChecksumService(max_workers=1).checksum_nodes([node]).files == 0
+    assert node.checksum == file_checksum(os.fspath(path))
+
+
+def test_checksum_nodes_retries_unreadable_files(db, tmp_path, session):
+    path = tmp_path / "file"
+    path.write_bytes(b"data")
+    node = LocalNode.create(path, session)
+    path.unlink()
+
+    service = ChecksumService(max_workers=1)
+    assert service.checksum_nodes([node]).files == 0
+    assert node._checksum is None
+
+    path.write_bytes(b"data")
+    assert service.checksum_nodes([node]).files == 1
+    assert node.checksum == file_checksum(os.fspath(path))
@@ -0,0 +1,39 @@
+import pytest
+
+from lansync.daemon import Daemon
+
+
+@pytest.fixture
+def daemon():
+    daemon = Daemon("device")
+    yield daemon
+    daemon.action_pool.shutdown(wait=False)
+
+
+def test_sessions_share_daemon_resources(daemon, tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    first = daemon.add_session("a", str(tmp_path / "a"))
+    second = daemon.add_session("b", str(tmp_path / "b"))
+
+    assert first.peer_registry is second.peer_registry is daemon.peer_registry
+    assert first.client_pool is second.client_pool is daemon.client_pool
+    assert daemon.namespaces == ["a", "b"]
+    workers = list(daemon.workers.values())
+    assert all(worker.sync_action_scheduler.pool is daemon.action_pool for worker in workers)
+    assert all(worker.sync_action_producer.checksum_service is daemon.checksum_service for worker in workers)
+
+
+def test_namespace_hosted_once(daemon, tmp_path):
+    daemon.add_session("a", str(tmp_path))
+    with pytest.raises(ValueError):
+        daemon.add_session("a", str(tmp_path))
+
+
+def test_schedule_sync_reaches_namespace_worker(daemon, tmp_path):
+    daemon.add_session("a", str(tmp_path))
+    daemon.schedule_sync("a")
+    daemon.schedule_sync("unknown")
+
+    event, args = daemon.workers["a"].event_queue.get_nowait()
+    assert event == "scheduled_sync"
@@ -2,7 +2,7 @@ from datetime import datetime
 
 from faker import Faker, providers
 
-from lansync.discovery import DiscoveryMessage, PeerRegistry, Peer
+from lansync.discovery import MAX_DISCOVERY_MESSAGE_SIZE, DiscoveryMessage, PeerRegistry, Peer
 
 fake = Faker()
 fake.add_provider(providers.internet)
@@ -53,3 +53,32 @@ def test_peer_iteration():
         )
 
     assert len(list(registry.iter_peers(namespace))) == 5
+
+
+def test_multi_namespace_message_registers_every_namespace():
+    registry = PeerRegistry()
+    device_id, _, ip, port = create_peer_params()
+    namespaces = ["alpha", "beta", "gamma"]
+    registry.handle_discovery_message(ip, DiscoveryMessage.create(device_id, port, namespaces))
+
+    for namespace in namespaces:
+        assert registry.choose(namespace).device_id == device_id
+
+
+def test_peer_address_change_replaces_peer():
+    registry = PeerRegistry()
+    device_id, namespace, ip, port = create_peer_params()
+    registry.handle_discovery_message(ip, DiscoveryMessage.create(device_id, port, [namespace]))
+    registry.handle_discovery_message(ip, DiscoveryMessage.create(device_id, port + 1, [namespace]))
+
+    assert registry.choose(namespace).port == port + 1
+
+
+def test_namespaces_split_over_datagrams():
+    device_id, _, _, port = create_peer_params()
+    namespaces = [f"namespace-{i:04d}" for i in range(200)]
+    messages = DiscoveryMessage.for_namespaces(device_id, port, namespaces)
+
+    assert len(messages) > 1
+    assert all(len(msg.encode()) <= MAX_DISCOVERY_MESSAGE_SIZE for msg in messages)
+    assert [ns for msg in messages for ns in msg.all_namespaces] == namespaces
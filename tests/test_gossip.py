@@ -0,0 +1,91 @@
+import dataclasses
+from unittest.mock import Mock
+
+import pytest
+from faker import Faker, providers
+
+from lansync import models
+from lansync.database import open_database
+from lansync.gossip import MarketGossip, Rumors, pick_peers
+from lansync.market import ChunkSet, Market
+
+fake = Faker()
+fake.add_provider(providers.misc)
+fake.add_provider(providers.internet)
+
+
+@pytest.fixture()
+def db():
+    with open_database(":memory:", models.all_models):
+        yield
+
+
+class FakeClient:
+    """A peer that merges the markets it receives like the server does."""
+
+    def __init__(self, device_id, market):
+        self.peer = Mock(device_id=device_id)
+        self.market = market
+        self.received = 0
+
+    def exchange_market(self, market):
+        self.received += 1
+        self.market.merge(market)
+        return dataclasses.replace(self.market, peers=dict(self.market.peers))
+
+
+def create_gossip(namespace, clients, fanout=2, stop_after=2):
+    session = Mock(
+        namespace=namespace,
+        peer_registry=Mock(live_peers=lambda namespace: list(clients)),
+        client_pool=Mock(aquire=lambda peer: peer),
+    )
+    return MarketGossip(session, fanout=fanout, interval=0, stop_after=stop_after)
+
+
+def test_rumor_dies_after_useless_exchanges():
+    rumors = Rumors(stop_after=2)
+    rumors.touch("a")
+    rumors.feedback("a", False)
+    rumors.feedback("a", True)
+    rumors.feedback("a", False)
+    assert rumors.keys() == ["a"]
+    rumors.feedback("a", False)
+    assert rumors.keys() == []
+    rumors.feedback("b", True)
+    assert rumors.keys() == []
+
+
+def test_pick_peers_bounded_by_fanout():
+    assert len(pick_peers(range(10), 3)) == 3
+    assert sorted(pick_peers(range(2), 3)) == [0, 1]
+
+
+def test_gossip_round_merges_and_stops(db):
+    namespace, key = fake.hostname(), fake.md5()
+    own, other = fake.uuid4(), fake.uuid4()
+    Market(namespace=namespace, key=key, peers={own: ChunkSet.full(8)}).exchange_with_db()
+    clients = [
+        FakeClient(other, Market(namespace=namespace, key=key, peers={other: ChunkSet.empty(8).mark(3)})),
+        FakeClient(fake.uuid4(), Market(namespace=namespace, key=key, peers={})),
+    ]
+    gossip = create_gossip(namespace, clients)
+    gossip.touch(key)
+
+    assert gossip.run_round() == 2
+    market = Market.load_from_db(namespace, key)
+    assert market.peers[other].has(3)
+    assert all(own in client.market.peers for client in clients)
+
+    # Nothing new is learned from now on, the rumor dies after `stop_after` exchanges
+    assert gossip.drain() == 2
+    assert len(gossip.rumors) == 0
+    assert gossip.run_round() == 0
+    assert [client.received for client in clients] == [2, 2]
+
+
+def test_gossip_drops_unknown_market(db):
+    gossip = create_gossip(fake.hostname(), [FakeClient(fake.uuid4(), None)])
+    gossip.touch(fake.md5())
+    assert gossip.run_round() == 0
+    assert len(gossip.rumors) == 0
@@ -1,18 +1,26 @@
 import os
 import tempfile
+from base64 import b64encode
+from dataclasses import asdict
 from os.path import normcase
 from pathlib import Path
 from unittest.mock import Mock
 
+import peewee  # type: ignore
 import pytest
+from dynaconf import settings  # type: ignore
 from faker import Faker, providers
 
+import librsync
+from rschunks.delta import parse_delta_from_file
 from lansync import common
 from lansync.database import open_database
 from lansync.discovery import Peer
-from lansync.models import Chunk, NodeChunk, StoredNode, all_models
-from lansync.node import LocalNode, store_new_node
+from lansync.chunk import calc_delta_commands, calc_initial_chunks, calc_new_chunks, calc_signature
+from lansync.models import Chunk, Namespace, NodeChunk, PartialDownload, RemoteNode, StoredNode, all_models
+from lansync.node import LocalNode, PartialNode, store_new_node
 from lansync.session import RootFolder
+from lansync.util.file import hash_path
 
 fake = Faker()
 fake.add_provider(providers.misc)
@@ -81,3 +89,208 @@ def test_find_chunk_by_hash(db, file_manager, session):
     assert chunk1 == chunk2
 
     assert full_node.stored_node.chunks == full_node.all_chunks
+
+
+def test_ingest_matches_separate_passes(db, file_manager, session):
+    local_node = LocalNode.create(file_manager.create_file(1024 * 5 + 100), session)
+    expected = LocalNode.create(local_node.local_path, session)
+
+    chunks = local_node.ingest()
+
+    assert chunks == expected.calc_chunks(None)
+    assert local_node.checksum == expected.checksum
+    assert local_node.calc_signature(format="binary") == expected.calc_signature(format="binary")
+
+
+def test_chunks_against_a_signature_are_not_the_cached_ones(db, download_session):
+    path = download_session.root_folder.path / "file.bin"
+    path.write_bytes(fake.binary(1024 * 4))
+    signature = b64encode(calc_signature(os.fspath(path))).decode()
+    path.write_bytes(fake.binary(100) + path.read_bytes())
+    LocalNode.create(path, download_session).ingest()
+
+    local_node = LocalNode.create(path, download_session)
+    assert local_node.calc_chunks(signature) == calc_new_chunks(os.fspath(path), signature)
+    assert local_node.calc_chunks(signature) != local_node.calc_chunks(None)
+
+
+def test_ingest_reuses_content_cache(db, file_manager, session):
+    path = file_manager.create_file(1024 * 3 + 10)
+    chunks = LocalNode.create(path, session).ingest()
+
+    local_node = LocalNode.create(path, session)
+    assert local_node.restore_cached()
+    assert local_node.ingest() == chunks
+
+    os.utime(path, ns=(0, 0))
+    assert not LocalNode.create(path, session).restore_cached()
+
+
+def test_signature_streams_into_memory(tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(fake.binary(1024 * 5 + 100))
+    librsync.signature_from_paths(os.fspath(path), os.fspath(tmp_path / "sig"), block_len=settings.CHUNK_SIZE)
+
+    assert calc_signature(os.fspath(path)) == (tmp_path / "sig").read_bytes()
+
+
+def test_delta_commands_stream_without_temp_files(tmp_path):
+    old, new = tmp_path / "old.bin", tmp_path / "new.bin"
+    data = fake.binary(1024 * 8)
+    old.write_bytes(data)
+    new.write_bytes(data[:3000] + fake.binary(700) + data[3000:])
+    signature = calc_signature(os.fspath(old))
+    (tmp_path / "sig").write_bytes(signature)
+    librsync.delta_from_paths(os.fspath(tmp_path / "sig"), os.fspath(new), os.fspath(tmp_path / "delta"))
+
+    commands = calc_delta_commands(os.fspath(new), b64encode(signature).decode(), block_size=1000)
+
+    assert commands == list(parse_delta_from_file(os.fspath(tmp_path / "delta")))
+    assert sum(c.length for c in commands) == new.stat().st_size
+
+
+@pytest.fixture
+def download_session(tmp_path):
+    root = tmp_path / "root"
+    root.mkdir()
+    return Mock(namespace=fake.user_name(), root_folder=RootFolder.create(os.fspath(root)))
+
+
+def make_remote_node(session, tmp_path, data, path="docs/file.bin"):
+    source = tmp_path / "source.bin"
+    source.write_bytes(data)
+    chunks = calc_initial_chunks(os.fspath(source))
+    return RemoteNode(
+        namespace=Namespace.for_session(session),
+        key=hash_path(path),
+        sequence_number=1,
+        path=path,
+        timestamp="",
+        checksum=fake.md5(),
+        chunks=[asdict(chunk) for chunk in chunks],
+        size=len(data),
+        signature="",
+    )
+
+
+def test_interrupted_download_resumes_with_missing_chunks(db, download_session, tmp_path):
+    data = fake.binary(1024 * 6 + 100)
+    remote_node = make_remote_node(download_session, tmp_path, data)
+
+    node = PartialNode.prepare(remote_node, download_session)
+    written = list(node.chunk_index)[:3]
+    for chunk_hash in written:
+        chunk = node.chunk_index[chunk_hash][0]
+        node.write_chunk(chunk_hash, data[chunk.offset:chunk.offset + chunk.size])
+
+    resumed = PartialNode.prepare(remote_node, download_session)
+    assert resumed.stored_node.id == node.stored_node.id
+    assert resumed.temp_path == node.temp_path
+    assert [h for h in resumed.chunk_index if resumed.has_chunk(h)] == written
+
+    for chunk_hash in resumed.chunk_index:
+        if not resumed.has_chunk(chunk_hash):
+            chunk = resumed.chunk_index[chunk_hash][0]
+            resumed.write_chunk(chunk_hash, data[chunk.offset:chunk.offset + chunk.size])
+    resumed.finish(download_session)
+
+    stored_node = StoredNode.get(StoredNode.key == remote_node.key)
+    assert stored_node.ready
+    assert stored_node.local_path.read_bytes() == data
+    assert not node.temp_path.exists()
+    assert PartialDownload.select().count() == 0
+
+
+def test_download_of_new_content_discards_partial(db, download_session, tmp_path):
+    data = fake.binary(1024 * 3)
+    remote_node = make_remote_node(download_session, tmp_path, data)
+    node = PartialNode.prepare(remote_node, download_session)
+
+    remote_node.checksum = fake.md5()
+    restarted = PartialNode.prepare(remote_node, download_session)
+
+    assert restarted.temp_path != node.temp_path
+    assert not node.temp_path.exists()
+    assert restarted.received.count() == 0
+    assert PartialDownload.select().count() == 1
+
+
+def test_partial_chunks_are_served_from_temp_file(db, download_session, tmp_path):
+    data = fake.binary(1024 * 3)
+    remote_node = make_remote_node(download_session, tmp_path, data)
+    node = PartialNode.prepare(remote_node, download_session)
+    chunk_hash = next(iter(node.chunk_index))
+    chunk = node.chunk_index[chunk_hash][0]
+    node.write_chunk(chunk_hash, data[chunk.offset:chunk.offset + chunk.size])
+
+    _, read_chunk = NodeChunk.find(download_session.namespace, chunk_hash)
+    assert read_chunk() == data[chunk.offset:chunk.offset + chunk.size]
+
+
+def test_bulk_manifest_matches_per_chunk_rows(db, download_session):
+    path = download_session.root_folder.path / "file.bin"
+    path.write_bytes(fake.binary(1024 * 5 + 100))
+    full_node = store_new_node(LocalNode.create(path, download_session), download_session, None)
+    chunks = full_node.all_chunks + [common.NodeChunk(offset=9999, size=7, hash=full_node.all_chunks[0].hash)]
+
+    NodeChunk.bulk_update_or_create(full_node.stored_node, chunks, batch_size=2)
+
+    rows = {(c.chunk.hash, c.chunk.size, c.offset) for c in NodeChunk.select().join(Chunk)}
+    expected = {(c.hash, c.size, c.offset) for c in full_node.all_chunks[1:]} | {(chunks[0].hash, 7, 9999)}
+    assert rows == expected
+    assert Chunk.select().count() == len({c.hash for c in chunks})
+
+
+def test_download_of_duplicate_file_clones_it(db, download_session, tmp_path):
+    data = fake.binary(1024 * 4 + 10)
+    path = download_session.root_folder.path / "original.bin"
+    path.write_bytes(data)
+    full_node = store_new_node(LocalNode.create(path, download_session), download_session, None)
+    remote_node = make_remote_node(download_session, tmp_path, data, path="copy.bin")
+    remote_node.checksum = full_node.stored_node.checksum
+
+    node = PartialNode.prepare(remote_node, download_session)
+
+    assert node.received.full
+    assert node.temp_path.read_bytes() == data
+
+
+def test_download_copies_shared_local_chunks(db, download_session, tmp_path):
+    data = fake.binary(1024 * 4)
+    path = download_session.root_folder.path / "original.bin"
+    path.write_bytes(data)
+    store_new_node(LocalNode.create(path, download_session), download_session, None)
+    new_data = data[:2048] + fake.binary(1024) + data[:1024]
+    remote_node = make_remote_node(download_session, tmp_path, new_data, path="changed.bin")
+
+    node = PartialNode.prepare(remote_node, download_session)
+
+    shared = {chunk.hash for chunk in node.all_chunks if chunk.offset < 2048}
+    assert {h for h in node.chunk_index if node.has_chunk(h)} == shared
+    assert node.received.count() == 3
+    content = node.temp_path.read_bytes()
+    assert content[:2048] == new_data[:2048] and content[3072:] == new_data[3072:]
+
+
+def test_old_chunk_schema_is_migrated(tmp_path, download_session):
+    db_path = os.fspath(tmp_path / "old.db")
+    with open_database(db_path, all_models) as db:
+        path = download_session.root_folder.path / "file.bin"
+        path.write_bytes(fake.binary(1024 * 3))
+        full_node = store_new_node(LocalNode.create(path, download_session), download_session, None)
+        # The schema before `Chunk.hash` and `(node, chunk)` were unique
+        db.execute_sql('DROP INDEX "chunk_hash"')
+        db.execute_sql('DROP INDEX "nodechunk_node_id_chunk_id"')
+        db.execute_sql('CREATE INDEX "chunk_hash" ON "chunk" ("hash")')
+        with pytest.raises(peewee.OperationalError):
+            NodeChunk.bulk_update_or_create(full_node.stored_node, full_node.all_chunks)
+        first = full_node.all_chunks[0]
+        duplicate = Chunk.create(hash=first.hash, size=first.size)
+        NodeChunk.create(node=full_node.stored_node, chunk=duplicate, offset=first.offset)
+
+    with open_database(db_path, all_models) as db:
+        assert Chunk.select().where(Chunk.hash == first.hash).count() == 1
+        assert NodeChunk.select().count() == len(full_node.all_chunks)
+        assert any(index.unique and index.columns == ["hash"] for index in db.get_indexes("chunk"))
+        NodeChunk.bulk_update_or_create(full_node.stored_node, full_node.all_chunks)
+        assert NodeChunk.select().count() == len(full_node.all_chunks)
@@ -1,16 +1,20 @@
 from base64 import b64encode
 from dataclasses import asdict
+import json
 import random
+import time
 from unittest.mock import Mock
 
 import pytest
 from faker import Faker, providers
 from playhouse.sqlite_udf import hostname
+import requests
 
 from lansync.database import open_database
 from lansync.models import RemoteNode, Namespace, all_models
 from lansync.common import NodeEvent, NodeOperation, NodeChunk
-from lansync.remote import RemoteEventHandler, RemoteUrl
+from lansync.remote import EventPublisher, RemoteClient, RemoteEventFeed, RemoteEventHandler, RemoteUrl
+from lansync.serializers import NodeEventSerializer
 
 fake = Faker()
 fake.add_provider(providers.internet)
@@ -92,3 +96,151 @@ def test_get_max_sequence_number(db):
 
     max_seq_num = RemoteNode.max_sequence_number(Namespace.by_name(namespace))
     assert max_seq_num == max(seq_nums)
+
+
+class FakeStream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_track_events(monkeypatch):
+    events = [
+        create_event(operation=NodeOperation.CREATE, sequence_number=i, chunks=[], signature=None)
+        for i in range(3)
+    ]
+    data = json.dumps(NodeEventSerializer().dump(events, many=True))
+    requested = []
+
+    def get(url, **kwargs):
+        requested.append(url)
+        return FakeStream([b"id: -1\ndata: []\n\n", b": keepalive\n\n", f"id: 2\ndata: {data}\n\n".encode()])
+
+    monkeypatch.setattr(requests, "get", get)
+    session = Mock(remote_server_url="http://example.com", namespace="ns")
+    batches = list(RemoteClient(session).track_events(5))
+
+    assert requested == ["http://example.com/namespace/ns/feed?min_sequence_number=5"]
+    assert [len(batch) for batch in batches] == [0, 3]
+    assert [event.key for event in batches[1]] == [event.key for event in events]
+
+
+def test_remote_event_feed_applies_events(db, monkeypatch):
+    namespace = fake.hostname()
+    events = [create_event(operation=NodeOperation.CREATE, sequence_number=i) for i in range(3)]
+    received = []
+
+    def track_events(self, min_sequence_number):
+        assert min_sequence_number == 0
+        yield []
+        yield events
+        feed.stop()
+        yield []
+
+    monkeypatch.setattr(RemoteClient, "track_events", track_events)
+    feed = RemoteEventFeed(Mock(namespace=namespace), on_events=received.append)
+    feed.running = True
+    feed.run()
+
+    assert received == [events]
+    assert RemoteNode.select().count() == 3
+
+
+def test_remote_event_feed_retries_startup(db, monkeypatch):
+    namespace = fake.hostname()
+    failures = [RuntimeError("database is locked")]
+
+    def last_sequence_number(self):
+        if failures:
+            raise failures.pop()
+        return None
+
+    def track_events(self, min_sequence_number):
+        feed.stop()
+        yield []
+
+    monkeypatch.setattr(RemoteEventHandler, "last_sequence_number", last_sequence_number)
+    monkeypatch.setattr(RemoteClient, "track_events", track_events)
+    monkeypatch.setattr(time, "sleep", lambda delay: None)
+    feed = RemoteEventFeed(Mock(namespace=namespace), on_events=Mock())
+    feed.running = True
+    feed.run()
+
+    assert failures == []
+
+
+def test_handle_events_skips_applied_events(db, monkeypatch):
+    namespace = fake.hostname()
+    key = fake.md5()
+    created = create_event(operation=NodeOperation.CREATE, key=key, sequence_number=1)
+    deleted = create_event(operation=NodeOperation.DELETE, key=key, sequence_number=2)
+    monkeypatch.setattr(RemoteClient, "fetch_events", lambda self, min_sequence_number: [created, deleted])
+    handler = RemoteEventHandler(Mock(namespace=namespace))
+
+    # A full sync refresh applies the events the feed thread is about to apply
+    assert handler.handle_new_events() == [created, deleted]
+    assert handler.handle_events([created]) == []
+    assert RemoteNode.select().count() == 0
+
+
+def test_event_publisher_pushes_batches(monkeypatch):
+    posted = []
+    refreshed = []
+
+    def post(url, json):
+        posted.append(json)
+        return Mock()
+
+    monkeypatch.setattr(requests, "post", post)
+    monkeypatch.setattr(RemoteEventHandler, "handle_new_events", lambda self: refreshed.append(1) or [])
+    session = Mock(remote_server_url="http://example.com", namespace="ns")
+    publisher = EventPublisher(session, max_events=3, max_delay=60)
+
+    for _ in range(4):
+        publisher.publish(create_event(operation=NodeOperation.DELETE))
+    assert [len(events) for events in posted] == [3]
+    assert not publisher.empty
+
+    publisher.flush()
+    assert [len(events) for events in posted] == [3, 1]
+    assert len(refreshed) == 2
+    assert publisher.empty and not publisher.timeout.running
+
+
+def test_event_publisher_keeps_events_on_failure(monkeypatch):
+    def post(url, json):
+        raise requests.ConnectionError()
+
+    monkeypatch.setattr(requests, "post", post)
+    session = Mock(remote_server_url="http://example.com", namespace="ns")
+    publisher = EventPublisher(session, max_events=10, max_delay=60, max_retry_delay=600)
+    events = [create_event(operation=NodeOperation.DELETE) for _ in range(2)]
+    for event in events:
+        publisher.publish(event)
+
+    published = []
+    publisher.publish(events[1], on_published=lambda: published.append(events[1]))
+
+    with pytest.raises(requests.ConnectionError):
+        publisher.flush()
+    first_retry = publisher.timeout.interval
+    with pytest.raises(requests.ConnectionError):
+        publisher.flush()
+    publisher.timeout.stop()
+    assert [event for event, _ in publisher.pending] == events + events[1:]
+    assert published == []
+    assert 60 < first_retry < publisher.timeout.interval
+
+    monkeypatch.setattr(requests, "post", lambda url, json: Mock())
+    monkeypatch.setattr(RemoteEventHandler, "handle_new_events", lambda self: [])
+    publisher.flush()
+    assert published == [events[1]]
+    assert publisher.empty and publisher.timeout.interval == 60
@@ -0,0 +1,104 @@
+import os
+from unittest.mock import Mock
+
+import pytest
+
+from lansync.database import open_database
+from lansync.models import all_models
+from lansync.scanner import LocalScanner
+from lansync.session import RootFolder
+
+
+@pytest.fixture()
+def db():
+    with open_database(":memory:", all_models):
+        yield
+
+
+@pytest.fixture
+def session(tmp_path):
+    return Mock(namespace="test", root_folder=RootFolder.create(os.fspath(tmp_path)))
+
+
+def paths(items):
+    return sorted(path for path, _ in items)
+
+
+def test_scan_reports_new_changed_and_vanished(db, session, tmp_path):
+    (tmp_path / "a").write_bytes(b"a")
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "b").write_bytes(b"b")
+
+    scanner = LocalScanner(session)
+    result = scanner.scan()
+    assert paths(result.new) == ["a", "dir/b"]
+    assert result.changed == [] and result.vanished == []
+
+    assert scanner.scan().empty
+
+    (tmp_path / "a").write_bytes(b"aaaa")
+    (tmp_path / "dir" / "b").unlink()
+    (tmp_path / "c").write_bytes(b"c")
+    result = scanner.scan()
+    assert paths(result.new) == ["c"]
+    assert paths(result.changed) == ["a"]
+    assert result.vanished == ["dir/b"]
+
+
+def test_scan_state_is_persistent(db, session, tmp_path):
+    (tmp_path / "a").write_bytes(b"a")
+    LocalScanner(session).scan()
+
+    scanner = LocalScanner(session)
+    assert list(scanner.load().keys()) == ["a"]
+    assert scanner.scan().empty
+
+
+def test_rescan_only_checks_given_paths(db, session, tmp_path):
+    (tmp_path / "a").write_bytes(b"a")
+    (tmp_path / "b").write_bytes(b"b")
+    scanner = LocalScanner(session)
+    scanner.scan()
+
+    (tmp_path / "a").write_bytes(b"aaaa")
+    (tmp_path / "b").unlink()
+    result = scanner.rescan(["a"])
+    assert paths(result.changed) == ["a"]
+    assert result.vanished == []
+
+    result = scanner.rescan(["b"])
+    assert result.vanished == ["b"]
+
+
+def test_rescan_folder_covers_its_files(db, session, tmp_path):
+    (tmp_path / "dir").mkdir()
+    (tmp_path / "dir" / "a").write_bytes(b"a")
+    (tmp_path / "dir" / "b").write_bytes(b"b")
+    scanner = LocalScanner(session)
+    scanner.scan()
+
+    (tmp_path / "dir" / "b").unlink()
+    (tmp_path / "dir" / "c").write_bytes(b"c")
+    result = scanner.rescan(["dir"])
+    assert paths(result.new) == ["dir/c"]
+    assert result.vanished == ["dir/b"]
+
+    for name in ("a", "c"):
+        (tmp_path / "dir" / name).unlink()
+    (tmp_path / "dir").rmdir()
+    assert sorted(scanner.rescan(["dir"]).vanished) == ["dir/a", "dir/c"]
+
+
+def test_scan_prunes_ignored_paths(db, session, tmp_path):
+    (tmp_path / ".lansyncignore").write_text("build/\n*.tmp\n")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "out").write_bytes(b"out")
+    (tmp_path / "a").write_bytes(b"a")
+    (tmp_path / "a.tmp").write_bytes(b"tmp")
+
+    scanner = LocalScanner(session)
+    assert paths(scanner.scan().new) == [".lansyncignore", "a"]
+    assert scanner.rescan(["build", "a.tmp"]).empty
+
+    (tmp_path / ".lansyncignore").write_text("build/\n*.tmp\n/a\n")
+    assert scanner.rescan(["a"]).vanished == ["a"]
@@ -0,0 +1,186 @@
+from collections import Counter
+from functools import partial
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import Mock
+from uuid import uuid4
+
+import pytest
+
+from lansync.database import open_database
+from lansync.session import RootFolder
+from lansync.sync import (iter_batches, iter_remote_nodes, iter_stored_nodes, load_full_nodes, merge_node_rows,
+                          update_sorted_keys)
+from lansync.sync_logic import handle_node
+from lansync.sync_action import (ActionPlan, SyncAction, SyncActionScheduler, SyncProgress, delete_stored,
+                                 nop, size_priority)
+from lansync import models
+from lansync.models import RemoteNode, RemoteNodeRecord, StoredNode, StoredNodeRecord, all_models
+
+
+@pytest.fixture
+def db():
+    with open_database(":memory:", all_models):
+        yield
+
+
+def test_merge_node_rows_joins_sorted_sources():
+    remote = [RemoteNode(key="a"), RemoteNode(key="c")]
+    stored = [StoredNode(key="b"), StoredNode(key="c")]
+
+    rows = [tuple(row) for row in merge_node_rows(remote, [], stored)]
+
+    assert [row[0] for row in rows] == ["a", "b", "c"]
+    assert rows[0][1] is not None and rows[0][3] is None
+    assert rows[1][1] is None and rows[1][3] is not None
+    assert rows[2][1] is not None and rows[2][3] is not None
+
+
+def test_merge_node_rows_is_lazy():
+    def source():
+        yield RemoteNode(key="a")
+        yield RemoteNode(key="b")
+        raise AssertionError("read past the second key")
+
+    rows = merge_node_rows(source(), [SimpleNamespace(key="c")])
+    assert next(rows).key == "a"
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches([], 2)) == []
+
+
+@pytest.mark.parametrize("bisect_max_changes", [0, 64])
+def test_update_sorted_keys(bisect_max_changes):
+    keys = ["b", "d", "f"]
+    updated = update_sorted_keys(keys, ["e", "a"], {"d"}, bisect_max_changes=bisect_max_changes)
+    assert updated == ["a", "b", "e", "f"]
+
+
+def test_action_plan_drops_nops_and_counts_types():
+    plan = ActionPlan([nop(), delete_stored(StoredNode(key="a")), nop()])
+    with plan.phase("decide"):
+        pass
+
+    assert len(plan) == 1
+    assert plan.counts == {"nop": 2, "delete_stored": 1}
+    assert plan.popleft().name == "delete_stored"
+    assert not plan
+    assert plan.summary().startswith("0 actions (delete_stored: 1, nop: 2) in decide: ")
+
+
+class RecordingExecutor:
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.log = []
+        self.running = Counter()
+        self.max_running = Counter()
+
+    def do_action(self, action):
+        with self.lock:
+            self.running[action.kind] += 1
+            self.max_running[action.kind] = max(self.max_running[action.kind], self.running[action.kind])
+            self.log.append(("start", action.name, action.key))
+        time.sleep(self.delay)
+        with self.lock:
+            self.running[action.kind] -= 1
+            self.log.append(("end", action.name, action.key))
+
+
+def download(remote_node, session):
+    pass
+
+
+def upload(local_node, session):
+    pass
+
+
+def make_action(func, key):
+    return SyncAction(partial(func, SimpleNamespace(key=key)))
+
+
+def test_scheduler_limits_concurrency_per_kind():
+    executor = RecordingExecutor()
+    scheduler = SyncActionScheduler(executor, max_workers=4, limits={"download": 1, "upload": 3})
+    scheduler.submit_all(
+        [make_action(download, f"d{i}") for i in range(3)]
+        + [make_action(upload, f"u{i}") for i in range(6)]
+    )
+    scheduler.join()
+
+    assert executor.max_running == {"download": 1, "upload": 3}
+    assert len(executor.log) == 18
+    # the slow lane of downloads does not hold back the uploads
+    first_end = [name for event, name, _ in executor.log if event == "end"][:3]
+    assert "upload" in first_end
+
+
+def test_scheduler_serialises_actions_on_the_same_key():
+    executor = RecordingExecutor()
+    idle = threading.Event()
+    scheduler = SyncActionScheduler(executor, max_workers=4, limits={}, on_idle=idle.set)
+    scheduler.submit_all([make_action(download, "a"), make_action(upload, "a"), make_action(upload, "b")])
+    assert idle.wait(5)
+
+    a_events = [(event, name) for event, name, key in executor.log if key == "a"]
+    assert a_events == [
+        ("start", "download"), ("end", "download"), ("start", "upload"), ("end", "upload")
+    ]
+    assert scheduler.idle
+
+
+def test_size_priority_runs_deletes_then_boosted_then_small_files():
+    actions = [
+        SyncAction(partial(download, SimpleNamespace(key="a", path="big", size=1000))),
+        SyncAction(partial(download, SimpleNamespace(key="b", path="small", size=1))),
+        SyncAction(partial(download, SimpleNamespace(key="c", path="docs/x", size=500))),
+        delete_stored(SimpleNamespace(key="d", path="gone", size=10000)),
+    ]
+    plan = ActionPlan(actions)
+    plan.prioritize(size_priority(["docs"]))
+
+    assert [action.path for action in plan] == ["gone", "docs/x", "small", "big"]
+
+
+def test_sync_progress_records_milestones():
+    progress = SyncProgress(4, milestones=(0.5, 1.0))
+    progress.complete()
+    assert progress.reached == {}
+    progress.complete()
+    assert list(progress.reached) == [0.5]
+    progress.complete()
+    progress.complete()
+    assert list(progress.reached) == [0.5, 1.0]
+    assert progress.summary().startswith("4/4 actions, time to 50%: ")
+
+
+def test_decisions_read_records_and_actions_load_full_rows(db, tmp_path):
+    session = Mock(namespace=str(uuid4()), root_folder=RootFolder.create(str(tmp_path)))
+    namespace = models.Namespace.by_name(session.namespace)
+    root_folder = models.RootFolder.by_path(session.root_folder.fspath)
+    StoredNode.create(
+        namespace=namespace, root_folder=root_folder, key="a", path="a", checksum="x",
+        local_modified_time=1, local_created_time=1, ready=True, size=1, signature="stored-signature",
+    )
+    RemoteNode.create(
+        namespace=namespace, key="a", sequence_number=1, path="a", timestamp="", checksum="y",
+        chunks=[], size=2, signature="remote-signature",
+    )
+
+    [stored] = iter_stored_nodes(session)
+    [remote] = iter_remote_nodes(session)
+    assert isinstance(stored, StoredNodeRecord) and stored.ready is True
+    assert isinstance(remote, RemoteNodeRecord)
+
+    action = handle_node(remote, None, stored)
+    [loaded] = load_full_nodes([action])
+    remote_node, stored_node = loaded.action.args
+    assert (loaded.name, remote_node.signature, stored_node.signature) == (
+        "delete_remote", "remote-signature", "stored-signature"
+    )
+
+    StoredNode.delete().execute()
+    assert load_full_nodes([action]) == []
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 import random
 import string
@@ -21,7 +22,7 @@ from lansync.sync_action import (
     nop,
 )
 from lansync.sync_logic import handle_node
-from lansync.util.file import hash_path
+from lansync.util.file import file_checksum, hash_path
 
 
 class Bunch:
@@ -138,74 +139,105 @@ class FileGenerator:
 file = FileGenerator()
 
 
-@pytest.mark.parametrize(
-    "number,remote,local,stored,expected_action_factory",
-    [
-        (1, None, None, None, lambda r, l, s: nop()),
-        (
-            2, None, None, file.new().stored(),
-            lambda r, l, s: delete_stored(s)
-        ),
-        (
-            3, None, file.new().local(), None,
-            lambda r, l, s: upload(l, s)
-        ),
-        (
-            4, None, file.new().local(), file.stored(),
-            lambda r, l, s: delete_local(l, s)
-        ),
-        (
-            5, file.new().remote(), None, None,
-            lambda r, l, s: download(r, s)
-        ),
-        (
-            6, file.new().remote(), None, file.stored(),
-            lambda r, l, s: delete_remote(r, s)
-        ),
-        (
-            7, file.new().remote(), file.local(), None,
-            lambda r, l, s: save_stored(r, l)
-        ),
-        (
-            8, file.new().remote(), file.local(_checksum=checksum.new()), None,
-            lambda r, l, s: conflict(r, l, s)
-        ),
-        (
-            9, file.new().remote(), file.local(), file.stored(),
-            lambda r, l, s: nop()
-        ),
-        (
-            10,
-            file.new().remote(),
-            file.local(modified_time=modified_time.new(), _checksum=checksum.new()),
-            file.stored(),
-            lambda r, l, s: upload(l, s)
-        ),
-        (
-            11, file.new().remote(checksum=checksum.new()), file.local(), file.stored(),
-            lambda r, l, s: download(r, s)
-        ),
-        (
-            12,
-            file.new().remote(checksum=checksum.new()),
-            file.local(modified_time=modified_time.new(), _checksum=checksum.same()),
-            file.stored(),
-            lambda r, l, s: save_stored(r, l)
-        ),
-        (
-            13,
-            file.new().remote(checksum=checksum.new()),
-            file.local(modified_time=modified_time.new(), _checksum=checksum.new()),
-            file.stored(),
-            lambda r, l, s: conflict(r, l, s)
-        ),
-        (
-            14, file.new().remote(), file.local(), file.stored(ready=False),
-            lambda r, l, s: download(r, s)
-        ),
-    ]
-)
+HANDLE_NODE_CASES = [
+    (1, None, None, None, lambda r, l, s: nop()),
+    (
+        2, None, None, file.new().stored(),
+        lambda r, l, s: delete_stored(s)
+    ),
+    (
+        3, None, file.new().local(), None,
+        lambda r, l, s: upload(l, s)
+    ),
+    (
+        4, None, file.new().local(), file.stored(),
+        lambda r, l, s: delete_local(l, s)
+    ),
+    (
+        5, file.new().remote(), None, None,
+        lambda r, l, s: download(r, s)
+    ),
+    (
+        6, file.new().remote(), None, file.stored(),
+        lambda r, l, s: delete_remote(r, s)
+    ),
+    (
+        7, file.new().remote(), file.local(), None,
+        lambda r, l, s: save_stored(r, l)
+    ),
+    (
+        8, file.new().remote(), file.local(_checksum=checksum.new()), None,
+        lambda r, l, s: conflict(r, l, s)
+    ),
+    (
+        9, file.new().remote(), file.local(), file.stored(),
+        lambda r, l, s: nop()
+    ),
+    (
+        10,
+        file.new().remote(),
+        file.local(modified_time=modified_time.new(), _checksum=checksum.new()),
+        file.stored(),
+        lambda r, l, s: upload(l, s)
+    ),
+    (
+        11, file.new().remote(checksum=checksum.new()), file.local(), file.stored(),
+        lambda r, l, s: download(r, s)
+    ),
+    (
+        12,
+        file.new().remote(checksum=checksum.new()),
+        file.local(modified_time=modified_time.new(), _checksum=checksum.same()),
+        file.stored(),
+        lambda r, l, s: save_stored(r, l)
+    ),
+    (
+        13,
+        file.new().remote(checksum=checksum.new()),
+        file.local(modified_time=modified_time.new(), _checksum=checksum.new()),
+        file.stored(),
+        lambda r, l, s: conflict(r, l, s)
+    ),
+    (
+        14, file.new().remote(), file.local(), file.stored(ready=False),
+        lambda r, l, s: download(r, s)
+    ),
+    (
+        15, file.new().remote(), None, file.stored(ready=False),
+        lambda r, l, s: download(r, s)
+    ),
+]
+
+
+@pytest.mark.parametrize("number,remote,local,stored,expected_action_factory", HANDLE_NODE_CASES)
 def test_handle_node(number, remote, local, stored, expected_action_factory):
     action = handle_node(remote, local, stored)
     expected_action = expected_action_factory(remote, local, stored)
     assert repr(action) == repr(expected_action)
+
+
+def test_checksums_of_another_hash_function(tmp_path):
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"content")
+    md5 = file_checksum(os.fspath(path), "md5")
+    blake2b = file_checksum(os.fspath(path), "blake2b")
+    stat = path.stat()
+    local = LocalNode(
+        root_folder=tmp_path, path="file.bin", modified_time=stat.st_mtime, created_time=stat.st_ctime,
+        size=stat.st_size, _checksum=md5,
+    )
+    remote = RemoteNode(key=local.key, path=local.path, checksum=blake2b, size=local.size)
+    changed = RemoteNode(key=local.key, path=local.path, checksum="blake2b:" + "0" * 32, size=local.size)
+    stored = StoredNode(
+        key=local.key, path=local.path, checksum=md5, local_modified_time=local.modified_time,
+        local_created_time=local.created_time, size=local.size, ready=True,
+    )
+
+    def decide(remote, local, stored):
+        return handle_node(remote, local, stored).name
+
+    assert decide(remote, local, None) == "save_stored"
+    assert decide(changed, local, None) == "conflict"
+    assert decide(remote, local, stored) == "save_stored"
+    assert decide(changed, local, stored) == "download"
+    assert decide(remote, local, StoredNode(**{**stored.__data__, "checksum": blake2b})) == "nop"
@@ -0,0 +1,21 @@
+import pytest
+
+from lansync.util.bitmap import Bitmap
+
+
+def test_bitmap_round_trip():
+    bitmap = Bitmap(11)
+    for i in (0, 7, 8, 10):
+        bitmap.add(i)
+
+    restored = Bitmap(11, bytes(bitmap))
+    assert [i for i in range(11) if i in restored] == [0, 7, 8, 10]
+    assert restored.count() == 4
+    assert not restored.full
+
+
+def test_bitmap_checks_size():
+    with pytest.raises(ValueError):
+        Bitmap(9, b"\0")
+    with pytest.raises(IndexError):
+        Bitmap(3).add(3)
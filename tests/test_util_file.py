@@ -0,0 +1,60 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from lansync.util.file import clone_file, copy_range, iter_folder, relative_path, walk_folder
+
+
+def test_walk_folder_matches_iter_folder(tmp_path):
+    for folder in ("a", "a/b", "a/b/c", "d"):
+        (tmp_path / folder).mkdir()
+        for i in range(3):
+            (tmp_path / folder / f"file{i}").write_bytes(b"x" * i)
+    (tmp_path / "top").write_bytes(b"top")
+
+    walked = {Path(path): stat.st_size for path, stat in walk_folder(tmp_path, max_workers=2)}
+
+    assert sorted(walked) == sorted(iter_folder(tmp_path))
+    assert all(walked[path] == path.stat().st_size for path in walked)
+
+
+def test_walk_empty_folder(tmp_path):
+    assert list(walk_folder(tmp_path)) == []
+
+
+def test_relative_path(tmp_path):
+    root = str(tmp_path)
+    path = tmp_path / "a" / "b.txt"
+    assert relative_path(str(path), root) == path.relative_to(tmp_path).as_posix()
+    with pytest.raises(ValueError):
+        relative_path(root + "x/b.txt", root)
+
+
+def test_copy_range_between_files(tmp_path, monkeypatch):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    data = os.urandom(3 * 4096 + 17)
+    src.write_bytes(data)
+    for copy_file_range in (True, False):
+        if not copy_file_range:
+            monkeypatch.delattr(os, "copy_file_range", raising=False)
+        dst.write_bytes(bytes(len(data)))
+        with open(src, "rb") as src_file, open(dst, "r+b") as dst_file:
+            copy_range(src_file.fileno(), dst_file.fileno(), 100, 4096, 5000)
+        assert dst.read_bytes() == bytes(4096) + data[100:5100] + bytes(len(data) - 9096)
+
+
+def test_copy_range_past_end_of_source(tmp_path):
+    (tmp_path / "src").write_bytes(b"short")
+    (tmp_path / "dst").write_bytes(b"")
+    with open(tmp_path / "src", "rb") as src_file, open(tmp_path / "dst", "r+b") as dst_file:
+        with pytest.raises(EOFError):
+            copy_range(src_file.fileno(), dst_file.fileno(), 0, 0, 100)
+
+
+def test_clone_file(tmp_path):
+    data = os.urandom(100000)
+    (tmp_path / "src").write_bytes(data)
+    (tmp_path / "dst").write_bytes(b"previous content that is longer than nothing")
+    clone_file(tmp_path / "src", tmp_path / "dst")
+    assert (tmp_path / "dst").read_bytes() == data
@@ -0,0 +1,38 @@
+import pytest
+
+from lansync.util.ignore import IgnoreRules, RootIgnoreRules
+
+
+@pytest.mark.parametrize("lines, path, is_dir, expected", [
+    (["*.tmp"], "a.tmp", False, True),
+    (["*.tmp"], "dir/sub/a.tmp", False, True),
+    (["*.tmp"], "a.tmpx", False, False),
+    (["/build"], "build", True, True),
+    (["/build"], "src/build", True, False),
+    (["cache/"], "cache", False, False),
+    (["cache/"], "cache/file", False, True),
+    (["docs/*.md"], "docs/a.md", False, True),
+    (["docs/*.md"], "docs/sub/a.md", False, False),
+    (["docs/**/*.md"], "docs/sub/a.md", False, True),
+    (["file?.txt"], "file1.txt", False, True),
+    (["file[0-9].txt"], "filex.txt", False, False),
+    (["# comment", "", "*.log"], "a.log", False, True),
+    (["*.log", "!keep.log"], "keep.log", False, False),
+    (["*.log", "!keep.log"], "other.log", False, True),
+    ([], "anything", False, False),
+])
+def test_ignored(lines, path, is_dir, expected):
+    assert IgnoreRules(lines).ignored(path, is_dir) is expected
+
+
+def test_rules_are_combined_without_negation():
+    assert IgnoreRules(["*.tmp", "build/"]).combined is not None
+    assert IgnoreRules(["*.tmp", "!a.tmp"]).combined is None
+
+
+def test_root_rules_reload_on_change(tmp_path):
+    rules = RootIgnoreRules(tmp_path, ".lansyncignore")
+    assert not rules.current().ignored("a.tmp")
+
+    (tmp_path / ".lansyncignore").write_text("*.tmp\n")
+    assert rules.current().ignored("a.tmp")
@@ -0,0 +1,23 @@
+import pytest
+
+from lansync.util.interval import AdaptiveInterval
+
+
+def test_backs_off_when_idle_and_snaps_back():
+    interval = AdaptiveInterval(1, 10, factor=2, max_share=1)
+    assert [interval.record_cycle(0, found_work=False) for _ in range(5)] == [2, 4, 8, 10, 10]
+    assert interval.reason == "idle, max interval"
+
+    assert interval.reset("local change") == 1
+    assert interval.reason == "local change"
+    assert interval.record_cycle(0, found_work=False) == 2
+
+    assert interval.record_cycle(0, found_work=True) == 1
+    assert interval.reason == "work"
+
+
+def test_caps_the_cpu_share_of_cycles():
+    interval = AdaptiveInterval(1, 10, max_share=0.25)
+    assert interval.record_cycle(2, found_work=True) == pytest.approx(6)
+    assert interval.reason == "cpu share"
+    assert interval.record_cycle(0.1, found_work=True) == 1
@@ -0,0 +1,99 @@
+import os
+from queue import Queue, Empty
+
+import pytest
+
+from lansync.util import inotify
+from lansync.watcher import FolderWatcher
+
+
+pytestmark = pytest.mark.skipif(not FolderWatcher.available(), reason="inotify is not available")
+
+
+def collect(queue, timeout=0.5):
+    items = set()
+    try:
+        while True:
+            items.add(queue.get(timeout=timeout))
+    except Empty:
+        return items
+
+
+@pytest.fixture
+def watcher(tmp_path):
+    changes = Queue()
+    overflows = Queue()
+    watcher = FolderWatcher(os.fspath(tmp_path), changes.put, lambda: overflows.put(True))
+    watcher.start()
+    yield watcher, changes, overflows
+    watcher.stop()
+
+
+def test_watcher_reports_file_changes(tmp_path, watcher):
+    _, changes, overflows = watcher
+    (tmp_path / "a").write_bytes(b"a")
+    assert collect(changes) == {"a"}
+
+    (tmp_path / "a").unlink()
+    assert collect(changes) == {"a"}
+    assert overflows.empty()
+
+
+def test_watcher_follows_new_folders(tmp_path, watcher):
+    _, changes, _ = watcher
+    (tmp_path / "dir").mkdir()
+    assert collect(changes) == {"dir"}
+
+    (tmp_path / "dir" / "b").write_bytes(b"b")
+    assert collect(changes) == {"dir/b"}
+
+
+def test_watcher_follows_renamed_folders(tmp_path, watcher):
+    _, changes, _ = watcher
+    (tmp_path / "dir" / "sub").mkdir(parents=True)
+    collect(changes)
+
+    (tmp_path / "dir").rename(tmp_path / "renamed")
+    assert collect(changes) == {"dir", "renamed"}
+    (tmp_path / "renamed" / "sub" / "b").write_bytes(b"b")
+    assert collect(changes) == {"renamed/sub/b"}
+
+
+def test_watcher_forgets_folders_moved_out(tmp_path, watcher):
+    _, changes, _ = watcher
+    (tmp_path / "dir").mkdir()
+    collect(changes)
+
+    outside = tmp_path.parent / f"{tmp_path.name}-outside"
+    (tmp_path / "dir").rename(outside)
+    try:
+        assert collect(changes) == {"dir"}
+        (outside / "b").write_bytes(b"b")
+        assert collect(changes) == set()
+    finally:
+        (outside / "b").unlink()
+        outside.rmdir()
+
+
+def test_stop_wakes_the_reader(tmp_path):
+    watcher = FolderWatcher(os.fspath(tmp_path), lambda path: None, lambda: None)
+    watcher.start()
+    notifier = watcher.inotify
+    watcher.stop()
+    watcher.thread.join(timeout=5)
+    assert not watcher.thread.is_alive()
+    assert notifier.closed
+
+
+def test_events_after_stop_do_not_kill_the_reader(tmp_path):
+    overflows = []
+    watcher = FolderWatcher(os.fspath(tmp_path), lambda path: None, lambda: overflows.append(True))
+    watcher.start()
+    notifier = watcher.inotify
+    watcher.stop()
+    watcher.thread.join(timeout=5)
+
+    (tmp_path / "dir").mkdir()
+    root_wd = next(iter(watcher.folders))
+    watcher.handle_event(notifier, inotify.InotifyEvent(root_wd, inotify.IN_CREATE | inotify.IN_ISDIR, 0, "dir"))
+    assert overflows == [True]